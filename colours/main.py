@@ -82,27 +82,82 @@ class ColorChart(tk.Frame):
 
     MAX_ROWS = 36
     FONT_SIZE = 10
+    CELL_WIDTH = 150
 
     def __init__(self, root):
         tk.Frame.__init__(self, root)
-        r = 0
-        c = 0
+        self.font = ("Times", self.FONT_SIZE, "bold")
+        self.cell_height = self.FONT_SIZE * 2 + 2
+        self.shown = COLORS
+        self.columns = {}
 
-        for color in COLORS:
-            label = tk.Label(self, text=color, bg=color,
-                             font=("Times", self.FONT_SIZE, "bold"))
-            label.grid(row=r, column=c, sticky="ew")
-            r += 1
+        # Typing filters the chart by name
+        self.search = tk.StringVar(self)
+        self.search.trace_add("write", lambda *args: self.set_filter(self.search.get()))
+        tk.Entry(self, textvariable=self.search).pack(fill="x")
 
-            if r > self.MAX_ROWS:
-                r = 0
-                c += 1
+        # One canvas for the whole chart, only the columns in view have items
+        scrollbar = tk.Scrollbar(self, orient="horizontal", command=self.scroll_x)
+        scrollbar.pack(side="bottom", fill="x")
+        self.canvas = tk.Canvas(self, bg="white", highlightthickness=0,
+                                height=(self.MAX_ROWS + 1) * self.cell_height,
+                                width=6 * self.CELL_WIDTH,
+                                xscrollincrement=self.CELL_WIDTH,
+                                xscrollcommand=scrollbar.set)
+        self.canvas.pack(expand=1, fill="both")
+        self.canvas.bind("<Configure>", lambda event: self.render())
 
+        self.update_scroll_region()
         self.pack(expand=1, fill="both")
 
+    def set_filter(self, text):
+        text = text.strip().lower()
+        self.shown = [color for color in COLORS if text in color] if text else COLORS
+        for items in self.columns.values():
+            self.canvas.delete(*items)
+
+        self.columns.clear()
+        self.update_scroll_region()
+        self.canvas.xview_moveto(0)
+        self.render()
+
+    def update_scroll_region(self):
+        columns = -(-len(self.shown) // (self.MAX_ROWS + 1))
+        self.canvas.config(scrollregion=(0, 0, max(1, columns * self.CELL_WIDTH), 0))
+
+    def render(self):
+        # Work out which columns intersect the visible part of the canvas
+        left = int(self.canvas.canvasx(0))
+        first = max(0, left // self.CELL_WIDTH)
+        last = (left + self.canvas.winfo_width()) // self.CELL_WIDTH + 1
+        visible = range(first, last)
+
+        for column in [c for c in self.columns if c not in visible]:
+            self.canvas.delete(*self.columns.pop(column))
+
+        for column in visible:
+            if column not in self.columns:
+                self.columns[column] = self.create_column(column)
+
+    def create_column(self, column):
+        items = []
+        rows = self.MAX_ROWS + 1
+        x = column * self.CELL_WIDTH
+        for r, color in enumerate(self.shown[column * rows:(column + 1) * rows]):
+            y = r * self.cell_height
+            items.append(self.canvas.create_rectangle(x, y, x + self.CELL_WIDTH, y + self.cell_height,
+                                                      fill=color, outline=""))
+            items.append(self.canvas.create_text(x + self.CELL_WIDTH // 2, y + self.cell_height // 2,
+                                                 text=color, font=self.font))
+        return items
+
+    def scroll_x(self, *args):
+        self.canvas.xview(*args)
+        self.render()
+
 
 if __name__ == '__main__':
     root = tk.Tk()
     root.title("Named Color Chart")
     app = ColorChart(root)
-    root.mainloop()
\ No newline at end of file
+    root.mainloop()
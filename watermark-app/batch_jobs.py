@@ -0,0 +1,61 @@
+import os
+from typing import Optional
+
+from image_exporter import ExportOptions
+from result_cache import ResultCache
+from watermark_engine import WatermarkSettings, watermark_file
+from watermark_profile import prepare_profile
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+# Per worker process state, set once by the pool initializer so the
+# settings aren't pickled for every file. Fonts and rendered text are
+# kept in each worker's glyph cache.
+_worker_settings: Optional[WatermarkSettings] = None
+_worker_options = ExportOptions()
+_worker_cache: Optional[ResultCache] = None
+
+
+def find_image_files(input_dir: str, recursive: bool=True) -> list[str]:
+  files = []
+  for dir_path, dir_names, file_names in os.walk(input_dir):
+    if not recursive:
+      dir_names.clear()
+
+    dir_names.sort()
+    files.extend(os.path.join(dir_path, name) for name in sorted(file_names) if name.lower().endswith(IMAGE_EXTENSIONS))
+
+  return files
+
+
+def find_images(input_dir: str, output_dir: str, recursive: bool=True) -> list[tuple[str, str]]:
+  # Each image goes to the same relative path under the output directory
+  return [(input_file, os.path.join(output_dir, os.path.relpath(input_file, input_dir)))
+          for input_file in find_image_files(input_dir, recursive)]
+
+
+def init_worker(settings: WatermarkSettings, options: ExportOptions, cache_file: Optional[str]=None) -> None:
+  global _worker_settings, _worker_options, _worker_cache
+  _worker_settings = prepare_profile(settings)
+  _worker_options = options
+
+  # Each worker has its own connection to the shared result cache
+  if cache_file is not None:
+    _worker_cache = ResultCache(cache_file)
+
+
+def process_job(job: tuple[str, str]) -> tuple[str, str, Optional[str], bool]:
+  # The last item is True when the output was up to date in the result cache
+  input_file, output_file = job
+  try:
+    output_dir = os.path.dirname(output_file)
+    if output_dir:
+      os.makedirs(output_dir, exist_ok=True)
+
+    processed = watermark_file(input_file, output_file, _worker_settings, _worker_options, _worker_cache)
+
+  except Exception as e:
+    # Report the failure back to the parent instead of killing the batch
+    return (input_file, output_file, f'{type(e).__name__}: {e}', False)
+
+  return (input_file, output_file, None, not processed)
@@ -0,0 +1,153 @@
+import argparse
+import csv
+import dataclasses
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
+from batch_jobs import find_images, init_worker, process_job
+from image_exporter import ExportOptions
+from result_cache import ResultCache, get_default_cache_file
+from watermark_engine import BLEND_MODES, PLACEMENTS, SIZE_REFERENCES, WATERMARK_MODES, WatermarkSettings
+from watermark_profile import load_profile
+
+
+def read_manifest(manifest_file: str, output_dir: str) -> list[tuple[str, str]]:
+  # Each row is an input file with an optional output file
+  jobs = []
+  with open(manifest_file, newline='') as f:
+    for row in csv.reader(f):
+      if not row or not row[0].strip() or row[0].startswith('#'):
+        continue
+
+      input_file = row[0].strip()
+      if len(row) > 1 and row[1].strip():
+        output_file = row[1].strip()
+      else:
+        output_file = os.path.join(output_dir, os.path.basename(input_file))
+
+      jobs.append((input_file, output_file))
+
+  return jobs
+
+
+def run_batch(jobs: list[tuple[str, str]], settings: WatermarkSettings, workers: Optional[int]=None,
+              chunksize: int=8, options: ExportOptions=ExportOptions(), verbose: bool=False,
+              cache_file: Optional[str]=None) -> tuple[list[tuple[str, str, str]], int]:
+  # Returns the failures and how many files were skipped as unchanged
+  errors = []
+  cached = 0
+  with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(settings, options, cache_file)) as executor:
+    for input_file, output_file, error, unchanged in executor.map(process_job, jobs, chunksize=max(1, chunksize)):
+      if error is not None:
+        errors.append((input_file, output_file, error))
+        print(f'FAILED {input_file}: {error}', file=sys.stderr)
+        continue
+
+      cached += unchanged
+      if verbose:
+        print(f'{input_file} -> {output_file}{" (unchanged)" if unchanged else ""}')
+
+  return errors, cached
+
+
+def _parse_args(argv: Optional[list[str]]=None) -> argparse.Namespace:
+  parser = argparse.ArgumentParser(description='Watermark a directory or manifest of images without the GUI')
+  parser.add_argument('input', nargs='?', help='directory of images to watermark')
+  parser.add_argument('-m', '--manifest', help='CSV file of "input[,output]" rows to watermark')
+  parser.add_argument('-o', '--output', required=True, help='directory to write the watermarked images to')
+  parser.add_argument('--no-recursive', action='store_true', help='don\'t descend into sub directories')
+  parser.add_argument('-p', '--profile', help='JSON watermark profile, the options below override it')
+  parser.add_argument('-t', '--text', help='watermark text (default @copyright)')
+  parser.add_argument('-f', '--font', help='path of the TrueType/OpenType font file to use')
+  parser.add_argument('-s', '--size', type=int, help='font size in pixels (default 20)')
+  parser.add_argument('--relative-size', type=float, help='font size as a percentage of the image, instead of --size')
+  parser.add_argument('--size-reference', choices=SIZE_REFERENCES,
+                      help='what relative sizes are a percentage of (default width)')
+  parser.add_argument('-c', '--colour', help='text colour name or #RRGGBB (default black)')
+  parser.add_argument('--opacity', type=float, help='watermark opacity from 0 to 1 (default 1)')
+  parser.add_argument('--blend', choices=BLEND_MODES, help='blend mode (default normal)')
+  parser.add_argument('--mode', choices=WATERMARK_MODES, help='one stamp or a repeating pattern (default single)')
+  parser.add_argument('--placement', choices=PLACEMENTS, help='where the single stamp goes (default bottom-right)')
+  parser.add_argument('--angle', type=float, help='pattern text angle in degrees (default 30)')
+  parser.add_argument('--spacing', type=int, help='gap between pattern repeats in pixels (default 100)')
+  parser.add_argument('--margin', type=int, help='margin from the edges in pixels (default 10)')
+  parser.add_argument('--relative-margin', type=float, help='margin as a percentage of the image, instead of --margin')
+  parser.add_argument('-q', '--quality', type=int, default=90, help='JPEG and WebP quality')
+  parser.add_argument('--no-optimize', action='store_true', help='skip the extra encoder optimisation pass')
+  parser.add_argument('--no-progressive', action='store_true', help='write baseline instead of progressive JPEGs')
+  parser.add_argument('--strip-metadata', action='store_true', help='don\'t copy EXIF and ICC profiles to the output')
+  parser.add_argument('--cache', default=get_default_cache_file(), help='result cache used to skip unchanged images')
+  parser.add_argument('--no-cache', action='store_true', help='watermark every image even if it is unchanged')
+  parser.add_argument('--prune-days', type=float, default=30.0, help='forget cached results unused for this many days')
+  parser.add_argument('--prune-size', type=int, help='forget the oldest cached results over this many megabytes of output')
+  parser.add_argument('-w', '--workers', type=int, default=os.cpu_count(), help='number of worker processes')
+  parser.add_argument('--chunksize', type=int, default=8, help='number of files sent to a worker at a time')
+  parser.add_argument('-v', '--verbose', action='store_true', help='print every processed file')
+
+  args = parser.parse_args(argv)
+  if (args.input is None) == (args.manifest is None):
+    parser.error('give either an input directory or --manifest')
+
+  return args
+
+
+def get_settings(args: argparse.Namespace) -> WatermarkSettings:
+  # Start from the profile, or the defaults, and apply the options that were given
+  settings = load_profile(args.profile) if args.profile else WatermarkSettings()
+  overrides = {
+    'text': args.text,
+    'font_file': args.font,
+    'font_size': args.size,
+    'relative_size': args.relative_size,
+    'size_reference': args.size_reference,
+    'colour': args.colour,
+    'opacity': args.opacity,
+    'blend_mode': args.blend,
+    'mode': args.mode,
+    'placement': args.placement,
+    'angle': args.angle,
+    'spacing': args.spacing,
+    'margin': args.margin,
+    'relative_margin': args.relative_margin
+  }
+
+  return dataclasses.replace(settings, **{name: value for name, value in overrides.items() if value is not None})
+
+
+def main(argv: Optional[list[str]]=None) -> int:
+  args = _parse_args(argv)
+
+  # Collect the files to process
+  if args.manifest:
+    jobs = read_manifest(args.manifest, args.output)
+  else:
+    jobs = find_images(args.input, args.output, not args.no_recursive)
+
+  settings = get_settings(args)
+
+  options = ExportOptions(
+    quality=args.quality,
+    optimize=not args.no_optimize,
+    progressive=not args.no_progressive,
+    keep_exif=not args.strip_metadata,
+    keep_icc=not args.strip_metadata)
+
+  cache_file = None if args.no_cache else args.cache
+  start_time = time.perf_counter()
+  errors, cached = run_batch(jobs, settings, args.workers, args.chunksize, options, args.verbose, cache_file)
+  elapsed = time.perf_counter() - start_time
+
+  if cache_file is not None:
+    cache = ResultCache(cache_file)
+    cache.prune(args.prune_days * 24 * 60 * 60, None if args.prune_size is None else args.prune_size * 1024 * 1024)
+    cache.close()
+
+  print(f'Processed {len(jobs)} images ({cached} unchanged) in {elapsed:.2f}s with {len(errors)} failures', file=sys.stderr)
+  return 1 if errors else 0
+
+
+if __name__ == '__main__':
+  sys.exit(main())
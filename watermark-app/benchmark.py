@@ -0,0 +1,331 @@
+import argparse
+import dataclasses
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import tkinter as tk
+from collections.abc import Callable
+from typing import Optional
+
+import PIL
+from PIL import Image
+
+from edit_pipeline import WatermarkOperation
+from font_index import FontIndex
+from image_container import ZOOM_STEP, ImageContainer
+from image_loader import ImageLoader
+from image_store import image_store
+from watermark_engine import WatermarkSettings
+import tiled_view
+
+DEFAULT_SIZES = (1, 10, 50, 200)
+DEFAULT_SCALES = (0.1, 0.25, 0.5, 1.0)
+
+
+# HEADLESS STAND INS
+class _FakeCanvas:
+  # Just enough of tk.Canvas for ImageContainer and TiledRenderer
+  def __init__(self, width: int=1280, height: int=800):
+    self._width = width
+    self._height = height
+    self._next_item = 0
+
+  def canvasx(self, x: float) -> float:
+    return x
+
+  def canvasy(self, y: float) -> float:
+    return y
+
+  def winfo_width(self) -> int:
+    return self._width
+
+  def winfo_height(self) -> int:
+    return self._height
+
+  def create_image(self, *args, **kwargs) -> int:
+    self._next_item += 1
+    return self._next_item
+
+  def coords(self, *args) -> None:
+    pass
+
+  def itemconfig(self, *args, **kwargs) -> None:
+    pass
+
+  def delete(self, *args) -> None:
+    pass
+
+  def config(self, **kwargs) -> None:
+    pass
+
+  def xview_moveto(self, fraction: float) -> None:
+    pass
+
+  def yview_moveto(self, fraction: float) -> None:
+    pass
+
+
+class _FakePhotoImage:
+  # Copies the pixels out, standing in for the upload to Tk
+  def __init__(self, img: Image.Image):
+    img.tobytes()
+    self.size = img.size
+
+  def paste(self, img: Image.Image) -> None:
+    img.tobytes()
+
+  def width(self) -> int:
+    return self.size[0]
+
+  def height(self) -> int:
+    return self.size[1]
+
+
+def create_container(headless: bool) -> tuple[ImageContainer, Optional[tk.Tk]]:
+  if not headless:
+    root = tk.Tk()
+    root.geometry('1280x800')
+    container = ImageContainer(root)
+    container.pack(expand=True, fill=tk.BOTH)
+    root.update()
+    return container, root
+
+  # Build the container without a Tk interpreter and run its real methods
+  tiled_view.ImageTk.PhotoImage = _FakePhotoImage
+  container = ImageContainer.__new__(ImageContainer)
+  container._canvas = _FakeCanvas()
+  container._renderer = tiled_view.TiledRenderer(container._canvas)
+  container._loader = ImageLoader(container._canvas, container._show_load_preview, container._image_loaded, container._load_failed)
+  container._pyramid_budget = 256 * 1024 * 1024
+  container._store = image_store
+
+  # Nothing runs the event loop, so the refine after a zoom is never scheduled
+  container.after = lambda ms, func: None
+  container.after_cancel = lambda after_id: None
+  return container, None
+
+
+def recreate_tiles(container: ImageContainer, img: Image.Image) -> None:
+  # The display path before tiles were repainted in place: every frame cleared
+  # the canvas and uploaded each visible tile as a new photo image
+  canvas, renderer = container._canvas, container._renderer
+  canvas.delete('all')
+  renderer._img = img
+  renderer._items.clear()
+  renderer._spare_items.clear()
+
+  scaled_width, scaled_height = renderer.get_scaled_size()
+  tile_size = renderer._tile_size
+  for ty in range(-(-min(scaled_height, canvas.winfo_height()) // tile_size)):
+    for tx in range(-(-min(scaled_width, canvas.winfo_width()) // tile_size)):
+      tk_tile = tiled_view.ImageTk.PhotoImage(renderer._render_tile(tx, ty, scaled_width, scaled_height))
+      item = canvas.create_image(tx * tile_size, ty * tile_size, anchor=tk.NW, image=tk_tile)
+      renderer._items[(tx, ty)] = (item, tk_tile)
+
+
+def create_image(megapixels: float) -> Image.Image:
+  # A smooth gradient with noise, so the encoders have realistic work to do
+  width = int((megapixels * 1_000_000 * 4 / 3) ** 0.5)
+  height = int(width * 3 / 4)
+  gradient = Image.linear_gradient('L').resize((width, height))
+  noise = Image.effect_noise((width, height), 32)
+  return Image.merge('RGB', (gradient, noise, gradient.transpose(Image.Transpose.FLIP_LEFT_RIGHT)))
+
+
+def time_call(func: Callable[[], None], repeat: int, setup: Optional[Callable[[], None]]=None) -> list[float]:
+  times = []
+  for _ in range(repeat):
+    if setup is not None:
+      setup()
+
+    start = time.perf_counter()
+    func()
+    times.append(time.perf_counter() - start)
+
+  return times
+
+
+def summarise(name: str, megapixels: Optional[float], times: list[float]) -> dict:
+  return {
+    'name': name,
+    'megapixels': megapixels,
+    'times': times,
+    'min': min(times),
+    'median': statistics.median(times),
+    'mean': statistics.fmean(times)
+  }
+
+
+def run_benchmarks(sizes: list[float], scales: list[float], repeat: int, headless: bool) -> list[dict]:
+  results = []
+
+  # Font index, cold and from the on disk cache
+  with tempfile.TemporaryDirectory() as cache_dir:
+    cache_file = os.path.join(cache_dir, 'font_index.json')
+    results.append(summarise('font_index_cold', None, time_call(
+      lambda: FontIndex(cache_file=cache_file), repeat, lambda: os.path.exists(cache_file) and os.remove(cache_file))))
+    results.append(summarise('font_index_cached', None, time_call(lambda: FontIndex(cache_file=cache_file), repeat)))
+
+  container, root = create_container(headless)
+  if root is not None:
+    from system_fonts import SystemFonts
+    results.append(summarise('system_fonts', None, time_call(lambda: SystemFonts(root), repeat)))
+
+  font_index = FontIndex()
+  font_file = font_index.get_font_path(next(iter(font_index.get_families()), ''))
+  settings = WatermarkSettings('@copyright', font_file, 48, 'white')
+
+  with tempfile.TemporaryDirectory() as temp_dir:
+    for megapixels in sizes:
+      filename = os.path.join(temp_dir, f'{megapixels}mp.jpg')
+      create_image(megapixels).save(filename, quality=90)
+      print(f'{megapixels} MP', file=sys.stderr)
+
+      # Decode and hand the image to the container, as the loader thread and after() callback do
+      def load() -> None:
+        with Image.open(filename) as img:
+          img.load()
+          container._image_loaded(img.copy())
+
+      results.append(summarise('load_image', megapixels, time_call(load, repeat)))
+
+      # Forget the displayed image so its tiles are rebuilt on the next show
+      def load_cold() -> None:
+        load()
+        container._display_img = None
+
+      for scale in scales:
+        def show(scale=scale) -> None:
+          container._scale_factor = scale
+          container._show_image()
+
+        results.append(summarise(f'show_image@{scale}', megapixels, time_call(show, repeat, load_cold)))
+
+      # Live preview frames while the watermark text is typed, the display size doesn't change
+      for scale in scales:
+        frames = iter(range(1_000_000))
+
+        def preview_frame() -> None:
+          container.preview_watermark(dataclasses.replace(settings, text=f'@copyright {next(frames)}'))
+          container._render_preview()
+
+        # The first frame after the image is shown is set up, the next one is timed
+        def show_preview(scale=scale) -> None:
+          load()
+          container._scale_factor = scale
+          container._show_image()
+          preview_frame()
+
+        results.append(summarise(f'preview_frame@{scale}', megapixels, time_call(preview_frame, repeat, show_preview)))
+
+        # The same frame drawn the old way, watermarked from scratch and every tile recreated
+        def preview_frame_recreate() -> None:
+          operation = WatermarkOperation(dataclasses.replace(settings, text=f'@copyright {next(frames)}'))
+          base = container._pipeline.render(container._display_scale)
+          recreate_tiles(container, operation.apply(base, container._display_scale))
+
+        results.append(summarise(
+          f'preview_frame_recreate@{scale}', megapixels, time_call(preview_frame_recreate, repeat, show_preview)))
+        in_place, recreated = results[-2]['median'], results[-1]['median']
+        print(f'  preview frame @{scale}: {in_place * 1000:.2f} ms in place, {recreated * 1000:.2f} ms recreated', file=sys.stderr)
+
+      def rotate() -> None:
+        container.rotate_image(90)
+
+      def watermark() -> None:
+        container.add_watermark(settings)
+
+      def reset() -> None:
+        load()
+        container._scale_factor = 1.0
+
+      # One wheel notch out, only the draft frame, the refine costs the same as show_image
+      def wheel_zoom() -> None:
+        container.zoom(container._scale_factor / ZOOM_STEP)
+
+      results.append(summarise('wheel_zoom', megapixels, time_call(wheel_zoom, repeat, reset)))
+      results.append(summarise('rotate_image', megapixels, time_call(rotate, repeat, reset)))
+      results.append(summarise('add_watermark', megapixels, time_call(watermark, repeat, reset)))
+
+      if root is not None:
+        root.update()
+
+  if root is not None:
+    root.destroy()
+
+  return results
+
+
+def compare(results: list[dict], baseline_file: str, threshold: float) -> list[str]:
+  # Flag anything whose median got slower than the threshold allows
+  with open(baseline_file) as f:
+    baseline = {(r['name'], r['megapixels']): r for r in json.load(f)['results']}
+
+  regressions = []
+  for result in results:
+    previous = baseline.get((result['name'], result['megapixels']))
+    if previous is not None and result['median'] > previous['median'] * (1 + threshold):
+      regressions.append(
+        f"{result['name']} {result['megapixels']} MP: {previous['median']:.4f}s -> {result['median']:.4f}s")
+
+  return regressions
+
+
+def _parse_args(argv: Optional[list[str]]=None) -> argparse.Namespace:
+  parser = argparse.ArgumentParser(description='Benchmark the load, scale, watermark and display paths')
+  parser.add_argument('--sizes', default=','.join(map(str, DEFAULT_SIZES)), help='comma separated image sizes in megapixels')
+  parser.add_argument('--scales', default=','.join(map(str, DEFAULT_SCALES)), help='comma separated display scale factors')
+  parser.add_argument('-r', '--repeat', type=int, default=3, help='runs per benchmark')
+  parser.add_argument('-o', '--output', help='write the JSON results to this file instead of stdout')
+  parser.add_argument('--headless', action='store_true', help='stub out Tk even if a display is available')
+  parser.add_argument('--compare', help='baseline JSON results to check for regressions')
+  parser.add_argument('--threshold', type=float, default=0.1, help='allowed slowdown before a regression is reported')
+  return parser.parse_args(argv)
+
+
+def main(argv: Optional[list[str]]=None) -> int:
+  args = _parse_args(argv)
+
+  # Fall back to the stubbed Tk when there is no display, e.g. on CI without Xvfb
+  headless = args.headless
+  if not headless:
+    try:
+      tk.Tk().destroy()
+    except tk.TclError:
+      headless = True
+
+  sizes = [float(s) for s in args.sizes.split(',')]
+  scales = [float(s) for s in args.scales.split(',')]
+  results = run_benchmarks(sizes, scales, args.repeat, headless)
+
+  report = {
+    'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    'python': platform.python_version(),
+    'pillow': PIL.__version__,
+    'platform': platform.platform(),
+    'headless': headless,
+    'results': results
+  }
+
+  if args.output:
+    with open(args.output, 'w') as f:
+      json.dump(report, f, indent=2)
+  else:
+    json.dump(report, sys.stdout, indent=2)
+
+  if args.compare:
+    regressions = compare(results, args.compare, args.threshold)
+    for regression in regressions:
+      print(f'REGRESSION {regression}', file=sys.stderr)
+
+    return 1 if regressions else 0
+
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(main())
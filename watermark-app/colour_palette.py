@@ -0,0 +1,312 @@
+import colorsys
+import tkinter as tk
+from tkinter import ttk
+from collections.abc import Callable
+from typing import Optional
+
+# The Tk colour names, the same list as the colours prototype chart
+COLOUR_NAMES = (
+  'snow', 'ghost white', 'white smoke', 'gainsboro', 'floral white', 'old lace', 'linen', 'antique white',
+  'papaya whip', 'blanched almond', 'bisque', 'peach puff', 'navajo white', 'lemon chiffon', 'mint cream',
+  'azure', 'alice blue', 'lavender', 'lavender blush', 'misty rose', 'dark slate gray', 'dim gray',
+  'slate gray', 'light slate gray', 'gray', 'light grey', 'midnight blue', 'navy', 'cornflower blue',
+  'dark slate blue', 'slate blue', 'medium slate blue', 'light slate blue', 'medium blue', 'royal blue',
+  'blue', 'dodger blue', 'deep sky blue', 'sky blue', 'light sky blue', 'steel blue', 'light steel blue',
+  'light blue', 'powder blue', 'pale turquoise', 'dark turquoise', 'medium turquoise', 'turquoise', 'cyan',
+  'light cyan', 'cadet blue', 'medium aquamarine', 'aquamarine', 'dark green', 'dark olive green',
+  'dark sea green', 'sea green', 'medium sea green', 'light sea green', 'pale green', 'spring green',
+  'lawn green', 'medium spring green', 'green yellow', 'lime green', 'yellow green', 'forest green',
+  'olive drab', 'dark khaki', 'khaki', 'pale goldenrod', 'light goldenrod yellow', 'light yellow', 'yellow',
+  'gold', 'light goldenrod', 'goldenrod', 'dark goldenrod', 'rosy brown', 'indian red', 'saddle brown',
+  'sandy brown', 'dark salmon', 'salmon', 'light salmon', 'orange', 'dark orange', 'coral', 'light coral',
+  'tomato', 'orange red', 'red', 'hot pink', 'deep pink', 'pink', 'light pink', 'pale violet red', 'maroon',
+  'medium violet red', 'violet red', 'medium orchid', 'dark orchid', 'dark violet', 'blue violet', 'purple',
+  'medium purple', 'thistle', 'snow2', 'snow3', 'snow4', 'seashell2', 'seashell3', 'seashell4',
+  'AntiqueWhite1', 'AntiqueWhite2', 'AntiqueWhite3', 'AntiqueWhite4', 'bisque2', 'bisque3', 'bisque4',
+  'PeachPuff2', 'PeachPuff3', 'PeachPuff4', 'NavajoWhite2', 'NavajoWhite3', 'NavajoWhite4', 'LemonChiffon2',
+  'LemonChiffon3', 'LemonChiffon4', 'cornsilk2', 'cornsilk3', 'cornsilk4', 'ivory2', 'ivory3', 'ivory4',
+  'honeydew2', 'honeydew3', 'honeydew4', 'LavenderBlush2', 'LavenderBlush3', 'LavenderBlush4', 'MistyRose2',
+  'MistyRose3', 'MistyRose4', 'azure2', 'azure3', 'azure4', 'SlateBlue1', 'SlateBlue2', 'SlateBlue3',
+  'SlateBlue4', 'RoyalBlue1', 'RoyalBlue2', 'RoyalBlue3', 'RoyalBlue4', 'blue2', 'blue4', 'DodgerBlue2',
+  'DodgerBlue3', 'DodgerBlue4', 'SteelBlue1', 'SteelBlue2', 'SteelBlue3', 'SteelBlue4', 'DeepSkyBlue2',
+  'DeepSkyBlue3', 'DeepSkyBlue4', 'SkyBlue1', 'SkyBlue2', 'SkyBlue3', 'SkyBlue4', 'LightSkyBlue1',
+  'LightSkyBlue2', 'LightSkyBlue3', 'LightSkyBlue4', 'SlateGray1', 'SlateGray2', 'SlateGray3', 'SlateGray4',
+  'LightSteelBlue1', 'LightSteelBlue2', 'LightSteelBlue3', 'LightSteelBlue4', 'LightBlue1', 'LightBlue2',
+  'LightBlue3', 'LightBlue4', 'LightCyan2', 'LightCyan3', 'LightCyan4', 'PaleTurquoise1', 'PaleTurquoise2',
+  'PaleTurquoise3', 'PaleTurquoise4', 'CadetBlue1', 'CadetBlue2', 'CadetBlue3', 'CadetBlue4', 'turquoise1',
+  'turquoise2', 'turquoise3', 'turquoise4', 'cyan2', 'cyan3', 'cyan4', 'DarkSlateGray1', 'DarkSlateGray2',
+  'DarkSlateGray3', 'DarkSlateGray4', 'aquamarine2', 'aquamarine4', 'DarkSeaGreen1', 'DarkSeaGreen2',
+  'DarkSeaGreen3', 'DarkSeaGreen4', 'SeaGreen1', 'SeaGreen2', 'SeaGreen3', 'PaleGreen1', 'PaleGreen2',
+  'PaleGreen3', 'PaleGreen4', 'SpringGreen2', 'SpringGreen3', 'SpringGreen4', 'green2', 'green3', 'green4',
+  'chartreuse2', 'chartreuse3', 'chartreuse4', 'OliveDrab1', 'OliveDrab2', 'OliveDrab4', 'DarkOliveGreen1',
+  'DarkOliveGreen2', 'DarkOliveGreen3', 'DarkOliveGreen4', 'khaki1', 'khaki2', 'khaki3', 'khaki4',
+  'LightGoldenrod1', 'LightGoldenrod2', 'LightGoldenrod3', 'LightGoldenrod4', 'LightYellow2', 'LightYellow3',
+  'LightYellow4', 'yellow2', 'yellow3', 'yellow4', 'gold2', 'gold3', 'gold4', 'goldenrod1', 'goldenrod2',
+  'goldenrod3', 'goldenrod4', 'DarkGoldenrod1', 'DarkGoldenrod2', 'DarkGoldenrod3', 'DarkGoldenrod4',
+  'RosyBrown1', 'RosyBrown2', 'RosyBrown3', 'RosyBrown4', 'IndianRed1', 'IndianRed2', 'IndianRed3',
+  'IndianRed4', 'sienna1', 'sienna2', 'sienna3', 'sienna4', 'burlywood1', 'burlywood2', 'burlywood3',
+  'burlywood4', 'wheat1', 'wheat2', 'wheat3', 'wheat4', 'tan1', 'tan2', 'tan4', 'chocolate1', 'chocolate2',
+  'chocolate3', 'firebrick1', 'firebrick2', 'firebrick3', 'firebrick4', 'brown1', 'brown2', 'brown3', 'brown4',
+  'salmon1', 'salmon2', 'salmon3', 'salmon4', 'LightSalmon2', 'LightSalmon3', 'LightSalmon4', 'orange2',
+  'orange3', 'orange4', 'DarkOrange1', 'DarkOrange2', 'DarkOrange3', 'DarkOrange4', 'coral1', 'coral2',
+  'coral3', 'coral4', 'tomato2', 'tomato3', 'tomato4', 'OrangeRed2', 'OrangeRed3', 'OrangeRed4', 'red2',
+  'red3', 'red4', 'DeepPink2', 'DeepPink3', 'DeepPink4', 'HotPink1', 'HotPink2', 'HotPink3', 'HotPink4',
+  'pink1', 'pink2', 'pink3', 'pink4', 'LightPink1', 'LightPink2', 'LightPink3', 'LightPink4', 'PaleVioletRed1',
+  'PaleVioletRed2', 'PaleVioletRed3', 'PaleVioletRed4', 'maroon1', 'maroon2', 'maroon3', 'maroon4',
+  'VioletRed1', 'VioletRed2', 'VioletRed3', 'VioletRed4', 'magenta2', 'magenta3', 'magenta4', 'orchid1',
+  'orchid2', 'orchid3', 'orchid4', 'plum1', 'plum2', 'plum3', 'plum4', 'MediumOrchid1', 'MediumOrchid2',
+  'MediumOrchid3', 'MediumOrchid4', 'DarkOrchid1', 'DarkOrchid2', 'DarkOrchid3', 'DarkOrchid4', 'purple1',
+  'purple2', 'purple3', 'purple4', 'MediumPurple1', 'MediumPurple2', 'MediumPurple3', 'MediumPurple4',
+  'thistle1', 'thistle2', 'thistle3', 'thistle4', 'gray1', 'gray2', 'gray3', 'gray4', 'gray5', 'gray6',
+  'gray7', 'gray8', 'gray9', 'gray10', 'gray11', 'gray12', 'gray13', 'gray14', 'gray15', 'gray16', 'gray17',
+  'gray18', 'gray19', 'gray20', 'gray21', 'gray22', 'gray23', 'gray24', 'gray25', 'gray26', 'gray27', 'gray28',
+  'gray29', 'gray30', 'gray31', 'gray32', 'gray33', 'gray34', 'gray35', 'gray36', 'gray37', 'gray38', 'gray39',
+  'gray40', 'gray42', 'gray43', 'gray44', 'gray45', 'gray46', 'gray47', 'gray48', 'gray49', 'gray50', 'gray51',
+  'gray52', 'gray53', 'gray54', 'gray55', 'gray56', 'gray57', 'gray58', 'gray59', 'gray60', 'gray61', 'gray62',
+  'gray63', 'gray64', 'gray65', 'gray66', 'gray67', 'gray68', 'gray69', 'gray70', 'gray71', 'gray72', 'gray73',
+  'gray74', 'gray75', 'gray76', 'gray77', 'gray78', 'gray79', 'gray80', 'gray81', 'gray82', 'gray83', 'gray84',
+  'gray85', 'gray86', 'gray87', 'gray88', 'gray89', 'gray90', 'gray91', 'gray92', 'gray93', 'gray94', 'gray95',
+  'gray97', 'gray98', 'gray99'
+)
+
+# Hue ranges in degrees that a search for the name matches, red wraps around 0
+HUE_RANGES = {
+  'red': ((345, 360), (0, 15)),
+  'orange': ((15, 45),),
+  'brown': ((10, 40),),
+  'yellow': ((45, 70),),
+  'green': ((70, 165),),
+  'cyan': ((165, 200),),
+  'teal': ((165, 200),),
+  'blue': ((200, 255),),
+  'purple': ((255, 300),),
+  'violet': ((255, 300),),
+  'magenta': ((290, 330),),
+  'pink': ((300, 350),)
+}
+
+# Colours with less saturation than this count as greys
+GREY_SATURATION = 0.12
+
+
+class PaletteColour:
+  __slots__ = ('name', 'hex', 'hue', 'saturation', 'lightness')
+
+  def __init__(self, name: str, rgb: tuple):
+    self.name = name
+    self.hex = f'#{rgb[0]:02X}{rgb[1]:02X}{rgb[2]:02X}'
+    hue, lightness, saturation = colorsys.rgb_to_hls(*(c / 255 for c in rgb))
+    self.hue = hue * 360
+    self.saturation = saturation
+    self.lightness = lightness
+
+
+  def is_grey(self) -> bool:
+    return self.saturation < GREY_SATURATION or self.lightness < 0.05 or self.lightness > 0.97
+
+
+  def matches(self, query: str) -> bool:
+    # A hue name matches by colour as well as by name, a number is a hue in degrees
+    if query in self.name.lower().replace(' ', ''):
+      return True
+
+    if query in ('grey', 'gray'):
+      return self.is_grey()
+
+    if self.is_grey():
+      return False
+
+    if query.isdigit():
+      distance = abs(self.hue - int(query) % 360)
+      return min(distance, 360 - distance) <= 15
+
+    return any(low <= self.hue < high for low, high in HUE_RANGES.get(query, ()))
+
+
+def get_palette_colours(widget: tk.Misc, names: tuple=COLOUR_NAMES) -> list[PaletteColour]:
+  # Greys last, the rest in hue order so similar colours sit together
+  colours = []
+  for name in names:
+    try:
+      rgb = tuple(c // 256 for c in widget.winfo_rgb(name))
+    except tk.TclError:
+      continue
+
+    colours.append(PaletteColour(name, rgb))
+
+  colours.sort(key=lambda c: (c.is_grey(), round(c.hue / 10) if not c.is_grey() else 0, c.lightness))
+  return colours
+
+
+# COLOUR PALETTE
+class ColourPalette(ttk.Frame):
+  _selected: Optional[str] = None
+
+  def __init__(self, parent, on_select: Callable[[str], None], colours: Optional[list[PaletteColour]]=None,
+               swatch_size: int=22, gap: int=2):
+    super().__init__(master=parent)
+    self._on_select = on_select
+    self._colours = colours if colours is not None else get_palette_colours(self)
+    self._shown = self._colours
+    self._cell = swatch_size + gap
+    self._gap = gap
+    self._columns = 1
+
+    # Canvas items of the swatch rows on screen, keyed by the row index
+    self._rows: dict[int, list[int]] = {}
+
+    # Typing filters by name, hue name or hue in degrees
+    self._search = tk.StringVar(self)
+    self._search.trace_add('write', lambda *args: self.set_filter(self._search.get()))
+    self._search_entry = ttk.Entry(self, textvariable=self._search)
+    self._search_entry.grid(row=0, column=0, columnspan=2, sticky='ew', padx=2, pady=2)
+    self._search_entry.bind('<Return>', lambda event: self._select(0))
+
+    # One canvas for every swatch, only the visible rows have items
+    scrollbar = ttk.Scrollbar(self, orient='vertical')
+    scrollbar.grid(row=1, column=1, sticky='ns')
+    self._canvas = tk.Canvas(
+      self,
+      bg='white',
+      highlightthickness=0,
+      yscrollincrement=self._cell,
+      yscrollcommand=scrollbar.set)
+
+    self._canvas.grid(row=1, column=0, sticky='nsew')
+    scrollbar.config(command=self._scroll_y)
+
+    # Name of the swatch under the mouse
+    self._status = ttk.Label(self, anchor=tk.W)
+    self._status.grid(row=2, column=0, columnspan=2, sticky='ew', padx=2)
+    self.rowconfigure(1, weight=1)
+    self.columnconfigure(0, weight=1)
+
+    # Outline moved onto the swatch under the mouse instead of redrawing it
+    self._hover = self._canvas.create_rectangle(0, 0, 0, 0, outline='black', width=2, state=tk.HIDDEN)
+
+    self._canvas.bind('<Configure>', self._resize)
+    self._canvas.bind('<Motion>', self._motion)
+    self._canvas.bind('<Leave>', lambda event: self._canvas.itemconfig(self._hover, state=tk.HIDDEN))
+    self._canvas.bind('<Button-1>', lambda event: self._select(self._get_index(event)))
+    self._canvas.bind('<MouseWheel>', self._wheel)  # with Windows and MacOS, but not Linux
+    self._canvas.bind('<Button-5>',   self._wheel)  # only with Linux, wheel scroll down
+    self._canvas.bind('<Button-4>',   self._wheel)  # only with Linux, wheel scroll up
+
+
+  def focus_search(self) -> None:
+    # A borderless window isn't given the focus by the window manager
+    self._search_entry.focus_force()
+
+
+  def get_colours(self) -> list[PaletteColour]:
+    # Worked out once from the Tk colour database, so another palette can share them
+    return self._colours
+
+
+  def set_filter(self, text: str) -> None:
+    query = text.strip().lower().replace(' ', '')
+    self._shown = [c for c in self._colours if c.matches(query)] if query else self._colours
+    self._clear_rows()
+    self._update_scroll_region()
+    self._canvas.yview_moveto(0)
+    self._render()
+
+
+  def _render(self) -> None:
+    # Work out which rows of swatches intersect the visible part of the canvas
+    top = int(self._canvas.canvasy(0))
+    rows = -(-len(self._shown) // self._columns)
+    visible = range(max(0, top // self._cell), min(rows, (top + self._canvas.winfo_height()) // self._cell + 1))
+
+    for row in [r for r in self._rows if r not in visible]:
+      self._canvas.delete(*self._rows.pop(row))
+
+    for row in visible:
+      if row not in self._rows:
+        self._rows[row] = self._create_row(row)
+
+    self._canvas.tag_raise(self._hover)
+
+
+  def _create_row(self, row: int) -> list[int]:
+    items = []
+    size = self._cell - self._gap
+    y = row * self._cell + self._gap
+    for column, colour in enumerate(self._shown[row * self._columns:(row + 1) * self._columns]):
+      x = column * self._cell + self._gap
+      outline = 'black' if colour.hex == self._selected else 'grey70'
+      items.append(self._canvas.create_rectangle(x, y, x + size, y + size, fill=colour.hex, outline=outline))
+
+    return items
+
+
+  def _clear_rows(self) -> None:
+    for items in self._rows.values():
+      self._canvas.delete(*items)
+
+    self._rows.clear()
+
+
+  def _update_scroll_region(self) -> None:
+    rows = -(-len(self._shown) // self._columns)
+    self._canvas.config(scrollregion=(0, 0, 0, max(1, rows * self._cell + self._gap)))
+
+
+  def _resize(self, event) -> None:
+    # The number of columns follows the width, so every row is laid out again
+    columns = max(1, (event.width - self._gap) // self._cell)
+    if columns != self._columns:
+      self._columns = columns
+      self._clear_rows()
+      self._update_scroll_region()
+
+    self._render()
+
+
+  def _get_index(self, event) -> Optional[int]:
+    x, y = int(self._canvas.canvasx(event.x)), int(self._canvas.canvasy(event.y))
+    column, row = x // self._cell, y // self._cell
+    index = row * self._columns + column
+    if column >= self._columns or not 0 <= index < len(self._shown):
+      return None
+
+    return index
+
+
+  def _motion(self, event) -> None:
+    index = self._get_index(event)
+    if index is None:
+      self._canvas.itemconfig(self._hover, state=tk.HIDDEN)
+      self._status.config(text='')
+      return
+
+    colour = self._shown[index]
+    x = (index % self._columns) * self._cell + self._gap
+    y = (index // self._columns) * self._cell + self._gap
+    size = self._cell - self._gap
+    self._canvas.coords(self._hover, x, y, x + size, y + size)
+    self._canvas.itemconfig(self._hover, state=tk.NORMAL)
+    self._status.config(text=f'{colour.name}  {colour.hex}')
+
+
+  def _select(self, index: Optional[int]) -> str:
+    if index is not None and 0 <= index < len(self._shown):
+      self._selected = self._shown[index].hex
+      self._on_select(self._selected)
+
+    return 'break'
+
+
+  def _wheel(self, event) -> None:
+    # Linux reports the wheel as buttons 4 and 5, the others as a signed delta
+    if event.num == 4 or event.delta > 0:
+      self._canvas.yview_scroll(-2, 'units')
+    else:
+      self._canvas.yview_scroll(2, 'units')
+
+    self._render()
+
+
+  def _scroll_y(self, *args) -> None:
+    self._canvas.yview(*args)
+    self._render()
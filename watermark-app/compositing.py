@@ -0,0 +1,106 @@
+import numpy as np
+from PIL import Image
+
+from watermark_engine import BLEND_MODES
+
+
+def _blend_colour(base: np.ndarray, colour: np.ndarray, blend_mode: str) -> np.ndarray:
+  # base is float32 in 0..1 with shape (h, w, 3), colour has shape (3,)
+  if blend_mode == 'normal':
+    return np.broadcast_to(colour, base.shape)
+
+  if blend_mode == 'multiply':
+    return base * colour
+
+  if blend_mode == 'screen':
+    return 1.0 - (1.0 - base) * (1.0 - colour)
+
+  if blend_mode == 'overlay':
+    return np.where(base < 0.5, 2.0 * base * colour, 1.0 - 2.0 * (1.0 - base) * (1.0 - colour))
+
+  raise ValueError(f'Unknown blend mode {blend_mode!r}')
+
+
+def composite_into(buffer: np.ndarray, mask: np.ndarray, colour: tuple, blend_mode: str='normal',
+                   opacity: float=1.0, strip_rows: int=64) -> None:
+  # Blend a solid colour through the mask into an RGB or RGBA uint8 buffer, in place
+  if buffer.ndim != 3 or buffer.shape[2] not in (3, 4):
+    raise ValueError(f'buffer must be RGB or RGBA, got shape {buffer.shape}')
+
+  if buffer.shape[:2] != mask.shape:
+    raise ValueError('mask and buffer must be the same size')
+
+  if blend_mode not in BLEND_MODES:
+    raise ValueError(f'Unknown blend mode {blend_mode!r}, expected one of {BLEND_MODES}')
+
+  # Work in strips so the float temporaries stay small, skipping the empty parts of the mask
+  for top in range(0, mask.shape[0], strip_rows):
+    mask_strip = mask[top:top + strip_rows]
+    columns = np.flatnonzero(mask_strip.any(axis=0))
+    if columns.size == 0:
+      continue
+
+    left, right = columns[0], columns[-1] + 1
+    _composite_strip(buffer[top:top + strip_rows, left:right], mask_strip[:, left:right], colour, blend_mode, opacity)
+
+
+def _composite_strip(buffer: np.ndarray, mask: np.ndarray, colour: tuple, blend_mode: str, opacity: float) -> None:
+  alpha = mask.astype(np.float32)
+  alpha *= opacity / 255.0
+  alpha = alpha[..., np.newaxis]
+
+  base = buffer[..., :3].astype(np.float32)
+  base *= 1.0 / 255.0
+  top = _blend_colour(base, np.asarray(colour[:3], dtype=np.float32) / 255.0, blend_mode)
+
+  if buffer.shape[2] == 4:
+    # Straight alpha "over", the blended colour is only seen where the base is opaque
+    base_alpha = buffer[..., 3:4].astype(np.float32)
+    base_alpha *= 1.0 / 255.0
+    top = base_alpha * top + (1.0 - base_alpha) * np.asarray(colour[:3], dtype=np.float32) / 255.0
+    out_alpha = alpha + base_alpha * (1.0 - alpha)
+
+    result = top * alpha
+    result += base * base_alpha * (1.0 - alpha)
+    np.divide(result, out_alpha, out=result, where=out_alpha > 0)
+    buffer[..., 3:4] = np.rint(out_alpha * 255.0)
+
+  else:
+    # result = base + alpha * (top - base)
+    result = top - base
+    result *= alpha
+    result += base
+
+  result *= 255.0
+  np.rint(result, out=result)
+  buffer[..., :3] = result
+
+
+def composite(img: Image.Image, mask: Image.Image, colour: tuple, position: tuple, blend_mode: str='normal',
+              opacity: float=1.0) -> Image.Image:
+  # Blended pixels can't be written back as indices into the image's own
+  # palette or as single bits, watermark_engine.prepare_image converts those
+  if img.mode in ('P', 'PA', '1'):
+    raise ValueError(f'Can\'t composite into a {img.mode} image, convert it to RGB or RGBA first')
+
+  # Clip the mask to the image
+  left, top = position
+  box = (max(0, left), max(0, top), min(img.width, left + mask.width), min(img.height, top + mask.height))
+  if box[2] <= box[0] or box[3] <= box[1]:
+    return img
+
+  mask_box = (box[0] - left, box[1] - top, box[2] - left, box[3] - top)
+
+  # Pillow can't hand out a writable view of its pixels, so the region under
+  # the mask is copied out, blended and pasted back. Greyscale and other
+  # modes are blended as RGB or RGBA and converted back.
+  region = img.crop(box)
+  if img.mode not in ('RGB', 'RGBA'):
+    region = region.convert('RGBA' if 'A' in region.getbands() or 'transparency' in region.info else 'RGB')
+
+  pixels = np.array(region)
+  composite_into(pixels, np.asarray(mask.crop(mask_box)), colour, blend_mode, opacity)
+  region = Image.fromarray(pixels, region.mode)
+  img.paste(region if region.mode == img.mode else region.convert(img.mode), box[:2])
+
+  return img
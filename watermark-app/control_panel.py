@@ -3,6 +3,12 @@ from tkinter import ttk, font, colorchooser
 from collections.abc import Callable
 from typing import Optional
 
+from colour_palette import ColourPalette
+from font_picker import FontPicker
+
+# Font size units shown in the panel -> the size reference they stand for, None for pixels
+SIZE_UNITS = {'px': None, '% width': 'width', '% short edge': 'short_edge'}
+
 # COLOUR BUTTON
 class ColourButton(ttk.Frame):
   _callback: Optional[Callable[[], str]] = None
@@ -10,6 +16,8 @@ class ColourButton(ttk.Frame):
   _btn_light: Optional[str] = None
   _btn_dark: Optional[str] = None
   _colour_tint: float = 0.25
+  _popup: Optional[tk.Toplevel] = None
+  _palette_colours = None
 
   def __init__(self, root=None, colour: Optional[str]=None, cursor: str='', size: int=32):
     super().__init__(root, cursor=cursor)
@@ -55,16 +63,64 @@ class ColourButton(ttk.Frame):
       self._canvas.config(bg=self._btn_dark)
 
 
+  def set_colour(self, colour: str) -> None:
+    self._btn_normal = colour
+    self._canvas.config(bg=self._btn_normal)
+    self._create_colour_shades(colour, self._colour_tint)
+
+
   def _btn_release(self, event) -> None:
+    if self._popup is not None:
+      self._close_palette()
+      return
+
+    # Borderless palette under the button, closed when it loses the focus
+    self._popup = tk.Toplevel(self)
+    self._popup.overrideredirect(True)
+    self._popup.geometry(f'300x320+{self.winfo_rootx()}+{self.winfo_rooty() + self.winfo_height()}')
+
+    palette = ColourPalette(self._popup, self._colour_selected, self._palette_colours)
+    palette.pack(expand=True, fill=tk.BOTH)
+    self._palette_colours = palette.get_colours()
+    more = ttk.Button(self._popup, text='More…', command=self._ask_colour)
+    more.pack(side=tk.RIGHT, padx=2, pady=2)
+
+    self._popup.bind('<Escape>', lambda event: self._close_palette())
+    self._popup.bind('<FocusOut>', lambda event: self.after(1, self._check_focus))
+    self._popup.update_idletasks()
+    palette.focus_search()
+
+
+  def _close_palette(self) -> None:
+    if self._popup is not None:
+      self._popup.destroy()
+      self._popup = None
+
+    self._canvas.config(bg=self._btn_normal)
+
+
+  def _check_focus(self) -> None:
+    # Focus moving between the palette's own widgets doesn't close it
+    focus = self.focus_get()
+    if self._popup is not None and (focus is None or focus.winfo_toplevel() is not self._popup):
+      self._close_palette()
+
+
+  def _ask_colour(self) -> None:
+    # The system colour chooser for anything the palette doesn't have
+    self._close_palette()
     new_colour = colorchooser.askcolor(self._btn_normal, title='Select a colour')
     if new_colour[1] is not None:
-      self._btn_normal = new_colour[1]
-      self._canvas.config(bg=self._btn_normal)
-      self._create_colour_shades(new_colour[1], self._colour_tint)
+      self._colour_selected(new_colour[1])
+
 
-      # Notify any callback functions
-      if self._callback is not None:
-        self._callback(self._btn_normal)
+  def _colour_selected(self, colour: str) -> None:
+    self._close_palette()
+    self.set_colour(colour)
+
+    # Notify any callback functions
+    if self._callback is not None:
+      self._callback(self._btn_normal)
 
 
   def _create_colour_shades(self, colour: str, tint: float) -> str:
@@ -96,32 +152,58 @@ class ColourButton(ttk.Frame):
 
 # WATERMARK CONTROL PANEL
 class WatermarkControlPanel(ttk.Frame):
-  def __init__(self, root_window: tk.Tk, fonts: list[str], add_watermark):
+  def __init__(self, root_window: tk.Tk, fonts: list[str], add_watermark, watermark_changed=None,
+               save_profile=None, load_profile=None, get_font_path=None):
     # Call the parent class constructor
     super().__init__(master=root_window, style='Card.TFrame')
+    self._watermark_changed = watermark_changed
+    self._get_font_path = get_font_path
 
     # Create watermark text entry
     self._create_watermark_text_entry()
 
     # Create the font combobox
-    self._create_font_combobox(fonts)
+    self._create_font_picker(fonts)
 
-    # Create the font size input
+    # Create the font size input, in pixels or relative to the image
     self._create_font_size_input()
+    self._create_size_unit_combobox()
 
     # Create the colour selector
     self._create_colour_button()
 
-    # Create the add watermark button
+    # Create the opacity and blend mode inputs
+    self._create_opacity_input()
+    self._create_blend_mode_combobox()
+
+    # Create the single stamp or repeating pattern selector
+    self._create_mode_combobox()
+
+    # Create the placement and margin inputs
+    self._create_placement_combobox()
+    self._create_margin_input()
+
+    # Create the add watermark and profile buttons
     self._create_buttons(add_watermark)
+    self._create_profile_buttons(save_profile, load_profile)
+
+    # Report every settings change for the live preview
+    for variable in (self._watermark_text, self._selected_font, self._font_size, self._size_unit, self._opacity, self._blend_mode,
+                     self._watermark_mode, self._placement, self._margin):
+      variable.trace_add('write', self._settings_changed)
 
 
   def get_watermark_text(self) -> str:
     return self._watermark_text.get()
   
 
-  def get_watermark_font_size(self) -> int:
-    return int(self._font_size.get())
+  def get_watermark_font_size(self) -> float:
+    return float(self._font_size.get())
+
+
+  def get_watermark_size_reference(self) -> Optional[str]:
+    # None for pixels, otherwise what the size and margin are a percentage of
+    return SIZE_UNITS[self._size_unit.get()]
   
 
   def get_watermark_font(self) -> str:
@@ -130,6 +212,52 @@ class WatermarkControlPanel(ttk.Frame):
 
   def get_watermark_colour(self) -> str:
     return self._watermark_colour
+
+
+  def get_watermark_opacity(self) -> float:
+    return int(self._opacity.get()) / 100
+
+
+  def get_watermark_blend_mode(self) -> str:
+    return self._blend_mode.get()
+
+
+  def get_watermark_mode(self) -> str:
+    return self._watermark_mode.get()
+
+
+  def get_watermark_placement(self) -> str:
+    return self._placement.get()
+
+
+  def get_watermark_margin(self) -> float:
+    return float(self._margin.get())
+
+
+  def set_fonts(self, fonts: list[str]) -> None:
+    # The font list arrives after the window is shown
+    self._fonts = fonts
+    self._font_picker.set_fonts(fonts)
+
+
+  def set_watermark(self, text: str, font: Optional[str], font_size: float, size_reference: Optional[str],
+                    colour: str, opacity: float, blend_mode: str, mode: str, placement: str, margin: float) -> None:
+    # Fill the inputs from a loaded profile, keeping the current font if the profile's isn't installed
+    self._watermark_text.set(text)
+    if font and font in self._fonts:
+      self._selected_font.set(font)
+      self._font_changed(None)
+
+    self._size_unit.set(next(unit for unit, reference in SIZE_UNITS.items() if reference == size_reference))
+    self._configure_margin_input()
+    self._font_size.set(f'{font_size:g}')
+    self._watermark_colour = colour
+    self._colour_btn.set_colour(colour)
+    self._opacity.set(str(round(opacity * 100)))
+    self._blend_mode.set(blend_mode)
+    self._watermark_mode.set(mode)
+    self._placement.set(placement)
+    self._margin.set(f'{margin:g}')
   
 
   def _create_watermark_text_entry(self) -> None:
@@ -138,11 +266,19 @@ class WatermarkControlPanel(ttk.Frame):
     self._text_entry.pack(side=tk.LEFT, expand=True, fill=tk.BOTH, padx=(5, 10), pady=(5, 5))
   
 
-  def _create_font_combobox(self, fonts: list[str]) -> None:
+  def _create_font_picker(self, fonts: list[str]) -> None:
+    # Each font in the list is previewed with the watermark text
+    self._fonts = fonts
     self._selected_font = tk.StringVar(self, value=font.nametofont('TkDefaultFont').actual()['family']) # Set this to the default font of tkinter
-    font_combobox = ttk.Combobox(self, values=fonts, textvariable=self._selected_font, width=30, state='readonly')
-    font_combobox.bind('<<ComboboxSelected>>', self._font_changed)
-    font_combobox.pack(side=tk.LEFT, expand=False, fill=tk.Y, padx=(0, 5), pady=5)
+    self._font_picker = FontPicker(
+      self,
+      fonts,
+      self._selected_font,
+      get_font_path=self._get_font_path,
+      get_preview_text=self._watermark_text.get,
+      command=lambda family: self._font_changed(None))
+
+    self._font_picker.pack(side=tk.LEFT, expand=False, fill=tk.Y, padx=(0, 5), pady=5)
 
 
   def _create_font_size_input(self) -> None:
@@ -161,16 +297,39 @@ class WatermarkControlPanel(ttk.Frame):
 
 
   def _validate_font_size(self, value: str) -> bool:
-    # Only accept numbers as font size
-    return value.isdigit()
+    # Only accept numbers as font size, relative sizes can have a fraction
+    return all(c.isdigit() or c == '.' for c in value)
   
 
   def _check_font_size_value(self, event) -> None:
-    # Prevent font sizes of nothing
-    if not self._font_size.get():
+    # Prevent font sizes of nothing, or typos like a second decimal point
+    try:
+      float(self._font_size.get())
+    except ValueError:
       self._font_size.set('1')
 
   
+  def _create_size_unit_combobox(self) -> None:
+    self._size_unit = tk.StringVar(self, value='px')
+    unit_combobox = ttk.Combobox(
+      self,
+      values=list(SIZE_UNITS),
+      textvariable=self._size_unit,
+      width=11,
+      state='readonly')
+
+    unit_combobox.bind('<<ComboboxSelected>>', self._size_unit_changed)
+    unit_combobox.pack(side=tk.LEFT, expand=False, fill=tk.Y, padx=(0, 5), pady=5)
+
+
+  def _size_unit_changed(self, event) -> None:
+    # Pixel values make no sense as percentages, start again from the defaults of the new unit
+    relative = self.get_watermark_size_reference() is not None
+    self._configure_margin_input()
+    self._margin.set('1' if relative else '10')
+    self._font_size.set('3' if relative else '20')
+
+
   def _create_colour_button(self) -> None:
     self._colour_btn = ColourButton(self, colour='black', cursor='hand2', size=32)
     self._colour_btn.pack(side=tk.LEFT, expand=False, fill=tk.Y, padx=(5, 5), pady=5)
@@ -178,8 +337,82 @@ class WatermarkControlPanel(ttk.Frame):
     self._watermark_colour = 'black'
 
 
+  def _create_opacity_input(self) -> None:
+    # Opacity is entered as a percentage
+    self._opacity = tk.StringVar(self, value='100')
+    opacity_box = ttk.Spinbox(self, from_=0, to=100, increment=5, textvariable=self._opacity, width=4, state='readonly')
+    opacity_box.pack(side=tk.LEFT, expand=False, fill=tk.Y, padx=(5, 5), pady=5)
+
+
+  def _create_blend_mode_combobox(self) -> None:
+    self._blend_mode = tk.StringVar(self, value='normal')
+    blend_combobox = ttk.Combobox(
+      self,
+      values=['normal', 'multiply', 'screen', 'overlay'],
+      textvariable=self._blend_mode,
+      width=9,
+      state='readonly')
+
+    blend_combobox.pack(side=tk.LEFT, expand=False, fill=tk.Y, padx=(5, 5), pady=5)
+
+
+  def _create_mode_combobox(self) -> None:
+    self._watermark_mode = tk.StringVar(self, value='single')
+    mode_combobox = ttk.Combobox(
+      self,
+      values=['single', 'pattern'],
+      textvariable=self._watermark_mode,
+      width=7,
+      state='readonly')
+
+    mode_combobox.pack(side=tk.LEFT, expand=False, fill=tk.Y, padx=(5, 5), pady=5)
+
+
+  def _create_placement_combobox(self) -> None:
+    self._placement = tk.StringVar(self, value='bottom-right')
+    placement_combobox = ttk.Combobox(
+      self,
+      values=['top-left', 'top', 'top-right', 'left', 'center', 'right', 'bottom-left', 'bottom', 'bottom-right'],
+      textvariable=self._placement,
+      width=12,
+      state='readonly')
+
+    placement_combobox.pack(side=tk.LEFT, expand=False, fill=tk.Y, padx=(5, 5), pady=5)
+
+
+  def _create_margin_input(self) -> None:
+    # Margin from the edges, in the same unit as the font size
+    self._margin = tk.StringVar(self, value='10')
+    self._margin_box = ttk.Spinbox(self, textvariable=self._margin, width=4, state='readonly')
+    self._margin_box.pack(side=tk.LEFT, expand=False, fill=tk.Y, padx=(5, 5), pady=5)
+    self._configure_margin_input()
+
+
+  def _configure_margin_input(self) -> None:
+    if self.get_watermark_size_reference() is None:
+      self._margin_box.configure(from_=0, to=500, increment=5)
+    else:
+      self._margin_box.configure(from_=0, to=25, increment=0.5)
+
+
   def _colour_changed(self, colour: str) -> None:
     self._watermark_colour = colour
+    self._settings_changed()
+
+
+  def _settings_changed(self, *args) -> None:
+    # Skip the half typed states, like an empty font size
+    if self._watermark_changed is None:
+      return
+
+    try:
+      if self.get_watermark_font_size() <= 0:
+        return
+
+    except ValueError:
+      return
+
+    self._watermark_changed()
 
 
   def _font_changed(self, event) -> None:
@@ -199,18 +432,57 @@ class WatermarkControlPanel(ttk.Frame):
     add_btn.pack(side=tk.LEFT, padx=5, pady=5)
 
 
+  def _create_profile_buttons(self, save_profile, load_profile) -> None:
+    # Watermark settings can be saved to and loaded from a profile file
+    if load_profile is not None:
+      load_btn = ttk.Button(self, text='Load Profile', style='Accent.TButton', width=12, command=load_profile)
+      load_btn.pack(side=tk.RIGHT, padx=5, pady=5)
+
+    if save_profile is not None:
+      save_btn = ttk.Button(self, text='Save Profile', style='Accent.TButton', width=12, command=save_profile)
+      save_btn.pack(side=tk.RIGHT, padx=5, pady=5)
+
+
 # IMAGE CONTROL PANEL
 class ImageControlPanel(ttk.Frame):
-  def __init__(self, root_window: tk.Tk, load_image, save_image, fit_to_window, actual_size, rotate_image, reset_image) -> None:
+  def __init__(self, root_window: tk.Tk, load_image, load_folder, save_image, fit_to_window, actual_size, rotate_image, reset_image, undo, redo, previous_image, next_image) -> None:
     # Call the parent class constructor
     super().__init__(master=root_window, style='Card.TFrame')
 
     self._create_load_button(load_image)
+    self._create_load_folder_button(load_folder)
+    self._create_navigation_btns(previous_image, next_image)
     self._create_save_button(save_image)
+    self._create_quality_input()
+    self._create_lossless_rotation_input()
     self._create_fit_window_btn(fit_to_window)
     self._create_actual_size_btn(actual_size)
     self._create_rotate_btns(rotate_image)
+    self._create_undo_btns(undo, redo)
     self._create_reset_btn(reset_image)
+    self._create_progress_bar()
+
+
+  def get_quality(self) -> int:
+    return int(self._quality.get())
+
+
+  def get_lossless_rotation(self) -> bool:
+    return self._lossless_rotation.get()
+
+
+  def set_progress(self, fraction: Optional[float], message: str='') -> None:
+    # A fraction of None means the total isn't known yet
+    if fraction is None:
+      if str(self._progress_bar.cget('mode')) != 'indeterminate':
+        self._progress_bar.config(mode='indeterminate')
+        self._progress_bar.start(20)
+
+    else:
+      self._progress_bar.stop()
+      self._progress_bar.config(mode='determinate', value=fraction * 100)
+
+    self._progress_text.set(message)
 
 
   def _create_load_button(self, load_image) -> None:
@@ -225,6 +497,44 @@ class ImageControlPanel(ttk.Frame):
     select_btn.pack(side=tk.TOP, padx=5, pady=5)
 
   
+  def _create_load_folder_button(self, load_folder) -> None:
+    # Create the folder selection button
+    folder_btn = ttk.Button(
+      self,
+      text='Load Folder',
+      style='Accent.TButton',
+      width=15,
+      command=load_folder)
+
+    folder_btn.pack(side=tk.TOP, padx=5, pady=5)
+
+
+  def _create_navigation_btns(self, previous_image, next_image) -> None:
+    # Create the previous and next image buttons
+    navigation_frame = ttk.Frame(self)
+    navigation_frame.pack(side=tk.TOP, padx=5, pady=5)
+
+    previous_btn = ttk.Button(
+      navigation_frame,
+      text='<',
+      style='Accent.TButton',
+      width=6,
+      command=previous_image
+    )
+
+    previous_btn.pack(side=tk.LEFT, padx=(0, 5))
+
+    next_btn = ttk.Button(
+      navigation_frame,
+      text='>',
+      style='Accent.TButton',
+      width=6,
+      command=next_image
+    )
+
+    next_btn.pack(side=tk.LEFT)
+
+
   def _create_save_button(self, save_image) -> None:
     # Create the save image button
     save_btn = ttk.Button(
@@ -238,6 +548,24 @@ class ImageControlPanel(ttk.Frame):
     save_btn.pack(side=tk.TOP, padx=5, pady=5)
 
 
+  def _create_quality_input(self) -> None:
+    # Create the export quality input
+    quality_frame = ttk.Frame(self)
+    quality_frame.pack(side=tk.TOP, padx=5, pady=5)
+    ttk.Label(quality_frame, text='Quality').pack(side=tk.LEFT, padx=(0, 5))
+
+    self._quality = tk.StringVar(self, value='90')
+    quality_box = ttk.Spinbox(quality_frame, from_=1, to=100, textvariable=self._quality, width=4, state='readonly')
+    quality_box.pack(side=tk.LEFT)
+
+
+  def _create_lossless_rotation_input(self) -> None:
+    # Rotated JPEGs can be saved without re-encoding by setting the EXIF Orientation
+    self._lossless_rotation = tk.BooleanVar(self, value=True)
+    lossless_check = ttk.Checkbutton(self, text='Lossless rotate', variable=self._lossless_rotation)
+    lossless_check.pack(side=tk.TOP, padx=5, pady=5)
+
+
   def _create_fit_window_btn(self, fit_to_window) -> None:
     # Create the fit window button
     fit_btn = ttk.Button(
@@ -287,6 +615,29 @@ class ImageControlPanel(ttk.Frame):
     rotate_right_btn.pack(side=tk.TOP, padx=5, pady=5)
 
   
+  def _create_undo_btns(self, undo, redo) -> None:
+    # Create the undo and redo buttons
+    undo_btn = ttk.Button(
+      self,
+      text='Undo',
+      style='Accent.TButton',
+      width=15,
+      command=undo
+    )
+
+    undo_btn.pack(side=tk.TOP, padx=5, pady=5)
+
+    redo_btn = ttk.Button(
+      self,
+      text='Redo',
+      style='Accent.TButton',
+      width=15,
+      command=redo
+    )
+
+    redo_btn.pack(side=tk.TOP, padx=5, pady=5)
+
+
   def _create_reset_btn(self, reset_image) -> None:
     reset_btn = ttk.Button(
       self,
@@ -297,3 +648,13 @@ class ImageControlPanel(ttk.Frame):
     )
 
     reset_btn.pack(side=tk.TOP, padx=5, pady=5)
+
+
+  def _create_progress_bar(self) -> None:
+    # Create the export progress bar
+    self._progress_bar = ttk.Progressbar(self, orient='horizontal', mode='determinate', maximum=100)
+    self._progress_bar.pack(side=tk.BOTTOM, fill=tk.X, padx=5, pady=(0, 5))
+
+    self._progress_text = tk.StringVar(self, value='')
+    progress_label = ttk.Label(self, textvariable=self._progress_text, width=15)
+    progress_label.pack(side=tk.BOTTOM, padx=5)
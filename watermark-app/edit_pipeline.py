@@ -0,0 +1,244 @@
+import dataclasses
+import math
+from dataclasses import dataclass
+from typing import Optional
+from PIL import Image
+
+from image_orientation import ROTATE_TRANSPOSE
+from image_pyramid import ImagePyramid
+from image_store import ImageStore, image_store
+from instrumentation import instrumentation
+import watermark_engine
+
+
+# OPERATIONS
+@dataclass(frozen=True)
+class RotateOperation:
+  angle: int
+
+  def apply(self, img: Image.Image, scale_factor: float) -> Image.Image:
+    # Right angles only move pixels, anything else has to resample
+    if self.angle % 360 in ROTATE_TRANSPOSE:
+      return img.transpose(ROTATE_TRANSPOSE[self.angle % 360])
+
+    return img.rotate(self.angle, expand=True)
+
+
+  def get_size(self, size: tuple) -> tuple:
+    # Bounding box of the rotated image, as rotate(expand=True) computes it
+    width, height = size
+    radians = math.radians(self.angle)
+    cos, sin = abs(round(math.cos(radians), 10)), abs(round(math.sin(radians), 10))
+    return (math.ceil(width * cos + height * sin), math.ceil(width * sin + height * cos))
+
+
+@dataclass(frozen=True)
+class WatermarkOperation:
+  settings: watermark_engine.WatermarkSettings
+
+  def apply(self, img: Image.Image, scale_factor: float) -> Image.Image:
+    # Draw on a copy, the input may be a memoised result
+    watermarked = watermark_engine.prepare_image(img)
+    if watermarked is img:
+      watermarked = img.copy()
+
+    return watermark_engine.apply_settings(watermarked, self._get_settings(scale_factor))
+
+
+  def get_size(self, size: tuple) -> tuple:
+    return size
+
+
+  def redraw(self, img: Image.Image, base: Image.Image, previous: 'WatermarkOperation', scale_factor: float) -> tuple:
+    # Swap the previous watermark on img, a watermarked copy of base, for this
+    # one in place and return the box that changed
+    previous_box = previous.get_box(base.size, scale_factor)
+    img.paste(base.crop(previous_box), previous_box[:2])
+    watermark_engine.apply_settings(img, self._get_settings(scale_factor))
+    return get_union(previous_box, self.get_box(base.size, scale_factor))
+
+
+  def get_box(self, size: tuple, scale_factor: float) -> tuple:
+    # The part of an image of this size the watermark is drawn on
+    return watermark_engine.get_watermark_box(size, self._get_settings(scale_factor))
+
+
+  def _get_settings(self, scale_factor: float) -> watermark_engine.WatermarkSettings:
+    # Scale the text with the preview so it lands in the same place, a
+    # relative size already follows the size of the image it is drawn on
+    if scale_factor == 1.0:
+      return self.settings
+
+    return dataclasses.replace(
+      self.settings,
+      font_size=max(1, round(self.settings.font_size * scale_factor)),
+      margin=round(self.settings.margin * scale_factor),
+      spacing=round(self.settings.spacing * scale_factor))
+
+
+def get_union(box: tuple, other: tuple) -> tuple:
+  return (min(box[0], other[0]), min(box[1], other[1]), max(box[2], other[2]), max(box[3], other[3]))
+
+
+def merge_rotations(operations: tuple) -> tuple:
+  # Back to back rotations become one orientation change, so a run of clicks
+  # moves the pixels once and rotating back to the start costs nothing
+  merged = []
+  for operation in operations:
+    if isinstance(operation, RotateOperation) and merged and isinstance(merged[-1], RotateOperation):
+      operation = RotateOperation((merged.pop().angle + operation.angle) % 360)
+
+    merged.append(operation)
+
+  return tuple(operation for operation in merged if not (isinstance(operation, RotateOperation) and operation.angle % 360 == 0))
+
+
+def get_rotation(operations: tuple) -> Optional[int]:
+  # The total right angle rotation when that is the only edit, otherwise None
+  angle = 0
+  for operation in operations:
+    if not isinstance(operation, RotateOperation) or operation.angle % 90 != 0:
+      return None
+
+    angle += operation.angle
+
+  return angle % 360
+
+
+# EDIT PIPELINE
+class EditPipeline:
+  def __init__(self, source: Image.Image, pyramid: Optional[ImagePyramid]=None, store: ImageStore=image_store):
+    # The source is never modified, edits are replayed on top of it, so it
+    # is shared with the pyramid and the store rather than copied
+    self._source = source
+    self._pyramid = pyramid
+    self._operations = []
+    self._position = 0
+
+    # The source is pinned, memoised results keyed by (scale, operations applied)
+    # are derived and the store drops them when it runs out of memory
+    self._store = store
+    self._store.add((self, 'source'), source, pinned=True)
+
+
+  def get_source(self) -> Image.Image:
+    return self._source
+
+
+  def get_operations(self) -> list:
+    return self._operations[:self._position]
+
+
+  def get_history(self) -> tuple:
+    # Every edit including the undone ones, and how many of them are applied
+    return (tuple(self._operations), self._position)
+
+
+  def set_history(self, history: tuple) -> None:
+    operations, position = history
+    self._operations = list(operations)
+    self._position = min(position, len(self._operations))
+
+
+  def get_size(self) -> tuple:
+    size = self._source.size
+    for operation in self.get_operations():
+      size = operation.get_size(size)
+
+    return size
+
+
+  def close(self) -> None:
+    # Release the source and every memoised render
+    self._store.remove_where(lambda key: isinstance(key, tuple) and key[0] is self)
+
+
+  def push(self, operation) -> None:
+    # A new edit drops anything that could have been redone
+    del self._operations[self._position:]
+    self._operations.append(operation)
+    self._position += 1
+
+
+  def can_undo(self) -> bool:
+    return self._position > 0
+
+
+  def can_redo(self) -> bool:
+    return self._position < len(self._operations)
+
+
+  def undo(self) -> bool:
+    if not self.can_undo():
+      return False
+
+    self._position -= 1
+    return True
+
+
+  def redo(self) -> bool:
+    if not self.can_redo():
+      return False
+
+    self._position += 1
+    return True
+
+
+  def reset(self) -> None:
+    # Undo everything, the edits can still be redone one by one
+    self._position = 0
+
+
+  def render(self, scale_factor: float=1.0, operations: Optional[tuple]=None) -> Image.Image:
+    # Pass a snapshot of the operations when rendering from another thread
+    scale_factor = round(min(1.0, scale_factor), 6)
+    if operations is None:
+      operations = tuple(self.get_operations())
+
+    operations = merge_rotations(operations)
+
+    # Start from the longest run of operations that is already rendered
+    start = len(operations)
+    img = self._get_memo(scale_factor, operations)
+    while img is None and start > 0:
+      start -= 1
+      img = self._get_memo(scale_factor, operations[:start])
+
+    if img is None:
+      img = self._get_scaled_source(scale_factor)
+      self._put_memo(scale_factor, (), img)
+
+    for index in range(start, len(operations)):
+      with instrumentation.measure(type(operations[index]).__name__, scale=scale_factor):
+        img = operations[index].apply(img, scale_factor)
+      self._put_memo(scale_factor, operations[:index + 1], img)
+
+    return img
+
+
+  def _get_memo(self, scale_factor: float, operations: tuple) -> Optional[Image.Image]:
+    if scale_factor == 1.0 and not operations:
+      return self._source
+
+    return self._store.get((self, scale_factor, operations))
+
+
+  def _put_memo(self, scale_factor: float, operations: tuple, img: Image.Image) -> None:
+    # The unedited source is already held by the store
+    if img is not self._source:
+      self._store.add((self, scale_factor, operations), img)
+
+
+  def _get_scaled_source(self, scale_factor: float) -> Image.Image:
+    if scale_factor == 1.0:
+      return self._source
+
+    # Resample from the nearest larger pyramid level when one is ready
+    source = self._source
+    if self._pyramid is not None:
+      source, _ = self._pyramid.get_level(scale_factor)
+
+    width, height = self._source.size
+    size = (max(1, round(width * scale_factor)), max(1, round(height * scale_factor)))
+    with instrumentation.measure('resize', scale=scale_factor):
+      return source.resize(size, Image.Resampling.BILINEAR)
@@ -0,0 +1,259 @@
+import json
+import os
+import struct
+import sys
+from typing import Optional
+
+FONT_INDEX_VERSION = 1
+FONT_EXTENSIONS = ('.ttf', '.otf', '.ttc', '.otc')
+FALLBACK_FAMILIES = ('Arial', 'DejaVu Sans', 'Helvetica', 'Liberation Sans', 'Noto Sans', 'Verdana')
+
+# Name table ids
+NAME_FAMILY = 1
+NAME_SUBFAMILY = 2
+NAME_TYPOGRAPHIC_FAMILY = 16
+NAME_TYPOGRAPHIC_SUBFAMILY = 17
+
+# Preferred style for the file that represents a family
+REGULAR_STYLES = ('regular', 'book', 'normal', 'roman', 'medium', 'plain')
+
+
+def get_font_dirs() -> list[str]:
+  home = os.path.expanduser('~')
+  if sys.platform == 'win32':
+    windir = os.environ.get('WINDIR', r'C:\Windows')
+    local_app_data = os.environ.get('LOCALAPPDATA', os.path.join(home, 'AppData', 'Local'))
+    return [os.path.join(windir, 'Fonts'), os.path.join(local_app_data, 'Microsoft', 'Windows', 'Fonts')]
+
+  if sys.platform == 'darwin':
+    return ['/System/Library/Fonts', '/Library/Fonts', os.path.join(home, 'Library', 'Fonts')]
+
+  data_home = os.environ.get('XDG_DATA_HOME', os.path.join(home, '.local', 'share'))
+  return ['/usr/share/fonts', '/usr/local/share/fonts', os.path.join(data_home, 'fonts'), os.path.join(home, '.fonts')]
+
+
+def get_cache_dir() -> str:
+  if sys.platform == 'win32':
+    cache_dir = os.environ.get('LOCALAPPDATA', os.path.expanduser('~'))
+  elif sys.platform == 'darwin':
+    cache_dir = os.path.expanduser('~/Library/Caches')
+  else:
+    cache_dir = os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache'))
+
+  return os.path.join(cache_dir, 'watermark-app')
+
+
+def get_cache_file() -> str:
+  return os.path.join(get_cache_dir(), 'font_index.json')
+
+
+def _decode_name(platform_id: int, encoding_id: int, data: bytes) -> Optional[str]:
+  if platform_id in (0, 3):
+    return data.decode('utf-16-be', errors='replace')
+
+  if platform_id == 1 and encoding_id == 0:
+    return data.decode('mac_roman', errors='replace')
+
+  return None
+
+
+def _read_names(f, font_offset: int) -> dict[int, str]:
+  # Find the name table in the table directory
+  f.seek(font_offset)
+  header = f.read(12)
+  if len(header) < 12:
+    return {}
+
+  num_tables = struct.unpack('>H', header[4:6])[0]
+  table_dir = f.read(16 * num_tables)
+  name_offset = None
+  for i in range(num_tables):
+    tag, _, offset, length = struct.unpack('>4sIII', table_dir[i * 16:(i + 1) * 16])
+    if tag == b'name':
+      name_offset = offset
+      name_length = length
+      break
+
+  if name_offset is None:
+    return {}
+
+  f.seek(name_offset)
+  table = f.read(name_length)
+  _, count, string_offset = struct.unpack('>HHH', table[:6])
+
+  # Rank the records so english Windows names win over the others
+  names = {}
+  ranks = {}
+  for i in range(count):
+    record = table[6 + i * 12:6 + (i + 1) * 12]
+    if len(record) < 12:
+      break
+
+    platform_id, encoding_id, language_id, name_id, length, offset = struct.unpack('>HHHHHH', record)
+    if name_id not in (NAME_FAMILY, NAME_SUBFAMILY, NAME_TYPOGRAPHIC_FAMILY, NAME_TYPOGRAPHIC_SUBFAMILY):
+      continue
+
+    if platform_id == 3:
+      rank = 0 if language_id == 0x409 else 2
+    elif platform_id == 1:
+      rank = 1 if language_id == 0 else 3
+    else:
+      rank = 4
+
+    if rank >= ranks.get(name_id, 5):
+      continue
+
+    start = string_offset + offset
+    name = _decode_name(platform_id, encoding_id, table[start:start + length])
+    if name:
+      names[name_id] = name.strip('\x00 ')
+      ranks[name_id] = rank
+
+  return names
+
+
+def read_font_names(font_file: str) -> list[dict[int, str]]:
+  # Returns the name records of every font in the file
+  with open(font_file, 'rb') as f:
+    tag = f.read(4)
+    if tag == b'ttcf':
+      f.seek(8)
+      num_fonts = struct.unpack('>I', f.read(4))[0]
+      offsets = struct.unpack(f'>{num_fonts}I', f.read(4 * num_fonts))
+    else:
+      offsets = (0,)
+
+    return [_read_names(f, offset) for offset in offsets]
+
+
+def _style_rank(style: str) -> int:
+  style = style.lower()
+  return 0 if style in REGULAR_STYLES else len(style) + 1
+
+
+# FONT INDEX
+class FontIndex:
+  def __init__(self, font_dirs: Optional[list[str]]=None, cache_file: Optional[str]=None):
+    self._font_dirs = font_dirs if font_dirs is not None else get_font_dirs()
+    self._cache_file = cache_file if cache_file is not None else get_cache_file()
+    self._fonts: dict[str, str] = {}
+    self._fonts_lower: dict[str, str] = {}
+    self._fallback_path: Optional[str] = None
+
+    self._load()
+
+
+  def get_families(self) -> list[str]:
+    return list(self._fonts.keys())
+
+
+  def get_font_path(self, family: str) -> Optional[str]:
+    font_path = self._fonts.get(family)
+    if font_path is None:
+      font_path = self._fonts_lower.get(family.lower(), self._fallback_path)
+
+    return font_path
+
+
+  def __contains__(self, family: str) -> bool:
+    return family in self._fonts
+
+
+  def rebuild(self) -> None:
+    dir_mtimes = self._scan_dir_mtimes()
+    self._set_fonts(self._index_fonts(dir_mtimes))
+    self._save(dir_mtimes)
+
+
+  def _load(self) -> None:
+    dir_mtimes = self._scan_dir_mtimes()
+
+    # Use the cached index if no font directory has changed
+    try:
+      with open(self._cache_file, encoding='utf-8') as f:
+        cache = json.load(f)
+
+      if cache.get('version') == FONT_INDEX_VERSION and cache.get('dirs') == dir_mtimes:
+        self._set_fonts(cache['fonts'])
+        return
+
+    except (OSError, ValueError, KeyError, TypeError):
+      pass
+
+    self._set_fonts(self._index_fonts(dir_mtimes))
+    self._save(dir_mtimes)
+
+
+  def _save(self, dir_mtimes: dict[str, int]) -> None:
+    cache = {'version': FONT_INDEX_VERSION, 'dirs': dir_mtimes, 'fonts': self._fonts}
+
+    # Write to a temporary file first so a crash never leaves half a cache
+    try:
+      os.makedirs(os.path.dirname(self._cache_file), exist_ok=True)
+      temp_file = f'{self._cache_file}.{os.getpid()}.tmp'
+      with open(temp_file, 'w', encoding='utf-8') as f:
+        json.dump(cache, f)
+
+      os.replace(temp_file, self._cache_file)
+
+    except OSError:
+      pass
+
+
+  def _set_fonts(self, fonts: dict[str, str]) -> None:
+    self._fonts = fonts
+    self._fonts_lower = {family.lower(): path for family, path in fonts.items()}
+    self._fallback_path = next((fonts[f] for f in FALLBACK_FAMILIES if f in fonts), None)
+
+
+  def _scan_dir_mtimes(self) -> dict[str, int]:
+    # Only directories are stat'd, adding or removing a font changes its directory mtime
+    dir_mtimes = {}
+    pending = [d for d in self._font_dirs if os.path.isdir(d)]
+    while pending:
+      dir_path = pending.pop()
+      try:
+        dir_mtimes[dir_path] = os.stat(dir_path).st_mtime_ns
+        with os.scandir(dir_path) as entries:
+          pending.extend(e.path for e in entries if e.is_dir(follow_symlinks=False))
+
+      except OSError:
+        continue
+
+    return dir_mtimes
+
+
+  def _index_fonts(self, dir_mtimes: dict[str, int]) -> dict[str, str]:
+    best = {}
+    for dir_path in sorted(dir_mtimes):
+      try:
+        with os.scandir(dir_path) as entries:
+          font_files = sorted(e.path for e in entries if e.is_file() and e.name.lower().endswith(FONT_EXTENSIONS))
+
+      except OSError:
+        continue
+
+      for font_file in font_files:
+        try:
+          fonts = read_font_names(font_file)
+
+        except (OSError, struct.error):
+          continue
+
+        for names in fonts:
+          style = names.get(NAME_SUBFAMILY, '')
+          rank = _style_rank(style)
+
+          # Register both family names, Tk reports either depending on the platform
+          for name_id in (NAME_FAMILY, NAME_TYPOGRAPHIC_FAMILY):
+            family = names.get(name_id)
+            if not family:
+              continue
+
+            if name_id == NAME_TYPOGRAPHIC_FAMILY:
+              rank = _style_rank(names.get(NAME_TYPOGRAPHIC_SUBFAMILY, style))
+
+            if family not in best or rank < best[family][0]:
+              best[family] = (rank, font_file)
+
+    return {family: font_file for family, (_, font_file) in sorted(best.items())}
@@ -0,0 +1,277 @@
+import tkinter as tk
+from tkinter import ttk
+from collections.abc import Callable
+from typing import Optional
+
+
+# FONT LIST
+class FontList(ttk.Frame):
+  # Index into the filtered fonts of the row under the keyboard cursor
+  _active = 0
+
+  def __init__(self, parent, fonts: list[str], get_font_path: Optional[Callable[[str], Optional[str]]],
+               get_photo: Callable[[str, Optional[str]], object], on_select: Callable[[str], None],
+               row_height: int=44):
+    super().__init__(master=parent)
+    self._fonts = fonts
+    self._shown = fonts
+    self._get_font_path = get_font_path
+    self._get_photo = get_photo
+    self._on_select = on_select
+    self._row_height = row_height
+
+    # Canvas items of the rows on screen, keyed by the row index
+    self._rows: dict[int, tuple[int, ...]] = {}
+
+    # Typing filters the families by name
+    self._search = tk.StringVar(self)
+    self._search.trace_add('write', lambda *args: self.set_filter(self._search.get()))
+    self._search_entry = ttk.Entry(self, textvariable=self._search)
+    self._search_entry.grid(row=0, column=0, columnspan=2, sticky='ew', padx=2, pady=2)
+
+    # Only the visible rows are ever drawn, the scroll region covers all of them
+    scrollbar = ttk.Scrollbar(self, orient='vertical')
+    scrollbar.grid(row=1, column=1, sticky='ns')
+    self._canvas = tk.Canvas(
+      self,
+      bg='white',
+      highlightthickness=0,
+      yscrollincrement=row_height,
+      yscrollcommand=scrollbar.set)
+
+    self._canvas.grid(row=1, column=0, sticky='nsew')
+    scrollbar.config(command=self._scroll_y)
+    self.rowconfigure(1, weight=1)
+    self.columnconfigure(0, weight=1)
+
+    self._canvas.bind('<Configure>', lambda event: self._render())
+    self._canvas.bind('<Button-1>', self._click)
+    self._canvas.bind('<MouseWheel>', self._wheel)  # with Windows and MacOS, but not Linux
+    self._canvas.bind('<Button-5>',   self._wheel)  # only with Linux, wheel scroll down
+    self._canvas.bind('<Button-4>',   self._wheel)  # only with Linux, wheel scroll up
+    self._search_entry.bind('<Up>', lambda event: self._move(-1))
+    self._search_entry.bind('<Down>', lambda event: self._move(1))
+    self._search_entry.bind('<Prior>', lambda event: self._move(-self._get_page_rows()))
+    self._search_entry.bind('<Next>', lambda event: self._move(self._get_page_rows()))
+    self._search_entry.bind('<Return>', lambda event: self._select(self._active))
+    self._update_scroll_region()
+
+
+  def focus_search(self) -> None:
+    # A borderless window isn't given the focus by the window manager
+    self._search_entry.focus_force()
+
+
+  def set_filter(self, text: str) -> None:
+    text = text.strip().lower()
+    self._shown = [f for f in self._fonts if text in f.lower()] if text else self._fonts
+    self._active = 0
+    self._clear_rows()
+    self._update_scroll_region()
+    self._canvas.yview_moveto(0)
+    self._render()
+
+
+  def show_font(self, family: str) -> None:
+    # Put the keyboard cursor on a family and scroll it into view
+    if family in self._shown:
+      self._active = self._shown.index(family)
+      self._canvas.yview_moveto(self._active / max(1, len(self._shown)))
+      self._clear_rows()
+      self._render()
+
+
+  def _render(self) -> None:
+    # Work out which rows intersect the visible part of the canvas
+    top = int(self._canvas.canvasy(0))
+    first = max(0, top // self._row_height)
+    last = min(len(self._shown), (top + self._canvas.winfo_height()) // self._row_height + 1)
+    visible = range(first, last)
+
+    # Drop the rows that scrolled out of view, then draw the new ones
+    for index in [i for i in self._rows if i not in visible]:
+      self._canvas.delete(*self._rows.pop(index))
+
+    for index in visible:
+      if index not in self._rows:
+        self._rows[index] = self._create_row(index)
+
+
+  def _create_row(self, index: int) -> tuple[int, ...]:
+    family = self._shown[index]
+    y = index * self._row_height
+    width = max(self._canvas.winfo_width(), 1)
+    fill = '#cce4f7' if index == self._active else ''
+    background = self._canvas.create_rectangle(0, y, width, y + self._row_height, fill=fill, outline='')
+    name = self._canvas.create_text(6, y + 2, anchor=tk.NW, text=family, fill='grey30', font='TkDefaultFont')
+    items = (background, name)
+
+    # The watermark text drawn in the font itself
+    font_file = self._get_font_path(family) if self._get_font_path is not None else None
+    photo = self._get_photo(family, font_file) if font_file is not None else None
+    if photo is not None:
+      items += (self._canvas.create_image(6, y + 18, anchor=tk.NW, image=photo),)
+
+    return items
+
+
+  def _clear_rows(self) -> None:
+    for items in self._rows.values():
+      self._canvas.delete(*items)
+
+    self._rows.clear()
+
+
+  def _update_scroll_region(self) -> None:
+    height = max(1, len(self._shown) * self._row_height)
+    self._canvas.config(scrollregion=(0, 0, 0, height))
+
+
+  def _get_page_rows(self) -> int:
+    return max(1, self._canvas.winfo_height() // self._row_height - 1)
+
+
+  def _move(self, rows: int) -> str:
+    if not self._shown:
+      return 'break'
+
+    previous = self._active
+    self._active = min(len(self._shown) - 1, max(0, self._active + rows))
+
+    # Keep the cursor row on screen
+    top = int(self._canvas.canvasy(0)) // self._row_height
+    bottom = top + self._get_page_rows()
+    if self._active < top:
+      self._canvas.yview_scroll(self._active - top, 'units')
+    elif self._active > bottom:
+      self._canvas.yview_scroll(self._active - bottom, 'units')
+
+    # Redraw the two rows whose highlight changed
+    for index in (previous, self._active):
+      if index in self._rows:
+        self._canvas.delete(*self._rows.pop(index))
+
+    self._render()
+    return 'break'
+
+
+  def _select(self, index: int) -> str:
+    if 0 <= index < len(self._shown):
+      self._on_select(self._shown[index])
+
+    return 'break'
+
+
+  def _click(self, event) -> None:
+    self._select(int(self._canvas.canvasy(event.y)) // self._row_height)
+
+
+  def _wheel(self, event) -> None:
+    # Linux reports the wheel as buttons 4 and 5, the others as a signed delta
+    if event.num == 4 or event.delta > 0:
+      self._canvas.yview_scroll(-3, 'units')
+    else:
+      self._canvas.yview_scroll(3, 'units')
+
+    self._render()
+
+
+  def _scroll_y(self, *args) -> None:
+    self._canvas.yview(*args)
+    self._render()
+
+
+# FONT PICKER
+class FontPicker(ttk.Frame):
+  _popup: Optional[tk.Toplevel] = None
+  _preview_cache = None
+  _photos = None
+
+  def __init__(self, parent, fonts: list[str], textvariable: tk.StringVar,
+               get_font_path: Optional[Callable[[str], Optional[str]]]=None,
+               get_preview_text: Optional[Callable[[], str]]=None,
+               command: Optional[Callable[[str], None]]=None, width: int=30,
+               preview_dir: Optional[str]=None):
+    super().__init__(master=parent)
+    self._fonts = fonts
+    self._textvariable = textvariable
+    self._get_font_path = get_font_path
+    self._get_preview_text = get_preview_text
+    self._command = command
+    self._preview_dir = preview_dir
+
+    # Looks like a read only combobox, the list opens below it
+    entry = ttk.Entry(self, textvariable=textvariable, width=width, state='readonly', cursor='hand2')
+    entry.pack(side=tk.LEFT, expand=True, fill=tk.BOTH)
+    entry.bind('<Button-1>', lambda event: self.open() or 'break')
+    button = ttk.Button(self, text='▾', width=2, command=self.open)
+    button.pack(side=tk.LEFT, fill=tk.Y)
+
+
+  def set_fonts(self, fonts: list[str]) -> None:
+    self._fonts = fonts
+    self.close()
+
+
+  def open(self) -> None:
+    if self._popup is not None:
+      self.close()
+      return
+
+    # Borderless window under the picker, closed when it loses the focus
+    self._popup = tk.Toplevel(self)
+    self._popup.overrideredirect(True)
+    self._popup.geometry(f'{max(self.winfo_width(), 360)}x400+{self.winfo_rootx()}+{self.winfo_rooty() + self.winfo_height()}')
+
+    font_list = FontList(self._popup, self._fonts, self._get_font_path, self._get_photo, self._font_selected)
+    font_list.pack(expand=True, fill=tk.BOTH)
+    font_list.show_font(self._textvariable.get())
+
+    self._popup.bind('<Escape>', lambda event: self.close())
+    self._popup.bind('<FocusOut>', lambda event: self.after(1, self._check_focus))
+    self._popup.update_idletasks()
+    font_list.focus_search()
+
+
+  def close(self) -> None:
+    if self._popup is not None:
+      self._popup.destroy()
+      self._popup = None
+
+
+  def _check_focus(self) -> None:
+    # Focus moving between the list's own widgets doesn't close it
+    focus = self.focus_get()
+    if self._popup is not None and (focus is None or focus.winfo_toplevel() is not self._popup):
+      self.close()
+
+
+  def _font_selected(self, family: str) -> None:
+    self._textvariable.set(family)
+    self.close()
+    if self._command is not None:
+      self._command(family)
+
+
+  def _get_photo(self, family: str, font_file: Optional[str]):
+    # Pillow is only needed once the list is opened, not to show the window
+    from PIL import ImageTk
+    from font_preview import FontPreviewCache, get_default_preview_dir
+    from glyph_cache import LRUCache
+
+    if self._preview_cache is None:
+      try:
+        self._preview_cache = FontPreviewCache(self._preview_dir or get_default_preview_dir())
+      except OSError:
+        self._preview_cache = FontPreviewCache()
+
+      self._photos = LRUCache(256)
+
+    # Fall back to the family name when there is no watermark text yet
+    text = (self._get_preview_text() if self._get_preview_text is not None else '') or family
+    preview = self._preview_cache.get_preview(text, font_file)
+    if preview is None:
+      return None
+
+    # Tk photo images are kept for the previews, not rebuilt for every scroll
+    return self._photos.get((text, font_file), lambda: ImageTk.PhotoImage(preview, master=self))
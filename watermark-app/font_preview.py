@@ -0,0 +1,128 @@
+import hashlib
+import os
+import tempfile
+from typing import Optional
+from PIL import Image, ImageDraw
+
+from font_index import get_cache_dir
+from glyph_cache import LRUCache, load_font
+from instrumentation import instrumentation
+
+# Bump when the way previews are drawn changes, so old files on disk aren't used
+PREVIEW_VERSION = 1
+
+
+def get_default_preview_dir() -> str:
+  return os.path.join(get_cache_dir(), 'font_previews')
+
+
+def render_preview(text: str, font_file: Optional[str], font_size: int=20, colour: str='black',
+                   max_width: int=320) -> Image.Image:
+  # Every preview is the ascent plus descent of its font high and starts on the
+  # ascender line, so the rows of a list line up whatever the glyphs are
+  font = load_font(font_file, font_size)
+  ascent, descent = font.getmetrics()
+  width = min(max_width, max(1, round(font.getlength(text))))
+
+  with instrumentation.measure('render_preview', text=text):
+    preview = Image.new('RGBA', (width, max(1, ascent + descent)), (0, 0, 0, 0))
+    ImageDraw.Draw(preview).text((0, 0), text, font=font, fill=colour)
+
+  return preview
+
+
+# FONT PREVIEW CACHE
+class FontPreviewCache:
+  def __init__(self, cache_dir: Optional[str]=None, font_size: int=20, colour: str='black',
+               max_width: int=320, max_previews: int=512, max_files: int=5000):
+    self._font_size = font_size
+    self._colour = colour
+    self._max_width = max_width
+
+    # Previews in memory, then optionally as PNG files keyed by the font file's mtime
+    self._previews = LRUCache(max_previews)
+    self._cache_dir = cache_dir
+    if cache_dir is not None:
+      os.makedirs(cache_dir, exist_ok=True)
+      self.prune(max_files)
+
+
+  def get_preview(self, text: str, font_file: Optional[str]) -> Optional[Image.Image]:
+    # None if the font file is gone or FreeType can't read it
+    if font_file:
+      try:
+        mtime_ns = os.stat(font_file).st_mtime_ns
+      except OSError:
+        return None
+    else:
+      mtime_ns = 0
+
+    key = (text, font_file, mtime_ns)
+    return self._previews.get(key, lambda: self._load_preview(key))
+
+
+  def prune(self, max_files: int) -> int:
+    # Keep the most recently used files, every preview text makes a new set of them
+    files = []
+    for entry in os.scandir(self._cache_dir):
+      if entry.name.endswith('.png'):
+        files.append((entry.stat().st_mtime, entry.path))
+
+    files.sort(reverse=True)
+    for _, path in files[max_files:]:
+      try:
+        os.remove(path)
+      except OSError:
+        pass
+
+    return max(0, len(files) - max_files)
+
+
+  def get_stats(self) -> dict:
+    return self._previews.stats()
+
+
+  def _get_file(self, key: tuple) -> str:
+    text, font_file, mtime_ns = key
+    name = repr((PREVIEW_VERSION, text, font_file, mtime_ns, self._font_size, self._colour, self._max_width))
+    return os.path.join(self._cache_dir, hashlib.sha1(name.encode()).hexdigest() + '.png')
+
+
+  def _load_preview(self, key: tuple) -> Optional[Image.Image]:
+    filename = self._get_file(key) if self._cache_dir is not None else None
+    if filename is not None and os.path.exists(filename):
+      try:
+        with Image.open(filename) as img:
+          img.load()
+
+        # Touch the file so pruning keeps it
+        os.utime(filename)
+        return img
+
+      except OSError:
+        pass
+
+    text, font_file, _ = key
+    try:
+      preview = render_preview(text, font_file, self._font_size, self._colour, self._max_width)
+    except OSError:
+      return None
+
+    if filename is not None:
+      self._save_preview(preview, filename)
+
+    return preview
+
+
+  def _save_preview(self, preview: Image.Image, filename: str) -> None:
+    # The disk cache is only a shortcut, a failed write is ignored
+    fd, temp_file = tempfile.mkstemp(dir=self._cache_dir, suffix='.tmp')
+    try:
+      with os.fdopen(fd, 'wb') as f:
+        preview.save(f, 'PNG')
+
+      os.replace(temp_file, filename)
+
+    except OSError:
+      if os.path.exists(temp_file):
+        os.remove(temp_file)
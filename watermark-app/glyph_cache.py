@@ -0,0 +1,162 @@
+import threading
+from collections import OrderedDict
+from collections.abc import Callable, Hashable
+from typing import Any, Optional
+from PIL import Image, ImageColor, ImageDraw, ImageFont
+
+from instrumentation import instrumentation
+
+
+# LRU CACHE
+class LRUCache:
+  def __init__(self, maxsize: int=128):
+    if maxsize < 1:
+      raise ValueError('maxsize must be at least 1')
+
+    self.maxsize = maxsize
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+    self._items = OrderedDict()
+    self._lock = threading.Lock()
+
+
+  def get(self, key: Hashable, create: Callable[[], Any]) -> Any:
+    with self._lock:
+      if key in self._items:
+        self.hits += 1
+        self._items.move_to_end(key)
+        return self._items[key]
+
+      self.misses += 1
+
+    # Create the value outside the lock, a duplicate create is harmless
+    value = create()
+    self.put(key, value)
+
+    return value
+
+
+  def put(self, key: Hashable, value: Any) -> None:
+    with self._lock:
+      self._items[key] = value
+      self._items.move_to_end(key)
+      while len(self._items) > self.maxsize:
+        self._items.popitem(last=False)
+        self.evictions += 1
+
+
+  def values(self) -> list:
+    with self._lock:
+      return list(self._items.values())
+
+
+  def items(self) -> list:
+    with self._lock:
+      return list(self._items.items())
+
+
+  def clear(self) -> None:
+    with self._lock:
+      self._items.clear()
+
+
+  def stats(self) -> dict:
+    with self._lock:
+      return {
+        'hits': self.hits,
+        'misses': self.misses,
+        'evictions': self.evictions,
+        'size': len(self._items),
+        'maxsize': self.maxsize
+      }
+
+
+  def __len__(self) -> int:
+    return len(self._items)
+
+
+# RENDERED TEXT
+class RenderedText:
+  __slots__ = ('tile', 'mask', 'text_box')
+
+  def __init__(self, tile: Image.Image, mask: Image.Image, text_box: tuple):
+    # The tile covers the text bounding box, text_box is relative to the text origin
+    self.tile = tile
+    self.mask = mask
+    self.text_box = text_box
+
+
+def load_font(font_file: Optional[str], font_size: int) -> ImageFont.FreeTypeFont:
+  # Fall back to the Pillow default font when no font file was resolved
+  if not font_file:
+    return ImageFont.load_default(size=font_size)
+
+  return ImageFont.truetype(font_file, size=font_size)
+
+
+def render_text(text: str, font: ImageFont.FreeTypeFont, colour: str) -> RenderedText:
+  text_box = font.getbbox(text)
+  width = max(1, text_box[2] - text_box[0])
+  height = max(1, text_box[3] - text_box[1])
+
+  # Rasterise the text once as an alpha mask
+  with instrumentation.measure('rasterise_text', text=text):
+    mask = Image.new('L', (width, height), 0)
+    ImageDraw.Draw(mask).text((-text_box[0], -text_box[1]), text, font=font, fill=255)
+
+  # Flood the colour channels so the edges don't blend towards black,
+  # this composites the same as a premultiplied tile would
+  tile = Image.new('RGBA', (width, height), ImageColor.getrgb(colour))
+  tile.putalpha(mask)
+
+  return RenderedText(tile, mask, text_box)
+
+
+def rotate_text(rendered: RenderedText, angle: float) -> RenderedText:
+  # The rotated tile is only used for patterns, so its text box is just its size
+  mask = rendered.mask.rotate(angle, Image.Resampling.BICUBIC, expand=True)
+  tile = rendered.tile.rotate(angle, Image.Resampling.BICUBIC, expand=True)
+  tile.putalpha(mask)
+
+  return RenderedText(tile, mask, (0, 0, mask.width, mask.height))
+
+
+# GLYPH CACHE
+class GlyphCache:
+  def __init__(self, max_fonts: int=32, max_tiles: int=128):
+    self._fonts = LRUCache(max_fonts)
+    self._tiles = LRUCache(max_tiles)
+
+
+  def get_font(self, font_file: Optional[str], font_size: int) -> ImageFont.FreeTypeFont:
+    return self._fonts.get((font_file, font_size), lambda: load_font(font_file, font_size))
+
+
+  def get_text(self, text: str, font_file: Optional[str], font_size: int, colour: str) -> RenderedText:
+    return self._tiles.get(
+      (text, font_file, font_size, colour),
+      lambda: render_text(text, self.get_font(font_file, font_size), colour))
+
+
+  def get_rotated_text(self, text: str, font_file: Optional[str], font_size: int, colour: str,
+                       angle: float) -> RenderedText:
+    if angle % 360 == 0:
+      return self.get_text(text, font_file, font_size, colour)
+
+    return self._tiles.get(
+      (text, font_file, font_size, colour, angle),
+      lambda: rotate_text(self.get_text(text, font_file, font_size, colour), angle))
+
+
+  def clear(self) -> None:
+    self._fonts.clear()
+    self._tiles.clear()
+
+
+  def stats(self) -> dict:
+    return {'fonts': self._fonts.stats(), 'tiles': self._tiles.stats()}
+
+
+# Shared cache for the whole process
+glyph_cache = GlyphCache()
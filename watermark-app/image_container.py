@@ -1,7 +1,23 @@
 import tkinter as tk
-from tkinter import ttk
-from PIL import ImageTk, Image, ImageDraw, ImageFont
-from system_fonts import SystemFonts
+from tkinter import ttk, messagebox
+from collections.abc import Callable
+from typing import Optional
+from PIL import Image
+from tiled_view import TiledRenderer
+from image_pyramid import ImagePyramid
+from image_store import ImageStore, get_image_bytes, image_store
+from image_loader import ImageLoader
+from edit_pipeline import EditPipeline, RotateOperation, WatermarkOperation, get_rotation
+from instrumentation import instrumentation
+import watermark_engine
+
+# Each wheel notch zooms by this factor, between these limits
+ZOOM_STEP = 1.25
+MIN_ZOOM = 0.02
+MAX_ZOOM = 32.0
+
+# Wheel zoom draws quick draft frames, refined once the wheel has been still this long
+REFINE_DELAY_MS = 100
 
 class AutoScrollbar(ttk.Scrollbar):
   def set(self, low, high):
@@ -21,18 +37,30 @@ class AutoScrollbar(ttk.Scrollbar):
 
 
 class ImageContainer(ttk.Frame):
-  _backup_img = None
-  _original_img = None
-  _tk_image = None
+  _pipeline = None
+  _source_file = None
+  _loading_file = None
+  _display_img = None
+  _preview_operation = None
+  _preview_key = None
+  _preview_img = None
+  _preview_id = None
+  _pyramid = None
   _scale_image = False
   _scale_factor = 1.0
+  _display_scale = 1.0
+  _refine_id = None
+  _show_overlay = False
 
-  def __init__(self, parent: tk.Tk, system_fonts: SystemFonts):
+  def __init__(self, parent: tk.Tk, pyramid_budget: int=256 * 1024 * 1024, store: ImageStore=image_store):
     # Call the parent class constructor
     super().__init__(master=parent)
 
-    # Save reference to the system fonts
-    self._system_fonts = system_fonts
+    # Memory budget in bytes for the downsampled levels of the image
+    self._pyramid_budget = pyramid_budget
+
+    # Every decoded and rendered image is accounted for in the store
+    self._store = store
 
     # Vertical and horizontal scrollbars
     vertical_scrollbar = AutoScrollbar(self, orient='vertical')
@@ -51,35 +79,88 @@ class ImageContainer(ttk.Frame):
 
     self._canvas.grid(row=0, column=0, sticky='nsew')
     self._canvas.update_idletasks()
-    vertical_scrollbar.config(command=self._canvas.yview)
-    horizontal_scrollbar.config(command=self._canvas.xview)
+    vertical_scrollbar.config(command=self._scroll_y)
+    horizontal_scrollbar.config(command=self._scroll_x)
     self.rowconfigure(0, weight=1)
     self.columnconfigure(0, weight=1)
 
+    # Only the tiles in the visible part of the canvas are rendered
+    self._renderer = TiledRenderer(self._canvas)
+    self._canvas.bind('<Configure>', lambda event: self._render())
+
+    # Images are decoded on a worker thread and handed back through after()
+    self._loader = ImageLoader(self, self._show_load_preview, self._image_loaded, self._load_failed)
+
     # Bind the mouse wheel to the canvas
-    self._canvas.bind('<MouseWheel>', None)  # with Windows and MacOS, but not Linux
-    self._canvas.bind('<Button-5>',   None)  # only with Linux, wheel scroll down
-    self._canvas.bind('<Button-4>',   None)  # only with Linux, wheel scroll up
+    self._canvas.bind('<MouseWheel>', self._wheel)  # with Windows and MacOS, but not Linux
+    self._canvas.bind('<Button-5>',   self._wheel)  # only with Linux, wheel scroll down
+    self._canvas.bind('<Button-4>',   self._wheel)  # only with Linux, wheel scroll up
+
+    # Drag the image with the left mouse button to pan
+    self._canvas.bind('<ButtonPress-1>', self._start_pan)
+    self._canvas.bind('<B1-Motion>', self._pan)
 
 
   def load_image(self, filename: str) -> None:
-    # Load the image
-    self._backup_img = Image.open(filename)
-    self._original_img = self._backup_img.copy() #Image.open(filename)
+    # Decode in the background, a newer load cancels this one
+    preview_size = (max(1, self._canvas.winfo_width()), max(1, self._canvas.winfo_height()))
+    self._loading_file = filename
+    self._loader.load(filename, preview_size)
+
+
+  def _show_load_preview(self, preview: Image.Image, full_size: tuple) -> None:
+    # Nothing can be edited until the full image arrives
+    self._release_image()
+    self._display_img = None
+    self._scale_factor = 1.0
+
+    # Stretch the low resolution preview over the full image size
+    self._renderer.set_scale(full_size[0] / preview.width)
+    self._renderer.set_image(preview)
+    scaled_width, scaled_height = self._renderer.get_scaled_size()
+    self._canvas.config(scrollregion=(0, 0, scaled_width, scaled_height))
+    self._render()
+
+
+  def _image_loaded(self, img: Image.Image) -> None:
+    self.set_image(img, self._loading_file)
+
+
+  def set_image(self, img: Image.Image, filename: Optional[str]=None, history: Optional[tuple]=None) -> None:
+    # Show an image that is already decoded, e.g. one prefetched by a session,
+    # with the edit history it had when it was last shown
+    self._loader.cancel()
+    self._clear_preview()
+    self._source_file = filename
+
+    # The pyramid only ever reads the loaded image, edits are replayed on top
+    self._release_image()
+    self._pyramid = ImagePyramid(img, self._pyramid_budget, store=self._store)
+    self._pyramid.build_async()
+
+    self._pipeline = EditPipeline(img, self._pyramid, self._store)
+    if history is not None:
+      self._pipeline.set_history(history)
+
+    self._display_img = None
     self._scale_factor = 1.0
     self._show_image()
+
+
+  def _load_failed(self, filename: str, error: Exception) -> None:
+    messagebox.showerror('Load Image', f'Could not load {filename}\n\n{error}', parent=self)
   
 
   def rotate_image(self, angle: int) -> None:
-    if self._original_img is None:
+    if self._pipeline is None:
       return
     
-    self._original_img = self._original_img.rotate(angle, expand=True)
+    self._pipeline.push(RotateOperation(angle))
     self._show_image()
 
 
   def fit_to_window(self) -> None:
-    if self._original_img is None:
+    if self._pipeline is None:
       return
     
     self._scale_image = True
@@ -87,46 +168,167 @@ class ImageContainer(ttk.Frame):
 
 
   def actual_size(self) -> None:
-    if self._original_img is None:
+    if self._pipeline is None:
       return
     
     self._scale_factor = 1.0
     self._show_image()
 
 
-  def add_watermark(self, text: str, font: str, font_size: int, colour: str) -> None:
-    if self._original_img is None:
+  def add_watermark(self, settings: watermark_engine.WatermarkSettings) -> None:
+    if self._pipeline is None:
       return
     
-    draw_img = ImageDraw.Draw(self._original_img)
-    font_file = self._system_fonts.get_font_path(font)
-    font = ImageFont.truetype(font_file, size=font_size)
+    # Committing replaces the live preview
+    self._clear_preview()
+    self._pipeline.push(WatermarkOperation(settings))
+    self._show_image()
+
 
-    text_box = draw_img.textbbox((0, 0), text, font)
-    margin = 10
-    img_width, img_height = self._original_img.size
-    position = (img_width - text_box[2] - margin, img_height - text_box[3] - margin)
-    draw_img.text(position, text, font=font, fill=colour)
+  def preview_watermark(self, settings: watermark_engine.WatermarkSettings) -> None:
+    if self._pipeline is None:
+      return
 
+    # Keep only the latest settings and render them at most once per frame
+    self._preview_operation = WatermarkOperation(settings)
+    if self._preview_id is None:
+      self._preview_id = self.after(16, self._render_preview)
+
+
+  def _render_preview(self) -> None:
+    self._preview_id = None
     self._show_image()
 
 
+  def _clear_preview(self) -> None:
+    if self._preview_id is not None:
+      self.after_cancel(self._preview_id)
+      self._preview_id = None
+
+    self._preview_operation = None
+    self._preview_key = None
+    self._preview_img = None
+
+
+  def undo(self) -> None:
+    if self._pipeline is not None and self._pipeline.undo():
+      self._show_image()
+
+
+  def redo(self) -> None:
+    if self._pipeline is not None and self._pipeline.redo():
+      self._show_image()
+
+
   def reset_image(self) -> None:
-    if self._backup_img is None:
+    if self._pipeline is None:
       return
     
-    self._original_img = self._backup_img.copy()
+    self._pipeline.reset()
     self._show_image()
 
 
+  def get_export_renderer(self) -> Optional[Callable[[], Image.Image]]:
+    # Snapshot the edits so the export thread isn't affected by later ones
+    if self._pipeline is None:
+      return None
+
+    pipeline = self._pipeline
+    operations = tuple(pipeline.get_operations())
+    return lambda: pipeline.render(1.0, operations)
+
+
+  def get_source_file(self) -> Optional[str]:
+    return self._source_file
+
+
+  def get_history(self) -> Optional[tuple]:
+    # None when nothing was ever edited, so there is nothing to keep
+    if self._pipeline is None or not self._pipeline.get_history()[0]:
+      return None
+
+    return self._pipeline.get_history()
+
+
+  def get_rotation(self) -> Optional[int]:
+    # The right angle rotation when that is all that was done to the image
+    if self._pipeline is None:
+      return None
+
+    return get_rotation(tuple(self._pipeline.get_operations()))
+
+
+  def get_source_info(self) -> dict:
+    if self._pipeline is None:
+      return {}
+
+    return self._pipeline.get_source().info
+
+
+  def close(self) -> None:
+    # Stop the loader and the pending redraws before the window goes away
+    self._loader.shutdown()
+    self._clear_preview()
+    if self._refine_id is not None:
+      self.after_cancel(self._refine_id)
+      self._refine_id = None
+
+    self._release_image()
+
+
+  def _release_image(self) -> None:
+    # Give the previous image and everything derived from it back to the store
+    if self._pyramid is not None:
+      self._pyramid.close()
+      self._pyramid = None
+
+    if self._pipeline is not None:
+      self._pipeline.close()
+      self._pipeline = None
+
+
+  def set_overlay(self, enabled: bool) -> None:
+    # The overlay shows the last frame timings, so it needs the timings recorded
+    self._show_overlay = enabled
+    if enabled:
+      instrumentation.enable()
+
+    self._update_overlay()
+
+
+  def toggle_overlay(self) -> None:
+    self.set_overlay(not self._show_overlay)
+
+
+  def get_memory_usage(self) -> int:
+    # Bytes held by the store, the live preview and the display tiles
+    memory = self._store.get_usage()['total'] + self._renderer.get_memory_usage()
+    if self._preview_img is not None:
+      memory += get_image_bytes(self._preview_img)
+
+    return memory
+
+
   def _show_image(self) -> None:
-    if self._original_img is None:
+    if self._pipeline is None:
       return
-    
-    # Destroy all existing widgets on the canvas
-    self._canvas.delete('all')
 
-    img_width, img_height = self._original_img.size
+    # A full render replaces any draft frame from the wheel
+    if self._refine_id is not None:
+      self.after_cancel(self._refine_id)
+      self._refine_id = None
+
+    self._renderer.set_draft(False)
+
+    instrumentation.start_frame()
+    with instrumentation.measure('show_image', scale=self._scale_factor):
+      self._update_display()
+
+    self._update_overlay()
+
+
+  def _update_display(self) -> None:
+    img_width, img_height = self._pipeline.get_size()
 
     if self._scale_image:
       # Get the size of the canvas
@@ -144,18 +346,125 @@ class ImageContainer(ttk.Frame):
       # Reset the scale image flag
       self._scale_image = False
 
-    # Scale the image copy to the scale factor
-    img_copy = self._original_img.copy()
-    if self._scale_factor != 1.0:
-      # Resize the image
-      new_size = (int(img_width * self._scale_factor), int(img_height * self._scale_factor))
-      img_copy = self._original_img.resize(new_size, Image.Resampling.NEAREST)
-
-    # Set the canvas scroll region to the image size
-    copy_width, copy_height = img_copy.size
-    self._canvas.config(scrollregion=(0, 0, copy_width, copy_height))
-
-    # Display the image on the canvas
-    self._tk_img = ImageTk.PhotoImage(img_copy)
-    self._canvas.create_image(0, 0, anchor=tk.NW, image=self._tk_img)
-    
\ No newline at end of file
+    # Replay the edits at display resolution when zoomed out
+    preview_scale = min(1.0, self._scale_factor)
+    display_img = self._pipeline.render(preview_scale)
+    self._display_scale = preview_scale
+
+    # Composite the live preview onto the display sized image only
+    dirty = None
+    if self._preview_operation is not None:
+      preview_key = (display_img, self._preview_operation)
+      if self._preview_key is None or self._preview_key[0] is not display_img or self._preview_key[1] != self._preview_operation:
+        # Between two previews on the same image swap the watermark in the frame
+        # on screen, only the old and new watermark areas are repainted
+        if self._preview_key is not None and self._preview_key[0] is display_img and self._preview_img is self._display_img:
+          dirty = self._preview_operation.redraw(self._preview_img, display_img, self._preview_key[1], preview_scale)
+        else:
+          self._preview_img = self._preview_operation.apply(display_img, preview_scale)
+
+        self._preview_key = preview_key
+
+      display_img = self._preview_img
+
+    # Scale first, a new image at the same scale only repaints the tiles that changed
+    self._renderer.set_scale(self._scale_factor / preview_scale)
+    if display_img is not self._display_img or dirty is not None:
+      self._display_img = display_img
+      self._renderer.set_image(display_img, dirty=dirty)
+
+    # Set the canvas scroll region to the scaled image size
+    scaled_width, scaled_height = self._renderer.get_scaled_size()
+    self._canvas.config(scrollregion=(0, 0, scaled_width, scaled_height))
+
+    # Display the visible tiles of the image
+    self._renderer.render()
+
+
+  def _render(self) -> None:
+    self._renderer.render()
+    if self._show_overlay:
+      self._update_overlay()
+
+
+  def _update_overlay(self) -> None:
+    self._canvas.delete('overlay')
+    if not self._show_overlay:
+      return
+
+    lines = [f'{name:<20}{duration * 1000:8.1f} ms' for name, duration in instrumentation.get_last_frame().items()]
+    lines.append(f'{"image memory":<20}{self.get_memory_usage() / (1024 * 1024):8.1f} MB')
+    lines.append(f'{"store budget":<20}{self._store.get_usage()["budget"] / (1024 * 1024):8.1f} MB')
+
+    # Keep the overlay pinned to the top left of the visible area
+    x, y = self._canvas.canvasx(8), self._canvas.canvasy(8)
+    text = self._canvas.create_text(x, y, anchor=tk.NW, text='\n'.join(lines), fill='yellow', font='TkFixedFont', tags='overlay')
+    self._canvas.create_rectangle(self._canvas.bbox(text), fill='black', outline='', stipple='gray50', tags='overlay')
+    self._canvas.tag_raise(text)
+
+
+  def _wheel(self, event) -> None:
+    if self._pipeline is None:
+      return
+
+    # Linux reports the wheel as buttons 4 and 5, the others as a signed delta
+    if event.num == 4 or event.delta > 0:
+      scale_factor = self._scale_factor * ZOOM_STEP
+    else:
+      scale_factor = self._scale_factor / ZOOM_STEP
+
+    self.zoom(min(MAX_ZOOM, max(MIN_ZOOM, scale_factor)), (event.x, event.y))
+
+
+  def zoom(self, scale_factor: float, anchor: Optional[tuple]=None) -> None:
+    # Zoom keeping the image point under the anchor, in window pixels, where it is
+    if self._pipeline is None or scale_factor == self._scale_factor:
+      return
+
+    if anchor is None:
+      anchor = (self._canvas.winfo_width() / 2, self._canvas.winfo_height() / 2)
+
+    ratio = scale_factor / self._scale_factor
+    anchor_x = self._canvas.canvasx(anchor[0]) * ratio
+    anchor_y = self._canvas.canvasy(anchor[1]) * ratio
+    self._scale_factor = scale_factor
+
+    # Stretch the bitmap already on screen for now, the edits are only
+    # replayed at the new scale once the wheel stops
+    with instrumentation.measure('draft_zoom', scale=scale_factor):
+      self._renderer.set_draft(True)
+      self._renderer.set_scale(scale_factor / self._display_scale)
+      scaled_width, scaled_height = self._renderer.get_scaled_size()
+      self._canvas.config(scrollregion=(0, 0, scaled_width, scaled_height))
+      self._canvas.xview_moveto((anchor_x - anchor[0]) / scaled_width)
+      self._canvas.yview_moveto((anchor_y - anchor[1]) / scaled_height)
+      self._render()
+
+    if self._refine_id is not None:
+      self.after_cancel(self._refine_id)
+
+    self._refine_id = self.after(REFINE_DELAY_MS, self._refine)
+
+
+  def _refine(self) -> None:
+    self._refine_id = None
+    self._show_image()
+
+
+  def _start_pan(self, event) -> None:
+    self._canvas.scan_mark(event.x, event.y)
+
+
+  def _pan(self, event) -> None:
+    self._canvas.scan_dragto(event.x, event.y, gain=1)
+    self._render()
+
+
+  def _scroll_x(self, *args) -> None:
+    self._canvas.xview(*args)
+    self._render()
+
+
+  def _scroll_y(self, *args) -> None:
+    self._canvas.yview(*args)
+    self._render()
@@ -0,0 +1,81 @@
+import queue
+import tkinter as tk
+from collections.abc import Callable
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Optional
+from PIL import Image
+
+from image_exporter import ExportOptions, export_image
+
+
+# IMAGE EXPORTER
+class ImageExporter:
+  _future: Optional[Future] = None
+  _poll_id: Optional[str] = None
+
+  def __init__(self, root: tk.Misc, poll_ms: int=50):
+    self._root = root
+    self._poll_ms = poll_ms
+    self._results = queue.Queue()
+    self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='ImageExporter')
+
+
+  def is_exporting(self) -> bool:
+    return self._future is not None
+
+
+  def export(self, render: Callable[[], Image.Image], filename: str, options: ExportOptions=ExportOptions(),
+             exif: Optional[bytes]=None, icc_profile: Optional[bytes]=None,
+             on_progress: Optional[Callable[[Optional[float], str], None]]=None,
+             on_done: Optional[Callable[[str], None]]=None,
+             on_error: Optional[Callable[[str, Exception], None]]=None) -> None:
+    if self.is_exporting():
+      raise RuntimeError('An export is already running')
+
+    self._on_progress = on_progress
+    self._on_done = on_done
+    self._on_error = on_error
+    self._future = self._executor.submit(self._export, render, filename, options, exif, icc_profile)
+    self._poll_id = self._root.after(self._poll_ms, self._poll)
+
+
+  def _export(self, render, filename, options, exif, icc_profile) -> None:
+    try:
+      # Rendering at full resolution happens here too, off the Tk thread
+      self._results.put(('progress', 0.0, 'Rendering'))
+      img = render()
+      progress = lambda fraction, message: self._results.put(('progress', fraction, message))
+      export_image(img, filename, options, exif, icc_profile, progress)
+      self._results.put(('done', filename, None))
+
+    except Exception as e:
+      self._results.put(('error', filename, e))
+
+
+  def _poll(self) -> None:
+    # Only forward the latest progress message, the encoder can report thousands
+    latest_progress = None
+    while True:
+      try:
+        kind, value, extra = self._results.get_nowait()
+      except queue.Empty:
+        break
+
+      if kind == 'progress':
+        latest_progress = (value, extra)
+        continue
+
+      self._future = None
+      if kind == 'done' and self._on_done is not None:
+        self._on_done(value)
+
+      elif kind == 'error' and self._on_error is not None:
+        self._on_error(value, extra)
+
+    if latest_progress is not None and self._on_progress is not None and self._future is not None:
+      self._on_progress(*latest_progress)
+
+    if self._future is not None:
+      self._poll_id = self._root.after(self._poll_ms, self._poll)
+    else:
+      self._poll_id = None
@@ -0,0 +1,118 @@
+import io
+import os
+import tempfile
+from collections.abc import Callable
+from dataclasses import dataclass
+from typing import Optional
+from PIL import Image
+
+FORMAT_EXTENSIONS = {'.jpg': 'JPEG', '.jpeg': 'JPEG', '.png': 'PNG', '.webp': 'WEBP'}
+
+# Modes each encoder can write without converting
+FORMAT_MODES = {'JPEG': ('RGB', 'L', 'CMYK'), 'PNG': ('RGB', 'RGBA', 'L', 'LA', 'P', '1', 'I'), 'WEBP': ('RGB', 'RGBA')}
+
+
+# EXPORT OPTIONS
+@dataclass(frozen=True)
+class ExportOptions:
+  format: Optional[str] = None
+  quality: int = 90
+  optimize: bool = True
+  progressive: bool = True
+  lossless: bool = False
+  keep_exif: bool = True
+  keep_icc: bool = True
+
+
+def get_format(filename: str, options: ExportOptions) -> str:
+  if options.format:
+    return options.format.upper()
+
+  extension = os.path.splitext(filename)[1].lower()
+  image_format = FORMAT_EXTENSIONS.get(extension) or Image.registered_extensions().get(extension)
+  if image_format is None:
+    raise ValueError(f'Unknown image format for {filename}')
+
+  return image_format
+
+
+def get_save_params(image_format: str, options: ExportOptions, exif: Optional[bytes]=None,
+                    icc_profile: Optional[bytes]=None) -> dict:
+  params = {}
+  if image_format == 'JPEG':
+    params.update(quality=options.quality, optimize=options.optimize, progressive=options.progressive)
+
+  elif image_format == 'PNG':
+    params.update(optimize=options.optimize)
+
+  elif image_format == 'WEBP':
+    params.update(quality=options.quality, lossless=options.lossless, method=6 if options.optimize else 4)
+
+  if options.keep_exif and exif:
+    params['exif'] = exif
+
+  if options.keep_icc and icc_profile:
+    params['icc_profile'] = icc_profile
+
+  return params
+
+
+# PROGRESS FILE
+class _ProgressFile:
+  # Counts the encoded bytes as the encoder streams them out, the final
+  # size isn't known up front so the fraction reported is None
+  def __init__(self, f, progress: Optional[Callable[[Optional[float], str], None]]):
+    self._f = f
+    self._progress = progress
+    self.bytes_written = 0
+
+
+  def write(self, data) -> int:
+    written = self._f.write(data)
+    self.bytes_written += len(data)
+    if self._progress is not None:
+      self._progress(None, f'Encoding {self.bytes_written // 1024} KB')
+
+    return written
+
+
+  def fileno(self) -> int:
+    # Without a file descriptor Pillow has to stream through write()
+    raise io.UnsupportedOperation('fileno')
+
+
+  def __getattr__(self, name: str):
+    return getattr(self._f, name)
+
+
+def export_image(img: Image.Image, filename: str, options: ExportOptions=ExportOptions(),
+                 exif: Optional[bytes]=None, icc_profile: Optional[bytes]=None,
+                 progress: Optional[Callable[[Optional[float], str], None]]=None) -> None:
+  image_format = get_format(filename, options)
+
+  # Convert to a mode the encoder accepts
+  modes = FORMAT_MODES.get(image_format)
+  if modes is not None and img.mode not in modes:
+    img = img.convert('RGBA' if 'RGBA' in modes and 'A' in img.getbands() else 'RGB')
+
+  params = get_save_params(image_format, options, exif, icc_profile)
+
+  # Encode into a temporary file next to the target and swap it in when complete
+  directory = os.path.dirname(os.path.abspath(filename))
+  fd, temp_file = tempfile.mkstemp(prefix='.', suffix='.tmp', dir=directory)
+  try:
+    with os.fdopen(fd, 'wb') as f:
+      img.save(_ProgressFile(f, progress), format=image_format, **params)
+      f.flush()
+      os.fsync(f.fileno())
+
+    os.replace(temp_file, filename)
+
+  except BaseException:
+    if os.path.exists(temp_file):
+      os.remove(temp_file)
+
+    raise
+
+  if progress is not None:
+    progress(1.0, 'Saved')
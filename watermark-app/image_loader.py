@@ -0,0 +1,118 @@
+import queue
+import tkinter as tk
+from collections.abc import Callable
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Optional
+from PIL import Image
+
+from image_orientation import apply_orientation, get_orientation
+from instrumentation import instrumentation
+
+
+# IMAGE LOADER
+class ImageLoader:
+  _future: Optional[Future] = None
+  _poll_id: Optional[str] = None
+
+  def __init__(self, root: tk.Misc,
+               on_preview: Callable[[Image.Image, tuple], None],
+               on_loaded: Callable[[Image.Image], None],
+               on_error: Callable[[str, Exception], None],
+               max_workers: int=2, poll_ms: int=20):
+    self._root = root
+    self._on_preview = on_preview
+    self._on_loaded = on_loaded
+    self._on_error = on_error
+    self._poll_ms = poll_ms
+
+    # Every load gets a new generation, results from older ones are dropped
+    self._generation = 0
+    self._results = queue.Queue()
+    self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='ImageLoader')
+
+
+  def load(self, filename: str, preview_size: Optional[tuple]=None) -> None:
+    # Cancel the previous load if it hasn't started yet
+    self.cancel()
+    generation = self._generation
+    self._future = self._executor.submit(self._decode, filename, preview_size, generation)
+
+    if self._poll_id is None:
+      self._poll_id = self._root.after(self._poll_ms, self._poll)
+
+
+  def cancel(self) -> None:
+    self._generation += 1
+    if self._future is not None:
+      self._future.cancel()
+      self._future = None
+
+
+  def shutdown(self) -> None:
+    # A decode already running finishes on its own, its result is never polled
+    self.cancel()
+    if self._poll_id is not None:
+      self._root.after_cancel(self._poll_id)
+      self._poll_id = None
+
+    self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+  def _decode(self, filename: str, preview_size: Optional[tuple], generation: int) -> None:
+    try:
+      # Let the JPEG decoder scale down by 1/2, 1/4 or 1/8 for a quick first frame
+      if preview_size is not None:
+        with Image.open(filename) as img:
+          # The preview is shown upright, so swap the size for the sideways orientations
+          full_size = img.size
+          if get_orientation(img) in (5, 6, 7, 8):
+            full_size = full_size[::-1]
+
+          if img.format == 'JPEG' and img.draft('RGB', preview_size) is not None:
+            with instrumentation.measure('decode_preview'):
+              img.load()
+
+            self._results.put(('preview', generation, apply_orientation(img.copy()), full_size))
+
+      if generation != self._generation:
+        return
+
+      with instrumentation.measure('decode', filename=filename):
+        img = Image.open(filename)
+        img.load()
+
+      with instrumentation.measure('orientation'):
+        apply_orientation(img)
+
+      self._results.put(('loaded', generation, img, None))
+
+    except Exception as e:
+      self._results.put(('error', generation, filename, e))
+
+
+  def _poll(self) -> None:
+    # Runs on the Tk thread, so the callbacks can touch widgets
+    while True:
+      try:
+        kind, generation, value, extra = self._results.get_nowait()
+      except queue.Empty:
+        break
+
+      if generation != self._generation:
+        continue
+
+      if kind == 'preview':
+        self._on_preview(value, extra)
+
+      elif kind == 'loaded':
+        self._future = None
+        self._on_loaded(value)
+
+      else:
+        self._future = None
+        self._on_error(value, extra)
+
+    if self._future is not None:
+      self._poll_id = self._root.after(self._poll_ms, self._poll)
+    else:
+      self._poll_id = None
@@ -0,0 +1,156 @@
+import os
+import struct
+import tempfile
+from typing import Optional
+from PIL import Image, ImageOps
+
+ORIENTATION_TAG = 0x0112
+
+# EXIF Orientation value -> transpose that shows the stored pixels upright
+ORIENTATION_TRANSPOSE = {
+  2: Image.Transpose.FLIP_LEFT_RIGHT,
+  3: Image.Transpose.ROTATE_180,
+  4: Image.Transpose.FLIP_TOP_BOTTOM,
+  5: Image.Transpose.TRANSPOSE,
+  6: Image.Transpose.ROTATE_270,
+  7: Image.Transpose.TRANSVERSE,
+  8: Image.Transpose.ROTATE_90
+}
+
+# Counter clockwise right angle rotations, as Image.rotate measures them
+ROTATE_TRANSPOSE = {
+  90: Image.Transpose.ROTATE_90,
+  180: Image.Transpose.ROTATE_180,
+  270: Image.Transpose.ROTATE_270
+}
+
+# A tiny image with every pixel different, used to compare orientations
+_PROBE = Image.frombytes('L', (3, 2), bytes(range(6)))
+
+
+def get_orientation(img: Image.Image) -> int:
+  return img.getexif().get(ORIENTATION_TAG, 1)
+
+
+def apply_orientation(img: Image.Image) -> Image.Image:
+  # Turn the pixels upright in place and drop the tag, so it isn't applied twice
+  ImageOps.exif_transpose(img, in_place=True)
+  return img
+
+
+def transpose(img: Image.Image, orientation: int=1, angle: int=0) -> Image.Image:
+  # Show stored pixels with the given EXIF orientation, then rotate them
+  if orientation in ORIENTATION_TRANSPOSE:
+    img = img.transpose(ORIENTATION_TRANSPOSE[orientation])
+
+  if angle % 360 in ROTATE_TRANSPOSE:
+    img = img.transpose(ROTATE_TRANSPOSE[angle % 360])
+
+  return img
+
+
+def combine_orientation(orientation: int, angle: int) -> int:
+  # The orientation that shows the stored pixels as `orientation` then `angle` would
+  target = transpose(_PROBE, orientation, angle)
+  for candidate in range(1, 9):
+    shown = transpose(_PROBE, candidate)
+    if shown.size == target.size and shown.tobytes() == target.tobytes():
+      return candidate
+
+  raise ValueError(f'Unsupported orientation {orientation!r} or angle {angle!r}')
+
+
+def _find_exif_segment(data: bytes) -> tuple[Optional[tuple], int]:
+  # Walk the JPEG header segments up to the start of the image data
+  offset = 2
+  insert_at = 2
+  while offset + 4 <= len(data) and data[offset] == 0xFF:
+    marker = data[offset + 1]
+    if marker in (0xDA, 0xD9):
+      break
+
+    length = struct.unpack_from('>H', data, offset + 2)[0]
+    if marker == 0xE1 and data[offset + 4:offset + 10] == b'Exif\0\0':
+      return (offset, offset + 2 + length), insert_at
+
+    # A new EXIF segment goes after the JFIF header
+    if marker == 0xE0:
+      insert_at = offset + 2 + length
+
+    offset += 2 + length
+
+  return None, insert_at
+
+
+def _patch_orientation(tiff: bytearray, orientation: int) -> bool:
+  # Overwrite the tag in IFD0 without touching anything else in the EXIF data
+  if len(tiff) < 8 or tiff[:2] not in (b'II', b'MM'):
+    return False
+
+  order = '<' if tiff[:2] == b'II' else '>'
+  ifd_offset = struct.unpack_from(order + 'I', tiff, 4)[0]
+  if ifd_offset + 2 > len(tiff):
+    return False
+
+  count = struct.unpack_from(order + 'H', tiff, ifd_offset)[0]
+  for index in range(count):
+    entry = ifd_offset + 2 + index * 12
+    if entry + 12 > len(tiff):
+      return False
+
+    tag, field_type, values = struct.unpack_from(order + 'HHI', tiff, entry)
+    if tag == ORIENTATION_TAG and field_type == 3 and values == 1:
+      struct.pack_into(order + 'H', tiff, entry + 8, orientation)
+      return True
+
+  return False
+
+
+def write_jpeg_orientation(input_file: str, output_file: str, angle: int) -> None:
+  # Rotate a JPEG by rewriting its Orientation tag, the compressed image data is copied as is
+  with open(input_file, 'rb') as f:
+    data = f.read()
+
+  if data[:2] != b'\xff\xd8':
+    raise ValueError(f'{input_file} is not a JPEG file')
+
+  segment, insert_at = _find_exif_segment(data)
+  if segment is not None:
+    start, end = segment
+    tiff = bytearray(data[start + 10:end])
+  else:
+    start, end = insert_at, insert_at
+    tiff = bytearray()
+
+  exif = Image.Exif()
+  if tiff:
+    exif.load(b'Exif\0\0' + bytes(tiff))
+
+  orientation = combine_orientation(exif.get(ORIENTATION_TAG, 1), angle)
+  if _patch_orientation(tiff, orientation):
+    payload = b'Exif\0\0' + bytes(tiff)
+  else:
+    exif[ORIENTATION_TAG] = orientation
+    payload = exif.tobytes()
+
+  if len(payload) + 2 > 0xFFFF:
+    raise ValueError('EXIF data is too large for a JPEG segment')
+
+  rotated = data[:start] + b'\xff\xe1' + struct.pack('>H', len(payload) + 2) + payload + data[end:]
+
+  # Same atomic replace as export_image, a failed write never leaves a partial file
+  output_dir = os.path.dirname(os.path.abspath(output_file))
+  fd, temp_file = tempfile.mkstemp(dir=output_dir, suffix='.tmp')
+  try:
+    with os.fdopen(fd, 'wb') as f:
+      f.write(rotated)
+      f.flush()
+      os.fsync(f.fileno())
+
+    os.replace(temp_file, output_file)
+
+  except BaseException:
+    if os.path.exists(temp_file):
+      os.remove(temp_file)
+
+    raise
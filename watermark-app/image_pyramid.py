@@ -0,0 +1,95 @@
+import threading
+from typing import Optional
+from PIL import Image
+
+from image_store import ImageStore, image_store
+
+# Modes Image.reduce can work on directly
+REDUCE_MODES = ('L', 'LA', 'RGB', 'RGBA', 'RGBX', 'I', 'F')
+
+
+# IMAGE PYRAMID
+class ImagePyramid:
+  _thread: Optional[threading.Thread] = None
+
+  def __init__(self, img: Image.Image, max_bytes: int=256 * 1024 * 1024, min_size: int=256,
+               store: ImageStore=image_store):
+    # Level 0 is the full resolution image, each level after halves the size
+    self._levels = [img]
+    self._max_bytes = max_bytes
+    self._min_size = min_size
+    self._store = store
+    self._cancelled = threading.Event()
+    self._lock = threading.Lock()
+
+
+  def build_async(self) -> None:
+    if self._thread is not None:
+      return
+
+    self._thread = threading.Thread(target=self._build, name='ImagePyramid', daemon=True)
+    self._thread.start()
+
+
+  def cancel(self) -> None:
+    # Wait for the worker so the caller can safely modify the source image
+    self._cancelled.set()
+    if self._thread is not None and self._thread is not threading.current_thread():
+      self._thread.join()
+
+
+  def close(self) -> None:
+    # Stop building and hand the downsampled levels back to the store
+    self.cancel()
+    with self._lock:
+      count = len(self._levels)
+      del self._levels[1:]
+
+    for index in range(1, count):
+      self._store.remove((self, index))
+
+
+  def get_level(self, scale_factor: float) -> tuple[Image.Image, float]:
+    # Pick the smallest level that is still at least as large as the requested scale
+    with self._lock:
+      levels = list(self._levels)
+
+    index = 0
+    while index + 1 < len(levels) and 1.0 / (1 << (index + 1)) >= scale_factor:
+      index += 1
+
+    return levels[index], 1.0 / (1 << index)
+
+
+  def _build(self) -> None:
+    level = self._levels[0]
+    if level.mode not in REDUCE_MODES:
+      level = level.convert('RGBA' if 'A' in level.getbands() or 'transparency' in level.info else 'RGB')
+
+    used_bytes = 0
+    while not self._cancelled.is_set() and min(level.size) // 2 >= self._min_size:
+      # Stop before going over the memory budget
+      next_bytes = (level.width // 2) * (level.height // 2) * len(level.getbands())
+      if used_bytes + next_bytes > self._max_bytes:
+        break
+
+      level = level.reduce(2)
+      used_bytes += next_bytes
+      with self._lock:
+        index = len(self._levels)
+        self._levels.append(level)
+
+      # The store may evict the level straight away when memory is tight
+      self._store.add((self, index), level, on_evict=self._level_evicted)
+
+
+  def _level_evicted(self, key: tuple) -> None:
+    # Levels stay contiguous, so dropping one drops every smaller level too
+    self._cancelled.set()
+    _, index = key
+    with self._lock:
+      count = len(self._levels)
+      del self._levels[index:]
+
+    for smaller in range(index + 1, count):
+      self._store.remove((self, smaller))
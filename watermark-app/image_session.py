@@ -0,0 +1,193 @@
+import queue
+import tkinter as tk
+from collections.abc import Callable
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Optional
+
+from batch_jobs import find_image_files
+from image_store import ImageStore, image_store
+from instrumentation import instrumentation
+from watermark_image import WatermarkImage
+
+
+def get_folder_images(folder: str) -> list[str]:
+  return find_image_files(folder, recursive=False)
+
+
+# IMAGE SESSION
+class ImageSession:
+  _poll_id: Optional[str] = None
+
+  def __init__(self, root: tk.Misc, files: list[str],
+               on_show: Callable[[int, WatermarkImage], None],
+               on_error: Callable[[str, Exception], None],
+               prefetch: int=2, max_workers: int=2, poll_ms: int=20, store: ImageStore=image_store):
+    self._root = root
+    self._files = list(files)
+    self._on_show = on_show
+    self._on_error = on_error
+    self._prefetch = prefetch
+    self._poll_ms = poll_ms
+    self._store = store
+    self._index = 0
+
+    # Decoded images around the current one, and the decodes still running.
+    # Each decode gets its own job number so a stale result is never mistaken
+    # for a newer decode of the same image.
+    self._images: dict[int, WatermarkImage] = {}
+
+    # Edit history of every image the user changed, it outlives the decoded
+    # image so the edits are replayed when the image is shown again
+    self._edits: dict[int, tuple] = {}
+    self._futures: dict[int, tuple[int, Future]] = {}
+    self._next_job = 0
+    self._outstanding = 0
+    self._results = queue.Queue()
+    self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='ImageSession')
+
+
+  def get_files(self) -> list[str]:
+    return list(self._files)
+
+
+  def get_index(self) -> int:
+    return self._index
+
+
+  def get_count(self) -> int:
+    return len(self._files)
+
+
+  def get_current(self) -> Optional[WatermarkImage]:
+    return self._images.get(self._index)
+
+
+  def get_edits(self, index: int) -> Optional[tuple]:
+    return self._edits.get(index)
+
+
+  def set_edits(self, index: int, edits: Optional[tuple]) -> None:
+    if edits is None:
+      self._edits.pop(index, None)
+    else:
+      self._edits[index] = edits
+
+
+  def go_to(self, index: int) -> bool:
+    if not 0 <= index < len(self._files):
+      return False
+
+    self._index = index
+    self._update_window()
+
+    # Show straight away when it was prefetched, otherwise once it is decoded
+    image = self._images.get(index)
+    if image is not None:
+      self._on_show(index, image)
+
+    return True
+
+
+  def next(self) -> bool:
+    return self.go_to(self._index + 1)
+
+
+  def previous(self) -> bool:
+    return self.go_to(self._index - 1)
+
+
+  def close(self) -> None:
+    if self._poll_id is not None:
+      self._root.after_cancel(self._poll_id)
+      self._poll_id = None
+
+    # Wait for the running decodes so none of their images are left in the store
+    self._executor.shutdown(wait=True, cancel_futures=True)
+    self._futures.clear()
+    while not self._results.empty():
+      _, _, _, image, _ = self._results.get_nowait()
+      if image is not None:
+        image.close()
+
+    for image in self._images.values():
+      image.close()
+
+    self._images.clear()
+    self._edits.clear()
+
+
+  def _get_window(self) -> list[int]:
+    # The current image first, then outwards, next before previous
+    window = [self._index]
+    for offset in range(1, self._prefetch + 1):
+      window.extend(index for index in (self._index + offset, self._index - offset) if 0 <= index < len(self._files))
+
+    return window
+
+
+  def _update_window(self) -> None:
+    window = self._get_window()
+
+    # Forget anything that scrolled out of range, it is decoded again if needed
+    for index in [index for index in self._images if index not in window]:
+      self._images.pop(index).close()
+
+    # Decodes that already started still report back and are dropped then
+    for index in [index for index in self._futures if index not in window]:
+      if self._futures.pop(index)[1].cancel():
+        self._outstanding -= 1
+
+    for index in window:
+      if index not in self._images and index not in self._futures:
+        self._next_job += 1
+        self._outstanding += 1
+        self._futures[index] = (self._next_job, self._executor.submit(self._decode, self._next_job, index, self._files[index]))
+
+    if self._outstanding and self._poll_id is None:
+      self._poll_id = self._root.after(self._poll_ms, self._poll)
+
+
+  def _decode(self, job: int, index: int, filename: str) -> None:
+    try:
+      with instrumentation.measure('prefetch', filename=filename):
+        image = WatermarkImage(self._root, filename, self._store)
+
+      self._results.put((job, index, filename, image, None))
+
+    except Exception as e:
+      self._results.put((job, index, filename, None, e))
+
+
+  def _poll(self) -> None:
+    # Runs on the Tk thread, so the callbacks can touch widgets
+    while True:
+      try:
+        job, index, filename, image, error = self._results.get_nowait()
+      except queue.Empty:
+        break
+
+      self._outstanding -= 1
+
+      # A decode that was already running when it went out of range
+      if self._futures.get(index, (None,))[0] != job:
+        if image is not None:
+          image.close()
+
+        continue
+
+      del self._futures[index]
+
+      if error is not None:
+        if index == self._index:
+          self._on_error(filename, error)
+
+        continue
+
+      self._images[index] = image
+      if index == self._index:
+        self._on_show(index, image)
+
+    if self._outstanding:
+      self._poll_id = self._root.after(self._poll_ms, self._poll)
+    else:
+      self._poll_id = None
@@ -0,0 +1,153 @@
+import threading
+from collections import OrderedDict
+from collections.abc import Callable, Hashable
+from typing import Any, Optional
+from PIL import Image
+
+
+def get_image_bytes(img: Image.Image) -> int:
+  return img.width * img.height * len(img.getbands())
+
+
+# STORE ENTRY
+class _Entry:
+  __slots__ = ('value', 'nbytes', 'pinned', 'on_evict')
+
+  def __init__(self, value: Any, nbytes: int, pinned: bool, on_evict: Optional[Callable[[Hashable], None]]):
+    self.value = value
+    self.nbytes = nbytes
+    self.pinned = pinned
+    self.on_evict = on_evict
+
+
+# IMAGE STORE
+class ImageStore:
+  def __init__(self, budget: int=1024 * 1024 * 1024):
+    # Pinned entries are pristine sources and are never evicted, the rest
+    # are derived buffers that can be rebuilt and go in LRU order
+    self._budget = budget
+    self._entries: OrderedDict[Hashable, _Entry] = OrderedDict()
+
+    # The same image can be held under several keys but is only counted once,
+    # as pinned if any of its keys is pinned: id -> [keys, pinned keys]
+    self._references: dict[int, list[int]] = {}
+    self._pinned_bytes = 0
+    self._derived_bytes = 0
+    self._evictions = 0
+    self._lock = threading.Lock()
+
+
+  def set_budget(self, budget: int) -> None:
+    with self._lock:
+      self._budget = budget
+      evicted = self._evict()
+
+    self._notify(evicted)
+
+
+  def add(self, key: Hashable, img: Image.Image, pinned: bool=False,
+          on_evict: Optional[Callable[[Hashable], None]]=None) -> Image.Image:
+    # Images are shared, never copied, so callers must not draw on what they get back
+    entry = _Entry(img, get_image_bytes(img), pinned, on_evict)
+    with self._lock:
+      self._remove(key)
+      self._entries[key] = entry
+      self._count(entry, 1)
+      evicted = self._evict()
+
+    self._notify(evicted)
+    return img
+
+
+  def get(self, key: Hashable) -> Optional[Image.Image]:
+    with self._lock:
+      entry = self._entries.get(key)
+      if entry is None:
+        return None
+
+      self._entries.move_to_end(key)
+      return entry.value
+
+
+  def remove(self, key: Hashable) -> None:
+    with self._lock:
+      self._remove(key)
+
+
+  def remove_where(self, predicate: Callable[[Hashable], bool]) -> None:
+    with self._lock:
+      for key in [k for k in self._entries if predicate(k)]:
+        self._remove(key)
+
+
+  def get_usage(self) -> dict:
+    with self._lock:
+      return {
+        'pinned': self._pinned_bytes,
+        'derived': self._derived_bytes,
+        'total': self._pinned_bytes + self._derived_bytes,
+        'budget': self._budget,
+        'entries': len(self._entries),
+        'evictions': self._evictions
+      }
+
+
+  def _remove(self, key: Hashable) -> None:
+    entry = self._entries.pop(key, None)
+    if entry is not None:
+      self._count(entry, -1)
+
+
+  def _count(self, entry: _Entry, delta: int) -> None:
+    # Move the image's bytes between pinned, derived and not held at all
+    references = self._references.setdefault(id(entry.value), [0, 0])
+    self._add_bytes(references, -entry.nbytes)
+    references[0] += delta
+    if entry.pinned:
+      references[1] += delta
+
+    self._add_bytes(references, entry.nbytes)
+    if references[0] == 0:
+      del self._references[id(entry.value)]
+
+
+  def _add_bytes(self, references: list[int], nbytes: int) -> None:
+    if references[0] == 0:
+      return
+
+    if references[1] > 0:
+      self._pinned_bytes += nbytes
+    else:
+      self._derived_bytes += nbytes
+
+
+  def _evict(self) -> list[tuple[Hashable, _Entry]]:
+    # Drop the least recently used derived buffers until back under budget
+    evicted = []
+    if self._pinned_bytes + self._derived_bytes <= self._budget:
+      return evicted
+
+    for key in list(self._entries):
+      if self._pinned_bytes + self._derived_bytes <= self._budget:
+        break
+
+      entry = self._entries[key]
+      if entry.pinned:
+        continue
+
+      self._remove(key)
+      self._evictions += 1
+      evicted.append((key, entry))
+
+    return evicted
+
+
+  def _notify(self, evicted: list[tuple[Hashable, _Entry]]) -> None:
+    # Called without the lock held so owners can take their own locks
+    for key, entry in evicted:
+      if entry.on_evict is not None:
+        entry.on_evict(key)
+
+
+# Shared store for the whole process
+image_store = ImageStore()
@@ -0,0 +1,110 @@
+import contextlib
+import json
+import os
+import threading
+import time
+from collections import deque
+from typing import Optional
+
+
+# INSTRUMENTATION
+class Instrumentation:
+  def __init__(self, window: int=256, max_events: int=100_000):
+    self.enabled = False
+    self._window = window
+    self._durations: dict[str, deque] = {}
+    self._last_frame: dict[str, float] = {}
+    self._events = deque(maxlen=max_events)
+    self._lock = threading.Lock()
+    self._start = time.perf_counter()
+
+
+  def enable(self, enabled: bool=True) -> None:
+    self.enabled = enabled
+
+
+  def measure(self, name: str, **args):
+    # Costs a single attribute check when instrumentation is off
+    if not self.enabled:
+      return contextlib.nullcontext()
+
+    return self._measure(name, args)
+
+
+  @contextlib.contextmanager
+  def _measure(self, name: str, args: dict):
+    start = time.perf_counter()
+    try:
+      yield
+    finally:
+      self.record(name, start, time.perf_counter() - start, args)
+
+
+  def record(self, name: str, start: float, duration: float, args: Optional[dict]=None) -> None:
+    # Chrome trace-event "complete" events use microseconds
+    event = {
+      'name': name,
+      'cat': 'watermark-app',
+      'ph': 'X',
+      'ts': (start - self._start) * 1_000_000,
+      'dur': duration * 1_000_000,
+      'pid': os.getpid(),
+      'tid': threading.get_ident()
+    }
+
+    if args:
+      event['args'] = args
+
+    with self._lock:
+      if name not in self._durations:
+        self._durations[name] = deque(maxlen=self._window)
+
+      self._durations[name].append(duration)
+      self._last_frame[name] = self._last_frame.get(name, 0.0) + duration
+      self._events.append(event)
+
+
+  def start_frame(self) -> None:
+    with self._lock:
+      self._last_frame = {}
+
+
+  def get_last_frame(self) -> dict[str, float]:
+    with self._lock:
+      return dict(self._last_frame)
+
+
+  def get_percentiles(self, name: str, percentiles: tuple=(50, 90, 99)) -> dict[int, float]:
+    with self._lock:
+      durations = sorted(self._durations.get(name, ()))
+
+    if not durations:
+      return {}
+
+    return {p: durations[min(len(durations) - 1, int(len(durations) * p / 100))] for p in percentiles}
+
+
+  def get_summary(self) -> dict[str, dict]:
+    with self._lock:
+      names = list(self._durations)
+
+    return {name: self.get_percentiles(name) for name in names}
+
+
+  def dump_trace(self, filename: str) -> None:
+    with self._lock:
+      events = list(self._events)
+
+    with open(filename, 'w') as f:
+      json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+
+
+  def clear(self) -> None:
+    with self._lock:
+      self._durations.clear()
+      self._last_frame.clear()
+      self._events.clear()
+
+
+# Shared instance, enabled from the command line
+instrumentation = Instrumentation()
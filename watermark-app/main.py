@@ -1,75 +1,356 @@
+import builtins
+import sys
+import threading
+import time
+
+# Start of the app as near as this module can measure it, for --profile-startup
+_START_TIME = time.perf_counter()
+
+# With --profile-startup the first import of every module on the Tk thread is
+# timed, including the modules it imports, like python -X importtime. Checked
+# before argparse runs, so the module level imports below are timed too.
+_import_times: list[list] = []
+_import_depth = 0
+_builtin_import = builtins.__import__
+
+
+def _timed_import(name, globals=None, locals=None, fromlist=(), level=0):
+  global _import_depth
+  if level or name in sys.modules or threading.current_thread() is not threading.main_thread():
+    return _builtin_import(name, globals, locals, fromlist, level)
+
+  # [depth, module, seconds], added before the nested imports so the order is kept
+  entry = [_import_depth, name, 0.0]
+  _import_times.append(entry)
+  _import_depth += 1
+  start = time.perf_counter()
+  try:
+    return _builtin_import(name, globals, locals, fromlist, level)
+  finally:
+    entry[2] = time.perf_counter() - start
+    _import_depth -= 1
+
+
+if '--profile-startup' in sys.argv[1:]:
+  builtins.__import__ = _timed_import
+
+import argparse
+import dataclasses
+import os
 import tkinter as tk
-from tkinter import ttk, filedialog
-from ctypes import windll
+from tkinter import ttk, filedialog, messagebox
+from typing import TYPE_CHECKING, Optional
 
 from control_panel import WatermarkControlPanel, ImageControlPanel
-from image_container import ImageContainer
+from instrumentation import instrumentation
 from system_fonts import SystemFonts
 
+# Everything that pulls in Pillow, NumPy or multiprocessing is imported once
+# the window is showing, or when it is first used
+if TYPE_CHECKING:
+  from watermark_engine import WatermarkSettings
+
+
+def set_dpi_awareness() -> None:
+  # Remove blurry text on high DPI screens, only Windows needs to be told
+  if sys.platform != 'win32':
+    return
+
+  try:
+    from ctypes import windll
+    windll.shcore.SetProcessDpiAwareness(1)
+  except (AttributeError, OSError):
+    pass
+
 
 class WatermarkApp:
-  def __init__(self):
+  # Set when a folder or several files are open
+  _session = None
+  _session_index: Optional[int] = None
+
+  # The last watermark added, applied to every image in a session
+  _watermark_settings = None
+
+  # The last loaded profile, supplies the settings the panel has no inputs for
+  _profile = None
+
+  # Created on the first save
+  _image_exporter = None
+
+  def __init__(self, profile_startup: bool=False):
+    # Time taken by each step up to the fonts being ready, printed with --profile-startup
+    self._profile_startup = profile_startup
+    self._phases = [('start', _START_TIME)]
+    self._mark_phase('imports')
+
     # Create the root window
-    windll.shcore.SetProcessDpiAwareness(1) # Remove blurry text on high DPI screens
+    set_dpi_awareness()
     self._root_window = tk.Tk()
     self._root_window.title('Image Watermarker')
     self._root_window.geometry('1280x800')
     self._root_window.minsize(640, 400)
 
-    # Cache the system fonts
-    self._system_fonts = SystemFonts(self._root_window)
-
     # Hide the root window untill all
     # widgets are created and positioned
     self._root_window.withdraw()
+    self._mark_phase('create window')
+
+    # Scan the system fonts on a worker thread, the font list is filled in when it's done
+    self._system_fonts = SystemFonts(self._root_window, fonts_loaded=self._fonts_loaded)
 
     # Load the theme
     self._load_theme()
+    self._mark_phase('load theme')
 
     # Create the control panel
-    self._watermark_control_panel = WatermarkControlPanel(self._root_window, self._system_fonts.get_tk_fonts(), self._add_watermark)
+    self._watermark_control_panel = WatermarkControlPanel(
+      self._root_window,
+      self._system_fonts.get_tk_fonts(),
+      self._add_watermark,
+      self._preview_watermark,
+      self._save_profile,
+      self._load_profile,
+      self._system_fonts.get_font_path)
+
     self._watermark_control_panel.pack(side=tk.TOP, expand=False, fill=tk.X, padx=5, pady=5)
 
     # Create the image control panel
     self._image_control_panel = ImageControlPanel(
       self._root_window,
       self._load_image,
+      self._load_folder,
       self._save_image,
       self._fit_to_window,
       self._actual_size,
       self._rotate_image,
-      self._reset_image)
+      self._reset_image,
+      self._undo,
+      self._redo,
+      self._previous_image,
+      self._next_image)
     
     self._image_control_panel.pack(side=tk.LEFT, expand=False, fill=tk.Y, padx=5, pady=5)
+    self._mark_phase('control panels')
+
+    # Center and show the root window before anything heavy is imported
+    self._center_window(self._root_window)
+    self._root_window.deiconify()
+    self._root_window.update()
+    self._mark_phase('show window')
 
     # Create the image container
-    self._image_container = ImageContainer(self._root_window, self._system_fonts)
+    from image_container import ImageContainer
+    self._image_container = ImageContainer(self._root_window)
     self._image_container.pack(side=tk.LEFT, expand=True, fill=tk.BOTH)
+    self._mark_phase('image container')
 
-    # Center the root window
-    self._center_window(self._root_window)
+    # Keyboard shortcuts for undo and redo
+    self._root_window.bind('<Control-z>', lambda event: self._undo())
+    self._root_window.bind('<Control-y>', lambda event: self._redo())
 
-    # Show the root window
-    self._root_window.deiconify()
+    # Keyboard shortcuts for stepping through a session
+    self._root_window.bind('<Prior>', lambda event: self._previous_image())
+    self._root_window.bind('<Next>', lambda event: self._next_image())
+
+    # Toggle the timing overlay
+    self._root_window.bind('<F12>', lambda event: self._image_container.toggle_overlay())
+
+    # Stop the background work when the window is closed
+    self._root_window.protocol('WM_DELETE_WINDOW', self._close)
 
 
   def run(self):
     self._root_window.mainloop()
 
-  
+
+  def set_overlay(self, enabled: bool) -> None:
+    self._image_container.set_overlay(enabled)
+
+
+  def _close(self) -> None:
+    self._close_session()
+    self._image_container.close()
+    self._root_window.destroy()
+
+
+  def _mark_phase(self, name: str) -> None:
+    self._phases.append((name, time.perf_counter()))
+
+    # Startup is over once the image container is built and the fonts are scanned
+    finished = {'image container', 'font scan'}
+    if self._profile_startup and name in finished and finished <= {phase for phase, _ in self._phases}:
+      self._print_startup_profile()
+
+
+  def _print_startup_profile(self) -> None:
+    times = dict(self._phases)
+    lines = []
+    start = _START_TIME
+    for name, end in self._phases[1:]:
+      if name == 'font scan':
+        # The scan runs on a worker thread alongside the steps after the window was created
+        lines.append(f'{name:<20}{(end - times["create window"]) * 1000:8.1f} ms')
+      else:
+        lines.append(f'{name:<20}{(end - start) * 1000:8.1f} ms')
+        start = end
+
+    lines.append(f'{"window shown after":<20}{(times["show window"] - _START_TIME) * 1000:8.1f} ms')
+    lines.append(f'{"modules loaded":<20}{len(sys.modules):8d}')
+
+    # Imports of a millisecond or more, nested ones indented under the module that imported them
+    lines.append('imports')
+    for depth, name, seconds in _import_times:
+      if seconds >= 0.001:
+        lines.append(f'{"  " * (depth + 1) + name:<40}{seconds * 1000:8.1f} ms')
+
+    print('\n'.join(lines), file=sys.stderr)
+
+
+  def _fonts_loaded(self, fonts: list[str]) -> None:
+    self._watermark_control_panel.set_fonts(fonts)
+    self._mark_phase('font scan')
+
+
   def _load_image(self) -> None:
-    filename = filedialog.askopenfilename(
+    filenames = filedialog.askopenfilenames(
       title='Select an image',
       filetypes=[('Image files', '*.png *.jpg *.jpeg')]
     )
 
-    if filename:
+    if len(filenames) == 1:
       # Load the image
-      self._image_container.load_image(filename)
+      self._close_session()
+      self._image_container.load_image(filenames[0])
+      self._root_window.title(f'Image Watermarker - {os.path.basename(filenames[0])}')
+
+    elif filenames:
+      self._open_session(list(filenames))
+
+
+  def _load_folder(self) -> None:
+    folder = filedialog.askdirectory(title='Select a folder')
+    if not folder:
+      return
+
+    from image_session import get_folder_images
+    filenames = get_folder_images(folder)
+    if filenames:
+      self._open_session(filenames)
+    else:
+      messagebox.showinfo('Load Folder', f'There are no images in {folder}', parent=self._root_window)
+
+
+  def _open_session(self, filenames: list[str]) -> None:
+    # Neighbouring images are decoded in the background while one is shown
+    from image_session import ImageSession
+    self._close_session()
+    self._session = ImageSession(self._root_window, filenames, self._show_session_image, self._session_load_failed)
+    self._session.go_to(0)
+
+
+  def _close_session(self) -> None:
+    if self._session is not None:
+      self._session.close()
+      self._session = None
+      self._session_index = None
+
+
+  def _show_session_image(self, index: int, watermark_image) -> None:
+    # Keep the edits of the image being left, they are replayed when it is shown again
+    if self._session_index is not None:
+      self._session.set_edits(self._session_index, self._image_container.get_history())
+
+    self._session_index = index
+    edits = self._session.get_edits(index)
+    self._image_container.set_image(watermark_image.get_original_image(), watermark_image.get_file(), edits)
+    if edits is None and self._watermark_settings is not None:
+      self._image_container.add_watermark(self._watermark_settings)
+
+    filename = os.path.basename(self._session.get_files()[index])
+    self._root_window.title(f'Image Watermarker - {filename} ({index + 1}/{self._session.get_count()})')
+
+
+  def _session_load_failed(self, filename: str, error: Exception) -> None:
+    messagebox.showerror('Load Image', f'Could not load {filename}\n\n{error}', parent=self._root_window)
+
+
+  def _previous_image(self) -> None:
+    if self._session is not None:
+      self._session.previous()
+
+
+  def _next_image(self) -> None:
+    if self._session is not None:
+      self._session.next()
 
   
   def _save_image(self) -> None:
-    print(f'{self.__class__.__name__}: _save_image() called.')
+    render = self._image_container.get_export_renderer()
+    if render is None or (self._image_exporter is not None and self._image_exporter.is_exporting()):
+      return
+
+    # Exports run on a worker thread
+    from image_export_worker import ImageExporter
+    from image_exporter import ExportOptions
+    if self._image_exporter is None:
+      self._image_exporter = ImageExporter(self._root_window)
+
+    filename = filedialog.asksaveasfilename(
+      title='Save image',
+      defaultextension='.jpg',
+      filetypes=[('JPEG', '*.jpg *.jpeg'), ('PNG', '*.png'), ('WebP', '*.webp')]
+    )
+
+    if filename and self._save_rotated_jpeg(filename):
+      return
+
+    if filename:
+      # Render at full resolution and encode in the background
+      source_info = self._image_container.get_source_info()
+      self._image_exporter.export(
+        render,
+        filename,
+        ExportOptions(quality=self._image_control_panel.get_quality()),
+        source_info.get('exif'),
+        source_info.get('icc_profile'),
+        on_progress=self._image_control_panel.set_progress,
+        on_done=self._image_saved,
+        on_error=self._save_failed)
+
+
+  def _save_rotated_jpeg(self, filename: str) -> bool:
+    # A JPEG that was only rotated is copied with a new Orientation tag instead of re-encoded
+    angle = self._image_container.get_rotation()
+    source_file = self._image_container.get_source_file()
+    if not self._image_control_panel.get_lossless_rotation() or angle is None or source_file is None:
+      return False
+
+    from image_exporter import ExportOptions, get_format
+    from image_orientation import write_jpeg_orientation
+    options = ExportOptions()
+    try:
+      if get_format(source_file, options) != 'JPEG' or get_format(filename, options) != 'JPEG':
+        return False
+    except ValueError:
+      return False
+
+    try:
+      write_jpeg_orientation(source_file, filename, angle)
+    except (OSError, ValueError) as e:
+      self._save_failed(filename, e)
+      return True
+
+    self._image_saved(filename)
+    return True
+
+
+  def _image_saved(self, filename: str) -> None:
+    self._image_control_panel.set_progress(1.0, f'Saved {os.path.basename(filename)}')
+
+
+  def _save_failed(self, filename: str, error: Exception) -> None:
+    self._image_control_panel.set_progress(0.0, 'Save failed')
+    messagebox.showerror('Save Image', f'Could not save {filename}\n\n{error}', parent=self._root_window)
 
 
   def _actual_size(self) -> None:
@@ -85,17 +366,103 @@ class WatermarkApp:
 
 
   def _add_watermark(self) -> None:
-    self._image_container.add_watermark(
-      self._watermark_control_panel.get_watermark_text(),
-      self._watermark_control_panel.get_watermark_font(),
-      self._watermark_control_panel.get_watermark_font_size(),
-      self._watermark_control_panel.get_watermark_colour())
+    settings = self._get_watermark_settings()
+    self._image_container.add_watermark(settings)
+
+    # Carry the watermark over to the other images in the session
+    self._watermark_settings = settings
+
+
+  def _preview_watermark(self) -> None:
+    self._image_container.preview_watermark(self._get_watermark_settings())
+
+
+  def _get_watermark_settings(self) -> 'WatermarkSettings':
+    from watermark_engine import WatermarkSettings
+    profile = self._profile or WatermarkSettings()
+    panel = self._watermark_control_panel
+    font = panel.get_watermark_font()
+
+    # The size and margin are either pixels or a percentage of the image
+    font_size = panel.get_watermark_font_size()
+    margin = panel.get_watermark_margin()
+    size_reference = panel.get_watermark_size_reference()
+    if size_reference is None:
+      sizes = {'font_size': max(1, round(font_size)), 'relative_size': 0.0, 'margin': round(margin), 'relative_margin': 0.0}
+    else:
+      # A zero relative margin falls back to the pixel margin, so that has to be zero too
+      sizes = {'relative_size': font_size, 'size_reference': size_reference, 'relative_margin': margin,
+               'margin': profile.margin if margin else 0}
+
+    return dataclasses.replace(
+      profile,
+      text=panel.get_watermark_text(),
+      font_file=self._system_fonts.get_font_path(font),
+      font_family=font,
+      colour=panel.get_watermark_colour(),
+      opacity=panel.get_watermark_opacity(),
+      blend_mode=panel.get_watermark_blend_mode(),
+      mode=panel.get_watermark_mode(),
+      placement=panel.get_watermark_placement(),
+      **sizes)
+
+
+  def _save_profile(self) -> None:
+    filename = filedialog.asksaveasfilename(
+      title='Save watermark profile',
+      defaultextension='.json',
+      filetypes=[('Watermark profile', '*.json')]
+    )
+
+    if not filename:
+      return
+
+    try:
+      from watermark_profile import save_profile
+      save_profile(self._get_watermark_settings(), filename)
+    except (OSError, ValueError) as e:
+      messagebox.showerror('Save Profile', f'Could not save {filename}\n\n{e}', parent=self._root_window)
+
+
+  def _load_profile(self) -> None:
+    filename = filedialog.askopenfilename(
+      title='Load watermark profile',
+      filetypes=[('Watermark profile', '*.json')]
+    )
+
+    if not filename:
+      return
+
+    try:
+      from watermark_profile import load_profile
+      self._profile = load_profile(filename)
+    except (OSError, ValueError, TypeError) as e:
+      messagebox.showerror('Load Profile', f'Could not load {filename}\n\n{e}', parent=self._root_window)
+      return
+
+    profile = self._profile
+    if profile.relative_size > 0:
+      font_size, size_reference, margin = profile.relative_size, profile.size_reference, profile.relative_margin
+    else:
+      font_size, size_reference, margin = profile.font_size, None, profile.margin
+
+    self._watermark_control_panel.set_watermark(
+      profile.text, profile.font_family, font_size, size_reference, profile.colour, profile.opacity,
+      profile.blend_mode, profile.mode, profile.placement, margin)
     
 
   def _reset_image(self) -> None:
     self._image_container.reset_image()
 
 
+  def _undo(self) -> None:
+    self._image_container.undo()
+
+
+  def _redo(self) -> None:
+    self._image_container.redo()
+
+
   def _load_theme(self) -> None:
     # Load the Azure-ttk theme
     #self._root_window.tk.call('source', 'static/Azure-ttk/azure.tcl')
@@ -134,6 +501,30 @@ class WatermarkApp:
     window.geometry(f"{width}x{height}+{x}+{y}")
 
 
+def _parse_args() -> argparse.Namespace:
+  parser = argparse.ArgumentParser(description='Image Watermarker')
+  parser.add_argument('--instrument', action='store_true', help='record timings of the image hot paths')
+  parser.add_argument('--overlay', action='store_true', help='show the timing overlay on the image (toggle with F12)')
+  parser.add_argument('--trace', help='write a Chrome trace-event JSON file on exit')
+  parser.add_argument('--memory-budget', type=int, default=1024, help='megabytes of decoded images to keep in memory')
+  parser.add_argument('--profile-startup', action='store_true', help='print how long each step of startup took')
+  return parser.parse_args()
+
+
 if __name__ == '__main__':
-  app = WatermarkApp()
+  args = _parse_args()
+  if args.instrument or args.trace:
+    instrumentation.enable()
+
+  app = WatermarkApp(args.profile_startup)
+
+  # Nothing is decoded before the event loop runs, so the store can wait for the window
+  from image_store import image_store
+  image_store.set_budget(args.memory_budget * 1024 * 1024)
+  if args.overlay:
+    app.set_overlay(True)
+
   app.run()
+
+  if args.trace:
+    instrumentation.dump_trace(args.trace)
@@ -0,0 +1,160 @@
+import dataclasses
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+from typing import Optional
+
+from font_index import get_cache_dir
+
+
+def get_default_cache_file() -> str:
+  return os.path.join(get_cache_dir(), 'results.db')
+
+
+def hash_file(path: str, chunk_size: int=1024 * 1024) -> str:
+  digest = hashlib.sha256()
+  with open(path, 'rb') as f:
+    while chunk := f.read(chunk_size):
+      digest.update(chunk)
+
+  return digest.hexdigest()
+
+
+def get_profile_key(settings, options, image_format: Optional[str]=None) -> str:
+  # Any change to the watermark or the output settings gives a new key. The
+  # format is usually taken from the output file, so it is passed in resolved.
+  profile = {'settings': dataclasses.asdict(settings), 'options': dataclasses.asdict(options), 'format': image_format}
+  return hashlib.sha256(json.dumps(profile, sort_keys=True).encode()).hexdigest()
+
+
+def copy_file(source_file: str, output_file: str) -> None:
+  # Through a temporary file, so a reader never sees half a copy
+  output_dir = os.path.dirname(os.path.abspath(output_file))
+  os.makedirs(output_dir, exist_ok=True)
+  fd, temp_file = tempfile.mkstemp(dir=output_dir, suffix='.tmp')
+  os.close(fd)
+  try:
+    shutil.copyfile(source_file, temp_file)
+    os.replace(temp_file, output_file)
+  except BaseException:
+    os.remove(temp_file)
+    raise
+
+
+# RESULT CACHE
+class ResultCache:
+  def __init__(self, db_file: Optional[str]=None):
+    # Opened once per process, sqlite serialises the writers
+    db_file = db_file or get_default_cache_file()
+    os.makedirs(os.path.dirname(os.path.abspath(db_file)), exist_ok=True)
+    self._db = sqlite3.connect(db_file, timeout=30)
+    self._db.execute('PRAGMA journal_mode=WAL')
+
+    # Input digests are remembered by size and mtime so unchanged files aren't hashed again
+    self._db.execute(
+      'CREATE TABLE IF NOT EXISTS inputs (path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, digest TEXT, used_at REAL)')
+    self._db.execute(
+      'CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, output_file TEXT, output_digest TEXT, '
+      'output_size INTEGER, output_mtime_ns INTEGER, created_at REAL, used_at REAL)')
+    self._db.commit()
+
+
+  def get_input_digest(self, path: str) -> str:
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    row = self._db.execute('SELECT size, mtime_ns, digest FROM inputs WHERE path = ?', (path,)).fetchone()
+    if row is not None and row[:2] == (stat.st_size, stat.st_mtime_ns):
+      self._db.execute('UPDATE inputs SET used_at = ? WHERE path = ?', (time.time(), path))
+      self._db.commit()
+      return row[2]
+
+    digest = hash_file(path)
+    self._db.execute(
+      'INSERT OR REPLACE INTO inputs VALUES (?, ?, ?, ?, ?)', (path, stat.st_size, stat.st_mtime_ns, digest, time.time()))
+    self._db.commit()
+    return digest
+
+
+  def get_key(self, input_digest: str, profile_key: str) -> str:
+    return hashlib.sha256(f'{input_digest}:{profile_key}'.encode()).hexdigest()
+
+
+  def lookup(self, key: str, output_file: str) -> bool:
+    # True when output_file now holds the cached result, without decoding anything
+    row = self._db.execute(
+      'SELECT output_file, output_digest, output_size, output_mtime_ns FROM results WHERE key = ?', (key,)).fetchone()
+    if row is None:
+      return False
+
+    cached_file, cached_digest, cached_size, cached_mtime_ns = row
+    if not self._is_valid(cached_file, cached_digest, cached_size, cached_mtime_ns):
+      self._db.execute('DELETE FROM results WHERE key = ?', (key,))
+      self._db.commit()
+      return False
+
+    # The same result was written somewhere else, copy it instead of encoding again
+    if os.path.abspath(cached_file) != os.path.abspath(output_file):
+      copy_file(cached_file, output_file)
+
+    self._db.execute('UPDATE results SET used_at = ? WHERE key = ?', (time.time(), key))
+    self._db.commit()
+    return True
+
+
+  def store(self, key: str, output_file: str) -> None:
+    stat = os.stat(output_file)
+    now = time.time()
+    self._db.execute(
+      'INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?)',
+      (key, os.path.abspath(output_file), hash_file(output_file), stat.st_size, stat.st_mtime_ns, now, now))
+    self._db.commit()
+
+
+  def prune(self, max_age: Optional[float]=None, max_bytes: Optional[int]=None) -> int:
+    # Drop entries unused for max_age seconds, then the least recently used
+    # until the outputs they point at add up to no more than max_bytes
+    removed = 0
+    if max_age is not None:
+      cutoff = time.time() - max_age
+      removed += self._db.execute('DELETE FROM results WHERE used_at < ?', (cutoff,)).rowcount
+      self._db.execute('DELETE FROM inputs WHERE used_at < ?', (cutoff,))
+
+    if max_bytes is not None:
+      total = 0
+      stale = []
+      for key, output_size in self._db.execute('SELECT key, output_size FROM results ORDER BY used_at DESC').fetchall():
+        total += output_size
+        if total > max_bytes:
+          stale.append((key,))
+
+      self._db.executemany('DELETE FROM results WHERE key = ?', stale)
+      removed += len(stale)
+
+    self._db.commit()
+    return removed
+
+
+  def get_stats(self) -> dict:
+    entries, output_bytes = self._db.execute('SELECT COUNT(*), COALESCE(SUM(output_size), 0) FROM results').fetchone()
+    return {'entries': entries, 'bytes': output_bytes}
+
+
+  def close(self) -> None:
+    self._db.close()
+
+
+  def _is_valid(self, output_file: str, digest: str, size: int, mtime_ns: int) -> bool:
+    # An untouched output is trusted, a touched one has to hash the same
+    try:
+      stat = os.stat(output_file)
+    except OSError:
+      return False
+
+    if stat.st_size != size:
+      return False
+
+    return stat.st_mtime_ns == mtime_ns or hash_file(output_file) == digest
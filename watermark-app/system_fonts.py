@@ -1,27 +1,79 @@
-from matplotlib import font_manager
+import queue
+import sys
+import threading
 import tkinter as tk
 from tkinter import font
+from collections.abc import Callable
+from typing import Optional
+
+from font_index import FontIndex
 
 
 class SystemFonts():
-  def __init__(self, root: tk.Tk):
+  _font_index: Optional[FontIndex] = None
+  _tk_font_list: list[str] = []
+
+  def __init__(self, root: tk.Tk, font_index: Optional[FontIndex]=None,
+               fonts_loaded: Optional[Callable[[list[str]], None]]=None, poll_ms: int=20):
     self.root = root
+    self._font_index = font_index
 
-    self._cache_system_fonts()
+    # With a callback the font files are scanned on a worker thread, the
+    # callback gets the font list on the Tk thread once the scan is done
+    if fonts_loaded is None:
+      self._cache_system_fonts()
+      return
+
+    self._fonts_loaded = fonts_loaded
+    self._poll_ms = poll_ms
+    self._results = queue.Queue()
+    threading.Thread(target=self._scan_fonts, daemon=True).start()
+    self.root.after(self._poll_ms, self._poll)
 
 
   def get_tk_fonts(self) -> list[str]:
     return list(self._tk_font_list)
-  
 
-  def get_font_path(self, font: str) -> str:
-    return self._mp_font_dict.get(font, 'Arial')
 
-  
+  def get_font_path(self, font: str) -> Optional[str]:
+    # None, for the default font, until the scan is done
+    if self._font_index is None:
+      return None
+
+    return self._font_index.get_font_path(font)
+
+
+  def _scan_fonts(self) -> None:
+    try:
+      self._results.put(self._font_index or FontIndex())
+    except Exception as e:
+      # Without an index only the default font is offered
+      print(f'Font scan failed: {type(e).__name__}: {e}', file=sys.stderr)
+      self._results.put(None)
+
+
+  def _poll(self) -> None:
+    try:
+      font_index = self._results.get_nowait()
+    except queue.Empty:
+      self.root.after(self._poll_ms, self._poll)
+      return
+
+    # Tk can only be asked for its font families on its own thread
+    if font_index is not None:
+      self._font_index = font_index
+      self._cache_system_fonts()
+
+    self._fonts_loaded(self.get_tk_fonts())
+
+
   def _cache_system_fonts(self) -> None:
-    self._mp_font_dict = {font.name: font.fname for font in font_manager.fontManager.ttflist}
-    # Don't know why tkinter and matplotlib system fonts don't match just keep the ones that do
-    self._tk_font_list = [f for f in font.families() if f in self._mp_font_dict.keys()]
+    # The index is read from the on disk cache unless a font directory changed
+    if self._font_index is None:
+      self._font_index = FontIndex()
+
+    # Only keep the fonts tkinter can display that also have a font file
+    self._tk_font_list = [f for f in set(font.families(self.root)) if f in self._font_index]
     self._tk_font_list.sort()
 
 
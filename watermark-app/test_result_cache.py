@@ -0,0 +1,43 @@
+import os
+import tempfile
+import unittest
+from PIL import Image
+
+from result_cache import ResultCache
+from watermark_engine import WatermarkSettings, watermark_file
+
+
+class ResultCacheTest(unittest.TestCase):
+  def setUp(self):
+    self._temp_dir = tempfile.TemporaryDirectory()
+    self._dir = self._temp_dir.name
+    self._input_file = os.path.join(self._dir, 'a.jpg')
+    Image.new('RGB', (64, 48), 'white').save(self._input_file)
+    os.makedirs(os.path.join(self._dir, 'out'))
+    self._cache = ResultCache(os.path.join(self._dir, 'results.db'))
+
+
+  def tearDown(self):
+    self._cache.close()
+    self._temp_dir.cleanup()
+
+
+  def test_same_output_is_cached(self):
+    settings = WatermarkSettings(text='Test')
+    output_file = os.path.join(self._dir, 'out', 'a.png')
+    self.assertTrue(watermark_file(self._input_file, output_file, settings, cache=self._cache))
+    self.assertFalse(watermark_file(self._input_file, output_file, settings, cache=self._cache))
+
+
+  def test_output_formats_are_cached_separately(self):
+    # One input exported to two extensions must be encoded for each of them
+    settings = WatermarkSettings(text='Test')
+    for extension, image_format in (('.png', 'PNG'), ('.webp', 'WEBP')):
+      output_file = os.path.join(self._dir, 'out', 'a' + extension)
+      self.assertTrue(watermark_file(self._input_file, output_file, settings, cache=self._cache))
+      with Image.open(output_file) as img:
+        self.assertEqual(img.format, image_format)
+
+
+if __name__ == '__main__':
+  unittest.main()
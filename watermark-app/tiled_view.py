@@ -0,0 +1,226 @@
+import tkinter as tk
+from typing import Optional
+from PIL import ImageTk, Image
+
+from glyph_cache import LRUCache
+from instrumentation import instrumentation
+
+# Modes a Tk photo image can be repainted in place with
+POOLED_MODES = ('RGB', 'RGBA')
+
+# TILED RENDERER
+class TiledRenderer:
+  _img: Optional[Image.Image] = None
+  _scale_factor: float = 1.0
+  _draft: bool = False
+
+  def __init__(self, canvas: tk.Canvas, tile_size: int=256, max_tiles: int=256):
+    self._canvas = canvas
+    self._tile_size = tile_size
+
+    # Tk photo images keyed by (zoom level, tile x, tile y)
+    self._tile_cache = LRUCache(max_tiles)
+
+    # Canvas items currently placed, keyed by (tile x, tile y)
+    self._items: dict[tuple[int, int], tuple[int, ImageTk.PhotoImage]] = {}
+
+    # Hidden canvas items and photo images of stale tiles, reused instead of
+    # asking Tk to allocate new ones. Photo images are keyed by (mode, size).
+    self._spare_items: list[int] = []
+    self._spare_photos: dict[tuple, list[ImageTk.PhotoImage]] = {}
+    self._max_spare_photos = max_tiles
+
+
+  def set_image(self, img: Optional[Image.Image], dirty: Optional[tuple]=None) -> None:
+    # dirty is the box, in image pixels, that changed since the last image or
+    # None if that isn't known. New pixels of the same size and mode are
+    # pasted into the photo images already on the canvas.
+    previous = self._img
+    self._img = img
+    if (img is None or previous is None or img.size != previous.size or img.mode != previous.mode
+        or img.mode not in POOLED_MODES or self._draft):
+      self._release_tiles(previous.mode if previous is not None else None, self._tile_cache.values())
+      self._tile_cache.clear()
+      self._clear_items()
+      return
+
+    self._repaint(dirty or (0, 0) + img.size)
+
+
+  def set_scale(self, scale_factor: float) -> None:
+    if scale_factor != self._scale_factor:
+      self._scale_factor = scale_factor
+      self._clear_items()
+
+
+  def set_draft(self, draft: bool) -> None:
+    # Draft tiles are a quick nearest neighbour resample shown while the user is zooming
+    if draft != self._draft:
+      self._draft = draft
+      self._clear_items()
+
+
+  def get_scaled_size(self) -> tuple[int, int]:
+    if self._img is None:
+      return (0, 0)
+
+    img_width, img_height = self._img.size
+    return (max(1, int(img_width * self._scale_factor)), max(1, int(img_height * self._scale_factor)))
+
+
+  def get_stats(self) -> dict:
+    return {'visible': len(self._items), 'cache': self._tile_cache.stats()}
+
+
+  def render(self) -> None:
+    if self._img is None:
+      return
+
+    # Work out which tiles intersect the visible part of the canvas
+    scaled_width, scaled_height = self.get_scaled_size()
+    left = max(0, int(self._canvas.canvasx(0)))
+    top = max(0, int(self._canvas.canvasy(0)))
+    right = min(scaled_width, left + self._canvas.winfo_width())
+    bottom = min(scaled_height, top + self._canvas.winfo_height())
+
+    visible = set()
+    for ty in range(top // self._tile_size, (max(top, bottom - 1) // self._tile_size) + 1):
+      for tx in range(left // self._tile_size, (max(left, right - 1) // self._tile_size) + 1):
+        visible.add((tx, ty))
+
+    # Drop the canvas items that scrolled out of view, their tiles stay cached
+    for key in [k for k in self._items if k not in visible]:
+      item, _ = self._items.pop(key)
+      self._canvas.itemconfig(item, state=tk.HIDDEN)
+      self._spare_items.append(item)
+
+    # Only create the tiles that aren't on the canvas yet, draft tiles are
+    # thrown away when the zoom settles so they aren't cached
+    for tx, ty in sorted(visible - self._items.keys()):
+      if self._draft:
+        tk_tile = self._create_photo_image(self._render_tile(tx, ty, scaled_width, scaled_height))
+      else:
+        tk_tile = self._tile_cache.get(
+          self._get_cache_key(tx, ty),
+          lambda: self._create_photo_image(self._render_tile(tx, ty, scaled_width, scaled_height)))
+
+      self._items[(tx, ty)] = (self._place_tile(tx, ty, tk_tile), tk_tile)
+
+
+  def get_memory_usage(self) -> int:
+    # Approximate bytes held by the cached and spare Tk tiles
+    tiles = self._tile_cache.values() + [photo for photos in self._spare_photos.values() for photo in photos]
+    return sum(tile.width() * tile.height() * 4 for tile in tiles)
+
+
+  def _get_cache_key(self, tx: int, ty: int) -> tuple:
+    return (round(self._scale_factor, 6), tx, ty)
+
+
+  def _place_tile(self, tx: int, ty: int, tk_tile: ImageTk.PhotoImage) -> int:
+    # Move a hidden item into place rather than creating a new one
+    x, y = tx * self._tile_size, ty * self._tile_size
+    if self._spare_items:
+      item = self._spare_items.pop()
+      with instrumentation.measure('move_image'):
+        self._canvas.coords(item, x, y)
+        self._canvas.itemconfig(item, image=tk_tile, state=tk.NORMAL)
+
+      return item
+
+    with instrumentation.measure('create_image'):
+      return self._canvas.create_image(x, y, anchor=tk.NW, image=tk_tile)
+
+
+  def _create_photo_image(self, tile: Image.Image) -> ImageTk.PhotoImage:
+    # Paste into a spare photo image of the same size, Tk keeps its buffer
+    spare = self._spare_photos.get((tile.mode, tile.size))
+    if spare:
+      tk_tile = spare.pop()
+      with instrumentation.measure('paste_image'):
+        tk_tile.paste(tile)
+
+      return tk_tile
+
+    with instrumentation.measure('photo_image'):
+      return ImageTk.PhotoImage(tile)
+
+
+  def _release_tiles(self, mode: Optional[str], tiles: list) -> None:
+    # Keep the photo images of stale tiles to paste the next tiles into
+    if mode not in POOLED_MODES:
+      return
+
+    spare_count = sum(len(photos) for photos in self._spare_photos.values())
+    for tk_tile in tiles[:max(0, self._max_spare_photos - spare_count)]:
+      self._spare_photos.setdefault((mode, (tk_tile.width(), tk_tile.height())), []).append(tk_tile)
+
+
+  def _repaint(self, dirty: tuple) -> None:
+    # The changed area in display pixels, grown by a pixel as resampling blends in the neighbours
+    scaled_width, scaled_height = self.get_scaled_size()
+    img_width, img_height = self._img.size
+    x0 = (dirty[0] - 1) * scaled_width / img_width
+    y0 = (dirty[1] - 1) * scaled_height / img_height
+    x1 = (dirty[2] + 1) * scaled_width / img_width
+    y1 = (dirty[3] + 1) * scaled_height / img_height
+
+    def is_dirty(tx: int, ty: int) -> bool:
+      tile_x, tile_y = tx * self._tile_size, ty * self._tile_size
+      return tile_x < x1 and tile_x + self._tile_size > x0 and tile_y < y1 and tile_y + self._tile_size > y0
+
+    # Cached tiles at this scale outside the change are still good, the tiles
+    # on screen are repainted in place and the rest become spares
+    scale_key = round(self._scale_factor, 6)
+    on_screen = {id(tk_tile) for _, tk_tile in self._items.values()}
+    kept, stale = [], []
+    for key, tk_tile in self._tile_cache.items():
+      if id(tk_tile) in on_screen or (key[0] == scale_key and not is_dirty(key[1], key[2])):
+        kept.append((key, tk_tile))
+      else:
+        stale.append(tk_tile)
+
+    self._tile_cache.clear()
+    for key, tk_tile in kept:
+      self._tile_cache.put(key, tk_tile)
+
+    self._release_tiles(self._img.mode, stale)
+
+    for (tx, ty), (_, tk_tile) in self._items.items():
+      if is_dirty(tx, ty):
+        with instrumentation.measure('paste_image'):
+          tk_tile.paste(self._render_tile(tx, ty, scaled_width, scaled_height))
+
+
+  def _render_tile(self, tx: int, ty: int, scaled_width: int, scaled_height: int) -> Image.Image:
+    # Tile bounds in display pixels, clipped at the right and bottom edges
+    x0, y0 = tx * self._tile_size, ty * self._tile_size
+    x1 = min(x0 + self._tile_size, scaled_width)
+    y1 = min(y0 + self._tile_size, scaled_height)
+
+    if self._scale_factor == 1.0:
+      return self._img.crop((x0, y0, x1, y1))
+
+    # The image is already at display resolution, the pipeline resamples it from
+    # its pyramid, so any other scale is a zoom in or a draft frame of the wheel
+    img_width, img_height = self._img.size
+    box = (
+      x0 * img_width / scaled_width,
+      y0 * img_height / scaled_height,
+      x1 * img_width / scaled_width,
+      y1 * img_height / scaled_height)
+
+    # Resample only the region behind this tile, the box lets the filter read
+    # the pixels around it so neighbouring tiles meet without seams
+    resample = Image.Resampling.NEAREST if self._draft else Image.Resampling.BILINEAR
+    with instrumentation.measure('resize_tile'):
+      return self._img.resize((x1 - x0, y1 - y0), resample, box=box)
+
+
+  def _clear_items(self) -> None:
+    # Hide the items for reuse, deleting and creating them costs more than moving them
+    for item, _ in self._items.values():
+      self._canvas.itemconfig(item, state=tk.HIDDEN)
+      self._spare_items.append(item)
+
+    self._items.clear()
@@ -0,0 +1,392 @@
+import argparse
+import ctypes
+import ctypes.util
+import os
+import select
+import signal
+import sqlite3
+import struct
+import sys
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Optional
+
+from batch_jobs import IMAGE_EXTENSIONS, init_worker, process_job
+from image_exporter import ExportOptions
+from result_cache import copy_file, get_profile_key, hash_file
+from watermark_engine import WatermarkSettings
+from watermark_profile import load_profile
+
+# inotify event flags, from <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+
+EVENT_HEADER = struct.Struct('iIII')
+
+
+def is_image_file(path: str) -> bool:
+  # Hidden files are usually temporary files still being copied
+  name = os.path.basename(path)
+  return not name.startswith('.') and name.lower().endswith(IMAGE_EXTENSIONS)
+
+
+def scan_images(input_dir: str, recursive: bool=True) -> list[str]:
+  images = []
+  for dir_path, dir_names, file_names in os.walk(input_dir):
+    if not recursive:
+      dir_names.clear()
+
+    dir_names[:] = sorted(name for name in dir_names if not name.startswith('.'))
+    images.extend(os.path.join(dir_path, name) for name in sorted(file_names) if is_image_file(name))
+
+  return images
+
+
+# POLLING WATCHER
+class PollingWatcher:
+  def __init__(self, input_dir: str, recursive: bool=True, interval: float=2.0):
+    self._input_dir = input_dir
+    self._recursive = recursive
+    self._interval = interval
+
+    # Files already there are reported by the first scan of the caller
+    self._last_scan = time.monotonic()
+    self._snapshot = self._scan()
+
+
+  def get_changes(self, timeout: float) -> set[str]:
+    # Rescan at most once per interval, reporting new and modified files
+    time.sleep(max(0.0, min(timeout, self._last_scan + self._interval - time.monotonic())))
+    if time.monotonic() - self._last_scan < self._interval:
+      return set()
+
+    self._last_scan = time.monotonic()
+    snapshot = self._scan()
+    changes = {path for path, key in snapshot.items() if self._snapshot.get(path) != key}
+    self._snapshot = snapshot
+    return changes
+
+
+  def close(self) -> None:
+    pass
+
+
+  def _scan(self) -> dict[str, tuple]:
+    snapshot = {}
+    for path in scan_images(self._input_dir, self._recursive):
+      try:
+        stat = os.stat(path)
+      except OSError:
+        continue
+
+      snapshot[path] = (stat.st_size, stat.st_mtime_ns)
+
+    return snapshot
+
+
+# INOTIFY WATCHER
+class InotifyWatcher:
+  def __init__(self, input_dir: str, recursive: bool=True):
+    self._input_dir = input_dir
+    self._recursive = recursive
+    self._libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+    self._fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+    if self._fd < 0:
+      raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+
+    # Watch descriptor -> directory
+    self._dirs = {}
+    self._add_tree(input_dir)
+
+
+  def get_changes(self, timeout: float) -> set[str]:
+    readable, _, _ = select.select([self._fd], [], [], timeout)
+    if not readable:
+      return set()
+
+    try:
+      data = os.read(self._fd, 64 * 1024)
+    except BlockingIOError:
+      return set()
+
+    changes = set()
+    offset = 0
+    while offset + EVENT_HEADER.size <= len(data):
+      wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+      name = data[offset + EVENT_HEADER.size:offset + EVENT_HEADER.size + length].rstrip(b'\0').decode(errors='surrogateescape')
+      offset += EVENT_HEADER.size + length
+
+      # Events were dropped, fall back to looking at everything
+      if mask & IN_Q_OVERFLOW:
+        changes.update(scan_images(self._input_dir, self._recursive))
+        continue
+
+      if wd not in self._dirs or not name:
+        continue
+
+      path = os.path.join(self._dirs[wd], name)
+      if mask & IN_ISDIR:
+        # Files copied in with a new directory may arrive before its watch
+        if self._recursive and mask & (IN_CREATE | IN_MOVED_TO) and not name.startswith('.'):
+          self._add_tree(path)
+          changes.update(scan_images(path, self._recursive))
+
+      elif is_image_file(path):
+        changes.add(path)
+
+    return changes
+
+
+  def close(self) -> None:
+    os.close(self._fd)
+
+
+  def _add_tree(self, top: str) -> None:
+    mask = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+    for dir_path, dir_names, _ in os.walk(top):
+      if not self._recursive and dir_path != top:
+        break
+
+      dir_names[:] = [name for name in dir_names if not name.startswith('.')]
+      wd = self._libc.inotify_add_watch(self._fd, os.fsencode(dir_path), mask)
+      if wd >= 0:
+        self._dirs[wd] = dir_path
+
+      if not self._recursive:
+        dir_names.clear()
+
+
+def create_watcher(input_dir: str, recursive: bool=True, interval: float=2.0, polling: bool=False):
+  if not polling and sys.platform.startswith('linux'):
+    try:
+      return InotifyWatcher(input_dir, recursive)
+    except (OSError, AttributeError):
+      pass
+
+  return PollingWatcher(input_dir, recursive, interval)
+
+
+# WATCH STATE
+class WatchState:
+  def __init__(self, db_file: str):
+    self._db = sqlite3.connect(db_file)
+    self._db.execute('PRAGMA journal_mode=WAL')
+    self._db.execute(
+      'CREATE TABLE IF NOT EXISTS files ('
+      'path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, digest TEXT, profile TEXT, output TEXT, processed_at REAL)')
+    self._db.execute('CREATE INDEX IF NOT EXISTS files_digest ON files (digest, profile)')
+    self._db.commit()
+
+
+  def is_unchanged(self, path: str, stat: os.stat_result, profile: str) -> bool:
+    # Same size and modification time means the file can be skipped without hashing it
+    row = self._db.execute('SELECT size, mtime_ns, profile FROM files WHERE path = ?', (path,)).fetchone()
+    return row is not None and row == (stat.st_size, stat.st_mtime_ns, profile)
+
+
+  def find_output(self, digest: str, profile: str) -> Optional[str]:
+    row = self._db.execute(
+      'SELECT output FROM files WHERE digest = ? AND profile = ? ORDER BY processed_at DESC LIMIT 1', (digest, profile)).fetchone()
+    return row[0] if row is not None else None
+
+
+  def mark_done(self, path: str, stat: os.stat_result, digest: str, profile: str, output: str) -> None:
+    self._db.execute(
+      'INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?)',
+      (path, stat.st_size, stat.st_mtime_ns, digest, profile, output, time.time()))
+    self._db.commit()
+
+
+  def close(self) -> None:
+    self._db.close()
+
+
+# WATCH FOLDER
+class WatchFolder:
+  def __init__(self, input_dir: str, output_dir: str, settings: WatermarkSettings, state: WatchState,
+               options: ExportOptions=ExportOptions(), watcher=None, settle: float=2.0,
+               workers: int=1, recursive: bool=True, verbose: bool=False, interval: float=2.0,
+               polling: bool=False):
+    self._input_dir = os.path.abspath(input_dir)
+    self._output_dir = os.path.abspath(output_dir)
+    self._state = state
+    self._profile = get_profile_key(settings, options)
+    self._watcher = watcher or create_watcher(self._input_dir, recursive, interval, polling)
+    self._settle = settle
+    self._recursive = recursive
+    self._verbose = verbose
+
+    # Files still being written: path -> (size, mtime, when it last changed)
+    self._pending: dict[str, tuple] = {}
+    self._running: dict[Future, tuple] = {}
+    self._executor = ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(settings, options))
+
+
+  def get_watcher_name(self) -> str:
+    return type(self._watcher).__name__
+
+
+  def run(self, stop: threading.Event, once: bool=False) -> None:
+    # Anything already in the folder is checked against the state database first
+    now = time.monotonic()
+    for path in scan_images(self._input_dir, self._recursive):
+      self._add_pending(path, now)
+
+    while not stop.is_set():
+      for path in self._watcher.get_changes(min(1.0, self._settle / 2)):
+        self._add_pending(path, time.monotonic())
+
+      self._check_pending()
+      self._collect_results()
+
+      if once and not self._pending and not self._running:
+        break
+
+
+  def close(self) -> None:
+    self._executor.shutdown(wait=True, cancel_futures=True)
+    self._collect_results()
+    self._watcher.close()
+
+
+  def _add_pending(self, path: str, changed: float) -> None:
+    # Absolute paths, so a watcher given a relative folder still has its
+    # events matched against the output folder and the state database
+    path = os.path.abspath(path)
+
+    # Skip our own output when it is written inside the watched folder
+    if not path.startswith(self._output_dir + os.sep):
+      self._pending[path] = (None, None, changed)
+
+
+  def _check_pending(self) -> None:
+    now = time.monotonic()
+    for path, (size, mtime_ns, changed) in list(self._pending.items()):
+      try:
+        stat = os.stat(path)
+      except OSError:
+        del self._pending[path]
+        continue
+
+      # Only pick a file up once it has stopped growing for the settle time
+      if (stat.st_size, stat.st_mtime_ns) != (size, mtime_ns):
+        self._pending[path] = (stat.st_size, stat.st_mtime_ns, now)
+
+      elif now - changed >= self._settle:
+        del self._pending[path]
+        self._submit(path, stat)
+
+
+  def _submit(self, path: str, stat: os.stat_result) -> None:
+    if self._state.is_unchanged(path, stat, self._profile):
+      return
+
+    output_file = os.path.join(self._output_dir, os.path.relpath(path, self._input_dir))
+    try:
+      digest = hash_file(path)
+    except OSError as e:
+      print(f'FAILED {path}: {e}', file=sys.stderr)
+      return
+
+    # The same content was already watermarked, e.g. a file copied in twice.
+    # A copy under another name gets a copy of that output instead of an encode.
+    previous_output = self._state.find_output(digest, self._profile)
+    if self._reuse_output(previous_output, output_file):
+      self._state.mark_done(path, stat, digest, self._profile, output_file)
+      if self._verbose:
+        print(f'{path} -> {output_file} (same as {previous_output})')
+
+      return
+
+    future = self._executor.submit(process_job, (path, output_file))
+    self._running[future] = (path, stat, digest)
+
+
+  def _reuse_output(self, previous_output: Optional[str], output_file: str) -> bool:
+    # The extension picks the output format, so only an output of the same type is reused
+    if previous_output is None or not os.path.exists(previous_output):
+      return False
+
+    if os.path.splitext(previous_output)[1].lower() != os.path.splitext(output_file)[1].lower():
+      return False
+
+    if previous_output != output_file:
+      try:
+        copy_file(previous_output, output_file)
+      except OSError:
+        return False
+
+    return True
+
+
+  def _collect_results(self) -> None:
+    for future in [future for future in self._running if future.done()]:
+      path, stat, digest = self._running.pop(future)
+      if future.cancelled():
+        continue
+
+      input_file, output_file, error, _ = future.result()
+      if error is not None:
+        print(f'FAILED {input_file}: {error}', file=sys.stderr)
+        continue
+
+      self._state.mark_done(path, stat, digest, self._profile, output_file)
+      if self._verbose:
+        print(f'{input_file} -> {output_file}')
+
+
+def _parse_args(argv: Optional[list[str]]=None) -> argparse.Namespace:
+  parser = argparse.ArgumentParser(description='Watch a directory and watermark images as they arrive')
+  parser.add_argument('input', help='directory to watch')
+  parser.add_argument('-o', '--output', required=True, help='directory to write the watermarked images to')
+  parser.add_argument('-p', '--profile', required=True, help='JSON watermark profile')
+  parser.add_argument('--state', help='state database, defaults to .watermark-state.db in the output directory')
+  parser.add_argument('--settle', type=float, default=2.0, help='seconds a file must stay unchanged before it is processed')
+  parser.add_argument('--poll', action='store_true', help='poll the directory instead of using inotify')
+  parser.add_argument('--interval', type=float, default=2.0, help='seconds between scans when polling')
+  parser.add_argument('--no-recursive', action='store_true', help='don\'t watch sub directories')
+  parser.add_argument('--once', action='store_true', help='process what is there and exit')
+  parser.add_argument('-q', '--quality', type=int, default=90, help='JPEG and WebP quality')
+  parser.add_argument('--strip-metadata', action='store_true', help='don\'t copy EXIF and ICC profiles to the output')
+  parser.add_argument('-w', '--workers', type=int, default=1, help='number of worker processes')
+  parser.add_argument('-v', '--verbose', action='store_true', help='print every processed file')
+  return parser.parse_args(argv)
+
+
+def main(argv: Optional[list[str]]=None) -> int:
+  args = _parse_args(argv)
+  settings = load_profile(args.profile)
+  options = ExportOptions(quality=args.quality, keep_exif=not args.strip_metadata, keep_icc=not args.strip_metadata)
+
+  os.makedirs(args.output, exist_ok=True)
+  state = WatchState(args.state or os.path.join(args.output, '.watermark-state.db'))
+  watch_folder = WatchFolder(
+    args.input, args.output, settings, state, options, settle=args.settle, workers=args.workers,
+    recursive=not args.no_recursive, verbose=args.verbose, interval=args.interval, polling=args.poll)
+
+  # Finish the files in flight on Ctrl+C or a service stop
+  stop = threading.Event()
+  signal.signal(signal.SIGINT, lambda *_: stop.set())
+  signal.signal(signal.SIGTERM, lambda *_: stop.set())
+
+  if args.verbose:
+    print(f'Watching {args.input} with {watch_folder.get_watcher_name()}', file=sys.stderr)
+
+  try:
+    watch_folder.run(stop, args.once)
+  finally:
+    watch_folder.close()
+    state.close()
+
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(main())
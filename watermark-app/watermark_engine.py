@@ -0,0 +1,242 @@
+import bisect
+import functools
+from dataclasses import dataclass
+from typing import Optional
+from PIL import Image, ImageColor
+
+from glyph_cache import GlyphCache, glyph_cache
+from image_exporter import ExportOptions, export_image, get_format
+from image_orientation import apply_orientation
+from result_cache import ResultCache, get_profile_key
+
+
+# WATERMARK SETTINGS
+@dataclass(frozen=True)
+class WatermarkSettings:
+  text: str = '@copyright'
+  font_file: Optional[str] = None
+  font_size: int = 20
+  colour: str = 'black'
+  margin: int = 10
+  opacity: float = 1.0
+  blend_mode: str = 'normal'
+  mode: str = 'single'
+  angle: float = 30.0
+  spacing: int = 100
+  placement: str = 'bottom-right'
+  relative_size: float = 0.0
+  font_family: Optional[str] = None
+  size_reference: str = 'width'
+  relative_margin: float = 0.0
+
+
+WATERMARK_MODES = ('single', 'pattern')
+
+# Kept here so checking a blend mode doesn't need NumPy
+BLEND_MODES = ('normal', 'multiply', 'screen', 'overlay')
+
+# What a relative size or margin is a percentage of
+SIZE_REFERENCES = ('width', 'short_edge')
+
+# Relative font sizes snap to this table, about 4% apart, so images of similar
+# sizes share one rendered tile instead of rasterising the text for each
+SIZE_BUCKETS = tuple(sorted({round(6 * 1.04 ** step) for step in range(150)}))
+
+PLACEMENTS = ('top-left', 'top', 'top-right', 'left', 'center', 'right', 'bottom-left', 'bottom', 'bottom-right')
+
+
+def get_watermark_position(img_size: tuple, text_box: tuple, margin: int=10, placement: str='bottom-right') -> tuple:
+  # Line the text box up with an edge or the centre of the image, inset by the margin
+  if placement not in PLACEMENTS:
+    raise ValueError(f'Unknown placement {placement!r}, expected one of {PLACEMENTS}')
+
+  img_width, img_height = img_size
+  left, top, right, bottom = text_box
+  vertical, horizontal = placement.split('-') if '-' in placement else (placement, placement)
+
+  if horizontal == 'left':
+    x = margin - left
+  elif horizontal == 'right':
+    x = img_width - right - margin
+  else:
+    x = (img_width - (right - left)) // 2 - left
+
+  if vertical == 'top':
+    y = margin - top
+  elif vertical == 'bottom':
+    y = img_height - bottom - margin
+  else:
+    y = (img_height - (bottom - top)) // 2 - top
+
+  return (x, y)
+
+
+def get_bucket_size(font_size: float) -> int:
+  # The nearest size in the table, sizes outside it are used as they are
+  if not SIZE_BUCKETS[0] < font_size < SIZE_BUCKETS[-1]:
+    return max(1, round(font_size))
+
+  index = bisect.bisect_left(SIZE_BUCKETS, font_size)
+  if index > 0 and font_size - SIZE_BUCKETS[index - 1] <= SIZE_BUCKETS[index] - font_size:
+    index -= 1
+
+  return SIZE_BUCKETS[index]
+
+
+def get_reference_length(settings: WatermarkSettings, img_size: tuple) -> int:
+  return min(img_size) if settings.size_reference == 'short_edge' else img_size[0]
+
+
+def get_font_size(settings: WatermarkSettings, img_size: tuple) -> int:
+  # A relative size is a percentage of the image, so it looks the same at any resolution
+  if settings.relative_size > 0:
+    return get_bucket_size(get_reference_length(settings, img_size) * settings.relative_size / 100)
+
+  return settings.font_size
+
+
+def get_margin(settings: WatermarkSettings, img_size: tuple) -> int:
+  if settings.relative_margin > 0:
+    return round(get_reference_length(settings, img_size) * settings.relative_margin / 100)
+
+  return settings.margin
+
+
+def paste_tile(img: Image.Image, tile: Image.Image, position: tuple) -> None:
+  # Clip the tile to the image, alpha_composite won't take negative offsets
+  left, top = position
+  crop_left, crop_top = max(0, -left), max(0, -top)
+  crop_right = min(tile.width, img.width - left)
+  crop_bottom = min(tile.height, img.height - top)
+  if crop_right <= crop_left or crop_bottom <= crop_top:
+    return
+
+  if (crop_left, crop_top, crop_right, crop_bottom) != (0, 0, tile.width, tile.height):
+    tile = tile.crop((crop_left, crop_top, crop_right, crop_bottom))
+
+  dest = (left + crop_left, top + crop_top)
+  if img.mode == 'RGBA':
+    img.alpha_composite(tile, dest)
+  else:
+    img.paste(tile, dest, tile)
+
+
+def add_watermark(img: Image.Image, text: str, font_file: Optional[str], font_size: int, colour: str,
+                  margin: int=10, opacity: float=1.0, blend_mode: str='normal', placement: str='bottom-right',
+                  cache: GlyphCache=glyph_cache) -> Image.Image:
+  rendered = cache.get_text(text, font_file, font_size, colour)
+  x, y = get_watermark_position(img.size, rendered.text_box, margin, placement)
+  position = (x + rendered.text_box[0], y + rendered.text_box[1])
+
+  # Opaque normal text is a plain paste of the cached tile
+  if opacity >= 1.0 and blend_mode == 'normal':
+    paste_tile(img, rendered.tile, position)
+
+  else:
+    # NumPy is only needed for blended watermarks
+    import compositing
+    compositing.composite(img, rendered.mask, ImageColor.getrgb(colour), position, blend_mode, opacity)
+
+  return img
+
+
+@functools.lru_cache(maxsize=32)
+def get_pattern_offsets(img_size: tuple, tile_size: tuple, spacing: int) -> tuple:
+  # Grid of tile positions covering the image, every other row shifted by half a step
+  img_width, img_height = img_size
+  tile_width, tile_height = tile_size
+  step_x = tile_width + max(0, spacing)
+  step_y = tile_height + max(0, spacing)
+
+  offsets = []
+  for row, y in enumerate(range(-(step_y // 2), img_height, step_y)):
+    shift = step_x // 2 if row % 2 else 0
+    offsets.extend((x, y) for x in range(-shift, img_width, step_x))
+
+  return tuple(offsets)
+
+
+def add_watermark_pattern(img: Image.Image, text: str, font_file: Optional[str], font_size: int, colour: str,
+                          angle: float=30.0, spacing: int=100, opacity: float=1.0, blend_mode: str='normal',
+                          cache: GlyphCache=glyph_cache) -> Image.Image:
+  # The text is rendered and rotated once, then stamped across the grid
+  rendered = cache.get_rotated_text(text, font_file, font_size, colour, angle)
+  offsets = get_pattern_offsets(img.size, rendered.tile.size, spacing)
+
+  if blend_mode == 'normal':
+    tile = rendered.tile
+    if opacity < 1.0:
+      tile = tile.copy()
+      tile.putalpha(rendered.mask.point(lambda v: round(v * opacity)))
+
+    for position in offsets:
+      paste_tile(img, tile, position)
+
+  else:
+    # Blend each stamp's own region, a full frame mask would touch every pixel.
+    # The spacing keeps the stamps from overlapping.
+    import compositing
+    rgb = ImageColor.getrgb(colour)
+    for position in offsets:
+      compositing.composite(img, rendered.mask, rgb, position, blend_mode, opacity)
+
+  return img
+
+
+def apply_settings(img: Image.Image, settings: WatermarkSettings) -> Image.Image:
+  font_size = get_font_size(settings, img.size)
+  if settings.mode == 'pattern':
+    return add_watermark_pattern(img, settings.text, settings.font_file, font_size, settings.colour,
+                                 settings.angle, settings.spacing, settings.opacity, settings.blend_mode)
+
+  return add_watermark(img, settings.text, settings.font_file, font_size, settings.colour,
+                       get_margin(settings, img.size), settings.opacity, settings.blend_mode, settings.placement)
+
+
+def get_watermark_box(img_size: tuple, settings: WatermarkSettings, cache: GlyphCache=glyph_cache) -> tuple:
+  # The part of the image apply_settings draws on, a pattern covers all of it
+  if settings.mode == 'pattern':
+    return (0, 0) + tuple(img_size)
+
+  rendered = cache.get_text(settings.text, settings.font_file, get_font_size(settings, img_size), settings.colour)
+  x, y = get_watermark_position(img_size, rendered.text_box, get_margin(settings, img_size), settings.placement)
+  left, top = x + rendered.text_box[0], y + rendered.text_box[1]
+  return (
+    max(0, left),
+    max(0, top),
+    min(img_size[0], left + rendered.tile.width),
+    min(img_size[1], top + rendered.tile.height))
+
+
+def prepare_image(img: Image.Image) -> Image.Image:
+  # Palette and greyscale images can't take a coloured watermark
+  if img.mode in ('RGB', 'RGBA'):
+    return img
+
+  has_alpha = img.mode in ('LA', 'PA') or 'transparency' in img.info
+  return img.convert('RGBA' if has_alpha else 'RGB')
+
+
+def watermark_file(input_file: str, output_file: str, settings: WatermarkSettings,
+                   options: ExportOptions=ExportOptions(), cache: Optional[ResultCache]=None) -> bool:
+  # Returns False when the result came from the cache and nothing was encoded
+  if cache is not None:
+    # The same input saved as PNG and as WebP are two different results
+    profile_key = get_profile_key(settings, options, get_format(output_file, options))
+    key = cache.get_key(cache.get_input_digest(input_file), profile_key)
+    if cache.lookup(key, output_file):
+      return False
+
+  with Image.open(input_file) as img:
+    # Turn the pixels upright, the tag is dropped from the EXIF that is copied over
+    apply_orientation(img)
+    exif = img.info.get('exif')
+    icc_profile = img.info.get('icc_profile')
+    img = prepare_image(img)
+    apply_settings(img, settings)
+    export_image(img, output_file, options, exif, icc_profile)
+
+  if cache is not None:
+    cache.store(key, output_file)
+
+  return True
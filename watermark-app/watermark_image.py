@@ -1,15 +1,29 @@
 import tkinter as tk
-from PIL import ImageTk, Image
+from PIL import Image
+
+from image_orientation import apply_orientation
+from image_store import ImageStore, image_store
 
 class WatermarkImage:
-  # PIL Image objects used for processing
-  _original_img = None
-  _watermarked_img = None
-  
-  # Tkinter Image objects used for displaying the image
-  _tk_img = None
-
-  def __init__(self, root_window: tk.Tk, image_file: str):
-    self._original_img = Image.open(image_file)
-    self._watermarked_img = self._original_img.copy()
-    self._tk_img = ImageTk.PhotoImage(self._original_img)
+  # A decoded image waiting to be shown, the watermark and other edits are
+  # replayed on top of it by the image container's edit pipeline
+  def __init__(self, root_window: tk.Tk, image_file: str, store: ImageStore=image_store):
+    self._root_window = root_window
+    self._image_file = image_file
+    self._store = store
+
+    # The original lives in the store, pinned and shared with the edit pipeline
+    original_img = apply_orientation(Image.open(image_file))
+    self._store.add((self, 'original'), original_img, pinned=True)
+
+
+  def get_file(self) -> str:
+    return self._image_file
+
+
+  def get_original_image(self) -> Image.Image:
+    return self._store.get((self, 'original'))
+
+
+  def close(self) -> None:
+    self._store.remove_where(lambda key: isinstance(key, tuple) and key[0] is self)
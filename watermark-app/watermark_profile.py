@@ -0,0 +1,119 @@
+import dataclasses
+import functools
+import json
+import os
+import typing
+from typing import Optional
+
+from font_index import FontIndex
+from glyph_cache import GlyphCache, glyph_cache
+from watermark_engine import (BLEND_MODES, PLACEMENTS, SIZE_REFERENCES, WATERMARK_MODES, WatermarkSettings,
+                              get_font_size)
+
+PROFILE_VERSION = 1
+PROFILE_FIELDS = tuple(field.name for field in dataclasses.fields(WatermarkSettings))
+
+
+def _get_json_types(annotation) -> tuple:
+  # JSON has no separate float type for whole numbers, so a float field takes an int too
+  if annotation is float:
+    return (int, float)
+
+  if typing.get_origin(annotation) is typing.Union:
+    return tuple(t for arg in typing.get_args(annotation) for t in _get_json_types(arg))
+
+  return (annotation,)
+
+
+# The types each field may have in a profile file
+PROFILE_TYPES = {field.name: _get_json_types(field.type) for field in dataclasses.fields(WatermarkSettings)}
+
+# Only built if a profile's font file is missing, e.g. one saved on another machine
+_font_index: Optional[FontIndex] = None
+
+
+def validate_profile(settings: WatermarkSettings) -> None:
+  if settings.mode not in WATERMARK_MODES:
+    raise ValueError(f'Unknown mode {settings.mode!r}, expected one of {WATERMARK_MODES}')
+
+  if settings.blend_mode not in BLEND_MODES:
+    raise ValueError(f'Unknown blend mode {settings.blend_mode!r}, expected one of {BLEND_MODES}')
+
+  if settings.placement not in PLACEMENTS:
+    raise ValueError(f'Unknown placement {settings.placement!r}, expected one of {PLACEMENTS}')
+
+  if not 0.0 <= settings.opacity <= 1.0:
+    raise ValueError(f'Opacity must be between 0 and 1, got {settings.opacity!r}')
+
+  if settings.size_reference not in SIZE_REFERENCES:
+    raise ValueError(f'Unknown size reference {settings.size_reference!r}, expected one of {SIZE_REFERENCES}')
+
+  if settings.font_size < 1 or settings.relative_size < 0:
+    raise ValueError('The font size must be positive')
+
+  if settings.margin < 0 or settings.relative_margin < 0:
+    raise ValueError('The margin can\'t be negative')
+
+
+def save_profile(settings: WatermarkSettings, filename: str) -> None:
+  validate_profile(settings)
+  profile = {'version': PROFILE_VERSION, **dataclasses.asdict(settings)}
+  with open(filename, 'w') as f:
+    json.dump(profile, f, indent=2)
+
+
+def load_profile(filename: str) -> WatermarkSettings:
+  # Fields left out of the file keep their defaults
+  with open(filename) as f:
+    profile = json.load(f)
+
+  if not isinstance(profile, dict):
+    raise ValueError(f'{filename} is not a watermark profile')
+
+  version = profile.pop('version', PROFILE_VERSION)
+  if version > PROFILE_VERSION:
+    raise ValueError(f'{filename} needs a newer version of the app (profile version {version})')
+
+  unknown = set(profile) - set(PROFILE_FIELDS)
+  if unknown:
+    raise ValueError(f'Unknown profile fields {", ".join(sorted(unknown))} in {filename}')
+
+  # Catch hand edited values like "opacity": "50" here, not halfway through rendering
+  for name, value in profile.items():
+    types = PROFILE_TYPES[name]
+    if isinstance(value, bool) or not isinstance(value, types):
+      expected = ' or '.join('null' if t is type(None) else t.__name__ for t in types)
+      raise ValueError(f'{name} must be {expected}, got {value!r} in {filename}')
+
+  settings = WatermarkSettings(**profile)
+  validate_profile(settings)
+  return settings
+
+
+@functools.lru_cache(maxsize=32)
+def resolve_profile(settings: WatermarkSettings) -> WatermarkSettings:
+  # Resolved once per profile, not once per image
+  global _font_index
+  if settings.font_file is None or os.path.exists(settings.font_file) or settings.font_family is None:
+    return settings
+
+  if _font_index is None:
+    _font_index = FontIndex()
+
+  return dataclasses.replace(settings, font_file=_font_index.get_font_path(settings.font_family))
+
+
+def prepare_profile(settings: WatermarkSettings, img_size: Optional[tuple]=None,
+                    cache: GlyphCache=glyph_cache) -> WatermarkSettings:
+  # Resolve the font and render the text up front, so every image after the first reuses the tile
+  settings = resolve_profile(settings)
+  if settings.relative_size > 0 and img_size is None:
+    return settings
+
+  font_size = get_font_size(settings, img_size or (0, 0))
+  if settings.mode == 'pattern':
+    cache.get_rotated_text(settings.text, settings.font_file, font_size, settings.colour, settings.angle)
+  else:
+    cache.get_text(settings.text, settings.font_file, font_size, settings.colour)
+
+  return settings